@@ -91,6 +91,9 @@ def run_api(bridge, port: int):
             json_gadget = gadget.serialized()
             out_gadget_list.append(json_gadget)
 
+        # Gadgets of clients handled by the other shards of a sharded bridge
+        out_gadget_list += bridge.get_remote_gadgets()
+
         buf_res = {"gadgets": out_gadget_list,
                    "gadget_count": len(out_gadget_list)}
 
@@ -115,6 +118,9 @@ def run_api(bridge, port: int):
             json_client = client.serialized()
             out_client_list.append(json_client)
 
+        # Clients handled by the other shards of a sharded bridge
+        out_client_list += bridge.get_remote_clients()
+
         buf_res = {"clients": out_client_list,
                    "client_count": len(out_client_list)}
 
@@ -141,9 +147,9 @@ def run_api(bridge, port: int):
                    "software_commit": bridge.get_sw_commit(),
                    "software_branch": bridge.get_sw_branch(),
                    "running_since": bridge.get_time_launched().strftime("%Y-%m-%d %H:%M:%S"),
-                   "gadget_count": len(gadget_list),
+                   "gadget_count": len(gadget_list) + len(bridge.get_remote_gadgets()),
                    "connector_count": len(connector_list),
-                   "client_count": len(client_list),
+                   "client_count": len(client_list) + len(bridge.get_remote_clients()),
                    "platformio_version": bridge.get_host_pio_version(),
                    "python_version": bridge.get_host_python_version(),
                    "pipenv_version": bridge.get_host_pipenv_version(),
@@ -0,0 +1,113 @@
+from async_network_connector import AsyncNetworkConnector, Request
+from mqtt_connector import decode_mqtt_message, get_mqtt_frame_size, disconnect_callback, get_scoped_topic, \
+    get_request_path, get_subscriptions
+from typing import Optional
+import paho.mqtt.client as mqtt
+
+
+class AsyncMQTTConnector(AsyncNetworkConnector):
+    """Class to implement an asyncio MQTT connection module"""
+
+    __client: mqtt.Client
+    __own_name: str
+    __ip: str
+    __port: int
+
+    __mqtt_username: Optional[str]
+    __mqtt_password: Optional[str]
+
+    # Names to receive requests for in the scoped topic scheme, None to receive everything published
+    __scoped_receivers: Optional[list]
+
+    # Clients subscribed to the scoped topic scheme, requests to them are published on their scoped topics
+    __scoped_clients: set
+
+    # Clients known to send their bodies as python repr instead of JSON
+    __repr_compat_clients: set
+
+    _max_frame_size = 256 * 1024
+
+    _binary_transport = True
+
+    def __init__(self, own_name: str, mqtt_ip: str, mqtt_port: int, mqtt_user: Optional[str] = None,
+                 mqtt_pw: Optional[str] = None, scoped_receivers: Optional[list] = None):
+        super().__init__(own_name)
+        self.__own_name = own_name
+        self.__client = mqtt.Client(self.__own_name)
+        self.__ip = mqtt_ip
+        self.__port = mqtt_port
+        self.__mqtt_username = mqtt_user
+        self.__mqtt_password = mqtt_pw
+        self.__scoped_receivers = scoped_receivers
+        self.__scoped_clients = set()
+        self.__repr_compat_clients = set()
+
+        if self.__mqtt_username and self.__mqtt_password:
+            self.__client.username_pw_set(self.__mqtt_username, self.__mqtt_password)
+
+        self.__client.on_message = self.__on_message
+        self.__client.on_disconnect = disconnect_callback
+        self.__client.on_connect = self.__on_connect
+
+        try:
+            # Connection is established by the network loop thread without blocking the event loop
+            self.__client.connect_async(self.__ip, self.__port, 10)
+            self.__client.loop_start()
+        except (OSError, ConnectionRefusedError) as err:
+            print(f"Could not connect to MQTT Server: {err}")
+
+    def __on_connect(self, client, userdata, flags, reason_code, properties=None):
+        """Callback for the mqtt network loop thread, subscribes once the connection is established"""
+
+        print("MQTT connected.")
+        self.__client.subscribe([(topic, 0) for topic in get_subscriptions(self.__scoped_receivers)])
+
+    def __on_message(self, client, userdata, message):
+        """Callback for the mqtt network loop thread"""
+
+        inc_req = decode_mqtt_message(get_request_path(message.topic), message.payload, self._validate_body,
+                                      self.__repr_compat_clients)
+        if inc_req is not None:
+            self._deliver_threadsafe(inc_req)
+
+    def __get_topic(self, req: Request) -> str:
+        """Returns the topic to publish the request on"""
+
+        if req.get_receiver() in self.__scoped_clients:
+            return get_scoped_topic(req.get_path(), req.get_receiver())
+        return req.get_path()
+
+    def _get_frame_size(self, req: Request) -> int:
+        return get_mqtt_frame_size(self.__get_topic(req), self._encode_body(req))
+
+    async def _send_data(self, req: Request):
+        # Publishing only queues the message for the network loop thread
+        self.__client.publish(self.__get_topic(req), self._encode_body(req))
+
+    def set_client_scoped_topics(self, client_name: str, scoped: bool):
+        """Sets whether the client is subscribed to the scoped topic scheme"""
+
+        if scoped:
+            self.__scoped_clients.add(client_name)
+        else:
+            self.__scoped_clients.discard(client_name)
+
+    def get_client_scoped_topics(self, client_name: str) -> bool:
+        """Returns whether requests to the client are published on its scoped topics"""
+
+        return client_name in self.__scoped_clients
+
+    def set_client_repr_compat(self, client_name: str, enabled: bool):
+        """Sets whether bodies sent by the client as python repr instead of JSON are accepted"""
+
+        if enabled:
+            self.__repr_compat_clients.add(client_name)
+        else:
+            self.__repr_compat_clients.discard(client_name)
+
+    def connected(self) -> bool:
+        return self.__client.is_connected()
+
+    async def close(self):
+        self.__client.disconnect()
+        self.__client.loop_stop()
@@ -0,0 +1,192 @@
+"""Module to contain the asyncio counterpart of the network connector prototype"""
+import asyncio
+from request import Request
+from connector_base import ConnectorBase
+from split_requests import is_window_ack
+from network_connector import Req_Response
+from typing import Optional
+
+
+class AsyncNetworkConnector(ConnectorBase):
+    """Class to implement an asyncio network interface prototype"""
+
+    _loop: asyncio.AbstractEventLoop
+    _message_queue: asyncio.Queue
+
+    # Lists of requests waiting for their responses together with the futures receiving them, identified by their
+    # session id
+    _pending_responses: dict
+
+    # Queues collecting the responses to sent broadcasts, identified by their session id
+    _broadcast_responses: dict
+
+    # Tasks sending window acknowledgements, referenced until they are done
+    __ack_tasks: set
+
+    def __init__(self, own_name: Optional[str] = None):
+        """Constructor for the connector, has to be called from within a running event loop"""
+
+        super().__init__(own_name)
+        self._loop = asyncio.get_running_loop()
+        self.__ack_tasks = set()
+        self._message_queue = asyncio.Queue()
+        self._pending_responses = {}
+        self._broadcast_responses = {}
+
+    async def _send_data(self, req: Request):
+        print(f"Not implemented: '_send_data'")
+
+    def _deliver_threadsafe(self, req: Request):
+        """Hands a request received on a foreign thread (mqtt loop, serial reader) over to the event loop"""
+
+        self._loop.call_soon_threadsafe(self._process_received_request, req)
+
+    def _process_received_request(self, received_request: Request):
+        """Reassembles split requests and hands them to a waiting sender or the message queue"""
+
+        buf_req, window_ack = self._add_to_split_buffer(received_request)
+        if buf_req is None:
+            if window_ack is not None:
+                task = self._loop.create_task(self._send_data(window_ack))
+                self.__ack_tasks.add(task)
+                task.add_done_callback(self.__ack_tasks.discard)
+            return
+
+        session_id = buf_req.get_session_id()
+
+        if buf_req.get_path() == "smarthome/broadcast/res" and session_id in self._broadcast_responses:
+            self._broadcast_responses[session_id].put_nowait(buf_req)
+            return
+
+        res_future = self.__pop_pending_response(buf_req)
+        if res_future is not None:
+            res_future.set_result(buf_req)
+            return
+
+        self._message_queue.put_nowait(buf_req)
+
+    def __pop_pending_response(self, res: Request) -> Optional[asyncio.Future]:
+        """Removes and returns the future of the oldest pending request the passed request responds to"""
+
+        pending_list: Optional[list] = self._pending_responses.get(res.get_session_id())
+        if not pending_list:
+            return None
+        for pending in pending_list:
+            out_req, res_future = pending
+            if res.get_sender() != out_req.get_sender() and not res_future.done():
+                self.__remove_pending_response(pending)
+                return res_future
+        return None
+
+    def __remove_pending_response(self, pending: tuple):
+        session_id = pending[0].get_session_id()
+        pending_list: Optional[list] = self._pending_responses.get(session_id)
+        if pending_list and pending in pending_list:
+            pending_list.remove(pending)
+            if not pending_list:
+                del self._pending_responses[session_id]
+
+    async def get_request(self, timeout: Optional[float] = None) -> Optional[Request]:
+        """Waits up to 'timeout' seconds for a request and returns it. Waits forever if 'timeout' is None."""
+
+        try:
+            return await asyncio.wait_for(self._message_queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def requests(self, timeout: Optional[float] = None):
+        """Yields the received requests until there was none for 'timeout' seconds. Runs forever if it is None."""
+
+        while True:
+            req = await self.get_request(timeout)
+            if req is None:
+                return
+            yield req
+
+    async def send_request(self, req: Request, timeout: int = 6) -> Req_Response:
+        """
+        Sends a request and waits for a response by default.
+
+        Returns the Ack-Status of the response and the response itself.
+        """
+        if timeout <= 0:
+            await self._send_data(req)
+            return None, None
+
+        pending = (req, self._loop.create_future())
+        self._pending_responses.setdefault(req.get_session_id(), []).append(pending)
+        try:
+            await self._send_data(req)
+            res: Request = await asyncio.wait_for(pending[1], timeout)
+            return res.get_ack(), res
+        except asyncio.TimeoutError:
+            return None, None
+        finally:
+            self.__remove_pending_response(pending)
+
+    async def iter_broadcast(self, req: Request, timeout: float = 5, expected_count: Optional[int] = None,
+                             quiet_period: Optional[float] = None):
+        """Sends a broadcast and yields the responses as they arrive, see NetworkConnector.iter_broadcast"""
+
+        session_id = req.get_session_id()
+        responses = asyncio.Queue()
+        self._broadcast_responses[session_id] = responses
+        try:
+            await self._send_data(req)
+            timeout_time = self._loop.time() + timeout
+            res_count = 0
+            while expected_count is None or res_count < expected_count:
+                wait_until = timeout_time
+                if quiet_period is not None and res_count > 0:
+                    wait_until = min(timeout_time, self._loop.time() + quiet_period)
+                try:
+                    res = await asyncio.wait_for(responses.get(), max(wait_until - self._loop.time(), 0))
+                except asyncio.TimeoutError:
+                    return
+                res_count += 1
+                yield res
+        finally:
+            del self._broadcast_responses[session_id]
+
+    async def send_broadcast(self, req: Request, timeout: float = 5, expected_count: Optional[int] = None,
+                             quiet_period: Optional[float] = None) -> [Request]:
+        """Sends a broadcast and returns the responses, see NetworkConnector.iter_broadcast"""
+
+        return [res async for res in self.iter_broadcast(req, timeout, expected_count, quiet_period)]
+
+    async def send_request_split(self, req: Request, part_max_size: Optional[int] = None, timeout: int = 6,
+                                 window_retries: int = 3) -> Req_Response:
+        """Splits the request into parts and sends them in windows, see NetworkConnector.send_request_split"""
+
+        plan = self._plan_split(req, part_max_size)
+        if plan is None:
+            return False, None
+        windows, last_part, settings = plan
+
+        for window in windows:
+            if not settings.window_acks:
+                for payload_part in window:
+                    await self._send_data(payload_part)
+                await asyncio.sleep(self._get_window_pause(settings, window))
+                continue
+
+            for _ in range(window_retries):
+                for payload_part in window[:-1]:
+                    await self._send_data(payload_part)
+                _, res = await self.send_request(window[-1], timeout)
+                if is_window_ack(res, window[-1]):
+                    break
+            else:
+                print("Window of split request was not acknowledged")
+                return None, None
+
+        return await self.send_request(last_part, timeout)
+
+    def connected(self) -> bool:
+        print("!!Not implemented!!")
+        return False
+
+    async def close(self):
+        """Closes the underlying connection"""
+
+        pass
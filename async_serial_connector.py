@@ -0,0 +1,104 @@
+from async_network_connector import AsyncNetworkConnector, Request
+from serial_connector import encode_serial_request
+from serial_frame_parser import SerialFrameParser
+from serial_capture import CaptureWriter, open_serial_port, DIRECTION_RX, DIRECTION_TX
+from typing import Optional
+from threading import Thread
+import serial
+
+
+class AsyncSerialConnector(AsyncNetworkConnector):
+    """Class to implement an asyncio serial connection module"""
+
+    __client: serial.Serial
+    __own_name: str
+    __baud_rate: int
+    __port: str
+    __connected: bool
+    __parser: SerialFrameParser
+
+    # Thread reading from the port until the connector is closed
+    __reader_thread: Thread
+    __running: bool = False
+
+    # Writer recording the traffic of the port, None if it is not recorded
+    __capture: Optional[CaptureWriter] = None
+
+    # Size of the default uart receive buffer of the ESP32, longer lines risk getting cut off
+    _max_frame_size = 256
+
+    def __init__(self, own_name: str, port: str, baudrate: int, capture_path: Optional[str] = None):
+        super().__init__(own_name)
+        self.__own_name = own_name
+        self.__baud_rate = baudrate
+        self.__port = port
+        self.__connected = False
+        self.__parser = SerialFrameParser(self._validate_body)
+        try:
+            # Accepts pyserial urls like 'loop://' and capture replays besides device paths.
+            # The short timeout only lets the reader thread notice the connector being closed.
+            self.__client = open_serial_port(self.__port, self.__baud_rate, 0.1)
+            self.__connected = True
+        except serial.serialutil.SerialException:
+            print(f"Could not connect to '{self.__port}'")
+            return
+        if capture_path is not None:
+            self.__capture = CaptureWriter(capture_path)
+
+        self.__running = True
+        self.__reader_thread = Thread(target=self.__read_serial, daemon=True)
+        self.__reader_thread.start()
+
+    def __read_serial(self):
+        """Reads from the serial port and hands the contained requests over to the event loop"""
+
+        while self.__running:
+            try:
+                data = self.__client.read(max(1, self.__client.in_waiting))
+            except (FileNotFoundError, serial.serialutil.SerialException):
+                if self.__running:
+                    print("Lost connection to serial port")
+                self.__connected = False
+                return
+            if not data:
+                continue
+            if self.__capture is not None:
+                self.__capture.write(DIRECTION_RX, data)
+            for item in self.__parser.feed(data):
+                if isinstance(item, Request):
+                    self._deliver_threadsafe(item)
+                elif item.startswith(b"Backtrace: 0x"):
+                    print("Client crashed with {}".format(item.decode(errors="replace").rstrip("\r\n")))
+
+    def set_request_validation(self, mode: str):
+        super().set_request_validation(mode)
+        self.__parser.set_body_validator(self._validate_body)
+
+    def _get_frame_size(self, req: Request) -> int:
+        return len(encode_serial_request(req, self._encode_body(req)))
+
+    def _get_link_rate(self) -> Optional[float]:
+        # Every byte takes a start and a stop bit on the uart
+        return self.__baud_rate / 10
+
+    async def _send_data(self, req: Request):
+        data = encode_serial_request(req, self._encode_body(req))
+        if self.__capture is not None:
+            self.__capture.write(DIRECTION_TX, data)
+        # Writing may block until the bytes are out, so it is done outside of the event loop
+        await self._loop.run_in_executor(None, self.__client.write, data)
+
+    def connected(self) -> bool:
+        return self.__connected
+
+    async def close(self):
+        if not self.__running:
+            return
+        self.__running = False
+        # The reader notices the closed connector within the read timeout of the port
+        await self._loop.run_in_executor(None, self.__reader_thread.join)
+        self.__client.close()
+        self.__connected = False
+        if self.__capture is not None:
+            self.__capture.close()
+        print(f"Closing Serial Connection to '{self.__port}@{self.__baud_rate}'")
@@ -0,0 +1,71 @@
+"""Module to remember the serial baudrates the chips can be reached with"""
+import json
+from threading import Lock
+from time import monotonic
+from typing import Optional
+
+# File the bridge and the serial port pool remember the baudrates of the chips in
+BAUDRATE_MEMORY_PATH = "baudrates.json"
+
+
+class BaudrateMemory:
+    """Class to store the highest baudrate negotiated with every chip, optionally persisted to a json file"""
+
+    __path: Optional[str]
+
+    # Highest working baudrate of every chip and the monotonic time it expires at, None if it does not expire.
+    # Identified by the chip name.
+    __rates: dict
+    __lock: Lock
+
+    def __init__(self, path: Optional[str] = None):
+        self.__path = path
+        self.__rates = {}
+        self.__lock = Lock()
+        if path is None:
+            return
+        try:
+            with open(path, "r") as f:
+                self.__rates = {str(chip): (int(rate), None) for chip, rate in json.load(f).items()}
+        except (IOError, ValueError, AttributeError):
+            pass
+
+    def get(self, chip_id: str) -> Optional[int]:
+        """Returns the highest baudrate the chip was reached with, None if it was never negotiated or expired"""
+
+        with self.__lock:
+            entry = self.__rates.get(chip_id)
+            if entry is None:
+                return None
+            baudrate, expires = entry
+            if expires is not None and monotonic() >= expires:
+                del self.__rates[chip_id]
+                return None
+            return baudrate
+
+    def set(self, chip_id: str, baudrate: int, ttl: Optional[float] = None):
+        """Saves the baudrate for the chip. Rates with a 'ttl' are forgotten after that many seconds and not saved."""
+
+        with self.__lock:
+            self.__rates[chip_id] = (baudrate, monotonic() + ttl if ttl is not None else None)
+            self.__save()
+
+    def forget(self, chip_id: str):
+        with self.__lock:
+            self.__rates.pop(chip_id, None)
+            self.__save()
+
+    def __save(self):
+        """Writes the rates that don't expire to the file. Needs '__lock'."""
+
+        if self.__path is None:
+            return
+        try:
+            with open(self.__path, "w") as f:
+                json.dump({chip: rate for chip, (rate, expires) in self.__rates.items() if expires is None}, f)
+        except IOError:
+            print(f"Could not save the baudrates to '{self.__path}'")
+
+
+# Memory shared by all serial connectors of the process
+DEFAULT_BAUDRATE_MEMORY = BaudrateMemory()
@@ -0,0 +1,62 @@
+"""Benchmark for the latency of decoding a received mqtt message, compares the validation modes"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from jsonschema import validate, ValidationError
+from mqtt_connector import decode_mqtt_message
+from request import Request
+from request_validation import get_body_validator, VALIDATION_MODES
+
+MESSAGE_COUNT = 5000
+
+TOPIC = "smarthome/heartbeat"
+FRAME = json.dumps({"session_id": 1234567, "sender": "chip_a", "receiver": "<bridge>",
+                    "payload": {"name": "lamp", "runtime": 1234, "gadgets": ["light_1", "fan_2"]}}).encode()
+
+
+def decode_legacy(topic: str, payload: bytes, request_schema: dict) -> Request:
+    """Decoder used before the validation modes were introduced"""
+
+    json_str = payload.decode("utf-8").replace("'", '"').replace("None", "null")
+    body = json.loads(json_str)
+    try:
+        validate(body, request_schema)
+    except ValidationError:
+        pass
+    return Request(topic, body["session_id"], body["sender"], body["receiver"], body["payload"])
+
+
+def measure(decode) -> [float]:
+    """Returns the sorted decoding times of the messages in microseconds"""
+
+    durations = []
+    for _ in range(MESSAGE_COUNT):
+        start = time.perf_counter()
+        decode()
+        durations.append((time.perf_counter() - start) * 1000000)
+    return sorted(durations)
+
+
+def print_latency(name: str, durations: [float]):
+    p50 = durations[len(durations) // 2]
+    p99 = durations[int(len(durations) * 0.99)]
+    print(f"{name:<12} p50: {p50:8.1f} us   p99: {p99:8.1f} us")
+
+
+def main():
+    with open("json_schemas/request_basic_structure.json", "r") as f:
+        schema = json.load(f)
+
+    print_latency("legacy", measure(lambda: decode_legacy(TOPIC, FRAME, schema)))
+    for mode in VALIDATION_MODES:
+        validator = get_body_validator(mode, schema)
+        print_latency(mode, measure(lambda: decode_mqtt_message(TOPIC, FRAME, validator)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Microbenchmark for the request handling of a received message: decoding, answering and encoding.
+
+Measures the request class of the checked out tree. To compare versions, run it on each checkout, it also works with
+versions of the class that have no encoded body cache.
+"""
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from request import Request
+from wire_codecs import JSON_CODEC
+
+MESSAGE_COUNT = 20000
+
+TOPIC = "smarthome/heartbeat"
+FRAME = json.dumps({"session_id": 1234567, "sender": "chip_a", "receiver": "<bridge>",
+                    "payload": {"name": "lamp", "runtime": 1234, "gadgets": ["light_1", "fan_2"]}}).encode()
+
+
+def handle_message():
+    """Handles one message the way a connector and the bridge do"""
+
+    body = JSON_CODEC.decode(FRAME)
+    req = Request(TOPIC, body["session_id"], body["sender"], body["receiver"], body["payload"])
+    req.get_session_id()
+    req.get_payload()["name"]
+    res = req.get_response(ack=True)
+    # Once to check the frame size, once to send it
+    for _ in range(2):
+        if hasattr(res, "get_encoded_body"):
+            res.get_encoded_body(JSON_CODEC)
+        else:
+            JSON_CODEC.encode(res.get_body())
+    return req
+
+
+def measure_time() -> float:
+    """Returns the best processing time per message out of five runs in microseconds"""
+
+    durations = []
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(MESSAGE_COUNT):
+            handle_message()
+        durations.append(time.perf_counter() - start)
+    return min(durations) / MESSAGE_COUNT * 1000000
+
+
+def measure_tracked_objects() -> float:
+    """Returns the number of objects the garbage collector has to track for every received request"""
+
+    gc.collect()
+    before = len(gc.get_objects())
+    kept = [handle_message() for _ in range(MESSAGE_COUNT)]
+    tracked = len(gc.get_objects()) - before
+    del kept
+    return tracked / MESSAGE_COUNT
+
+
+def measure_memory() -> (float, float):
+    """Returns the bytes allocated while processing a message and the bytes kept by every received request"""
+
+    tracemalloc.start()
+    snapshot = tracemalloc.take_snapshot()
+    handle_message()
+    tracemalloc.reset_peak()
+    handle_message()
+    _, peak = tracemalloc.get_traced_memory()
+    kept = [handle_message() for _ in range(MESSAGE_COUNT)]
+    retained = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(snapshot, "filename"))
+    tracemalloc.stop()
+    del kept
+    return peak, retained / MESSAGE_COUNT
+
+
+def main():
+    print(f"Time per message:               {measure_time():8.1f} us")
+    print(f"GC tracked objects per request: {measure_tracked_objects():5.1f}")
+    peak, retained = measure_memory()
+    print(f"Peak allocation per message:    {peak:8d} bytes")
+    print(f"Memory kept per request:        {retained:8.1f} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Benchmark for the throughput of parsing the byte stream of a serial port, compares the frame parser to the
+regex based line decoder it replaced"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from jsonschema import validate, ValidationError
+from request import Request
+from request_validation import get_body_validator
+from serial_capture import CAPTURE_MAGIC, DIRECTION_RX, read_capture
+from serial_connector import encode_serial_request
+from serial_frame_parser import SerialFrameParser
+
+FRAME_COUNT = 20000
+
+# Bytes the serial port returns per read, the ESP32 sends in bursts of about this size
+READ_SIZE = 64
+
+DEBUG_LINES = [b"[I][main.cpp:112] loop(): Heartbeat sent\r\n",
+               b"[D][gadget.cpp:57] update(): lamp_1 -> 1\r\n",
+               b"E (12345) wifi: reconnecting\r\n"]
+
+
+def generate_capture(frame_count: int) -> bytes:
+    """Returns a stream like the one a client sends: requests interleaved with its debug output"""
+
+    random.seed(1)
+    stream = []
+    for index in range(frame_count):
+        if index % 10 == 0:
+            payload = {"gadgets": [{"name": "lamp_1", "characteristics": [[1, 0, 100]]}], "port_mapping": {}}
+            path = "smarthome/sync"
+        else:
+            payload = {"name": "lamp_1", "characteristic": 1, "value": random.randint(0, 100)}
+            path = "smarthome/remotes/gadget/update"
+        stream.append(encode_serial_request(Request(path, index + 1, "chip_a", "<bridge>", payload)))
+        if index % 3 == 0:
+            stream.append(random.choice(DEBUG_LINES))
+    return b"".join(stream)
+
+
+def decode_legacy(line: str, request_schema: dict):
+    """Line decoder used before the frame parser was introduced"""
+
+    if line[:3] == "!r_":
+        req_dict = dict(re.findall("_([a-z])\\[(.+?)\\]", line))
+        if "p" not in req_dict or "b" not in req_dict:
+            return None
+        try:
+            json_body = json.loads(req_dict["b"])
+            validate(json_body, request_schema)
+            return Request.from_body(req_dict["p"], json_body)
+        except (ValueError, ValidationError):
+            return None
+    return None
+
+
+def parse_legacy(capture: bytes, schema: dict) -> int:
+    frames = 0
+    for line in capture.splitlines(keepends=True):
+        if decode_legacy(line.decode(), schema) is not None:
+            frames += 1
+    return frames
+
+
+def parse_incremental(capture: bytes, validator) -> int:
+    parser = SerialFrameParser(validator)
+    view = memoryview(capture)
+    for index in range(0, len(capture), READ_SIZE):
+        parser.feed(view[index:index + READ_SIZE])
+    return parser.get_stats()["frames"]
+
+
+def measure(name: str, capture: bytes, parse):
+    start = time.perf_counter()
+    frames = parse()
+    duration = time.perf_counter() - start
+    print(f"{name:<24} {len(capture) / duration / 1000000:8.2f} MB/s {frames / duration:10.0f} frames/s "
+          f"{frames:8d} frames")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the serial frame parsing throughput")
+    parser.add_argument("--capture", help="Capture file recorded by the serial connector or raw bytes read from a "
+                                          "serial port", type=str)
+    args = parser.parse_args()
+
+    if args.capture:
+        with open(args.capture, "rb") as f:
+            capture = f.read()
+        if capture.startswith(CAPTURE_MAGIC):
+            capture = b"".join(data for _, direction, data in read_capture(args.capture) if direction == DIRECTION_RX)
+    else:
+        capture = generate_capture(FRAME_COUNT)
+
+    with open("json_schemas/request_basic_structure.json", "r") as f:
+        schema = json.load(f)
+
+    print(f"Parsing {len(capture) / 1000000:.2f} MB")
+    measure("legacy (regex, schema)", capture, lambda: parse_legacy(capture, schema))
+    for mode in ["schema", "structural"]:
+        validator = get_body_validator(mode, schema)
+        measure(f"incremental ({mode})", capture, lambda: parse_incremental(capture, validator))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Benchmark for the round trips over a serial port, uses a virtual chip on a pseudo terminal instead of hardware"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import client_control_methods
+from baudrate_memory import BaudrateMemory
+from fleet_simulator import get_percentiles, format_ms
+from serial_connector import SerialConnector
+from split_requests import SplitSettings
+from virtual_esp32 import VirtualESP32
+
+SENDER = "serial_path_benchmark"
+
+
+def generate_config(chip_id: str, gadget_count: int) -> dict:
+    """Returns a valid client config, its size grows with the gadget count"""
+
+    return {"name": "benchmark",
+            "description": "Config generated by the serial path benchmark",
+            "data": {"id": chip_id, "wifi_ssid": "benchmark_wifi", "wifi_pw": "benchmark_pw",
+                     "mqtt_ip": "192.168.178.111", "mqtt_port": 1883, "mqtt_user": None, "mqtt_pw": None,
+                     "network_mode": 2},
+            "gadgets": [{"type": 1, "name": f"benchmark_lamp_{index}", "ports": {"port0": index % 40}}
+                        for index in range(gadget_count)]}
+
+
+def measure(name: str, runs: int, operation):
+    """Runs the operation and prints the percentiles of its duration, failed runs are counted but not measured"""
+
+    durations = []
+    failed = 0
+    for _ in range(runs):
+        start = time.perf_counter()
+        if operation():
+            durations.append((time.perf_counter() - start) * 1000)
+        else:
+            failed += 1
+    p50, p99 = get_percentiles(durations, [50, 99])
+    print(f"{name:<28} p50 {format_ms(p50)} ms  p99 {format_ms(p99)} ms  {failed:4d} failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the round trips to a chip connected via a serial port")
+    parser.add_argument("--runs", help="Number of runs per operation", type=int, default=100)
+    parser.add_argument("--latency", help="Seconds the virtual chip takes to answer", type=float, default=0.0)
+    parser.add_argument("--gadgets", help="Number of gadgets in the written config", type=int, default=40)
+    parser.add_argument("--high_speed", help="Negotiates a higher baudrate before measuring", action="store_true")
+    parser.add_argument("--window_acks", help="Sends split requests in acknowledged windows of this many parts "
+                                              "instead of pausing after every part", type=int)
+    parser.add_argument("--port", help="Serial port of a real chip to measure instead of the virtual one", type=str)
+    args = parser.parse_args()
+
+    chip = None
+    port = args.port
+    if port is None:
+        chip = VirtualESP32("benchmark_chip", args.latency, reboot_time=0)
+        port = chip.get_port()
+
+    connector = SerialConnector(SENDER, port, 115200)
+    chip_id = client_control_methods.get_connected_chip_id(connector, SENDER)
+    if chip_id is None:
+        print(f"No chip found on '{port}'")
+        sys.exit(1)
+    if args.high_speed:
+        connector.negotiate_baudrate(chip_id, memory=BaudrateMemory())
+    if args.window_acks:
+        connector.set_split_settings(chip_id, SplitSettings(window_size=args.window_acks, window_acks=True))
+
+    config = generate_config(chip_id, args.gadgets)
+    measure("discovery", args.runs,
+            lambda: client_control_methods.get_connected_chip_id(connector, SENDER) is not None)
+    measure("round trip", args.runs,
+            lambda: client_control_methods.reset_config(chip_id, "gadgets", SENDER, connector) is True)
+    measure("gadget upload", args.runs,
+            lambda: client_control_methods.upload_gadget(chip_id, config["gadgets"][0], SENDER, connector)[0])
+    measure(f"config write ({args.gadgets} gadgets)", max(1, args.runs // 10),
+            lambda: client_control_methods.write_config(chip_id, config, SENDER, connector))
+
+    connector.close()
+    if chip is not None:
+        chip.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,6 @@
 import argparse
 import json
 import socket
-import random
 import sys
 import os
 import time
@@ -15,33 +14,17 @@ from jsonschema import validate, ValidationError
 
 from homekit_connector import HomeConnectorType, HomeKitConnector
 from serial_connector import SerialConnector
+from baudrate_memory import BaudrateMemory, BAUDRATE_MEMORY_PATH
 from smarthomeclient import SmarthomeClient
 from gadget import Gadget, GadgetIdentifier, CharacteristicIdentifier, CharacteristicUpdateStatus, Characteristic
 from typing import Optional
 from mqtt_connector import MQTTConnector
+from shard_coordinator import ShardCoordinator
 from request import Request
+from split_requests import SplitSettings
+from wire_codecs import select_codec
 import client_control_methods
-
-
-def get_connected_chip_id(network: SerialConnector, sender: str) -> Optional[str]:
-    broadcast_req = Request(
-        "smarthome/broadcast/req",
-        gen_req_id(),
-        sender,
-        None,
-        {}
-    )
-
-    responses = network.send_broadcast(broadcast_req, 5)
-
-    if responses:
-        return responses[0].get_sender()
-    return None
-
-
-def gen_req_id() -> int:
-    """Generates a random Request ID"""
-    return random.randint(0, 1000000)
+from client_control_methods import gen_req_id
 
 
 def get_sender() -> str:
@@ -96,6 +79,18 @@ class MainBridge:
     __mqtt_user: Optional[str]
     __mqtt_pw: Optional[str]
 
+    # Whether requests carry MQTT v5 response topics, clients without v5 still get their responses the old way
+    __mqtt_v5: bool
+
+    # Clients sending their bodies as python repr instead of JSON
+    __repr_compat_clients: list
+
+    # Highest baudrates negotiated with the chips connected via USB
+    __baudrate_memory: BaudrateMemory
+
+    # Sharding, None if the bridge runs in a single process
+    __shard_coordinator: Optional[ShardCoordinator] = None
+
     # API
     __api_port: int
     __api_thread: Thread
@@ -128,7 +123,10 @@ class MainBridge:
     # endregion
 
     def __init__(self, bridge_name: str, mqtt_ip: str, mqtt_port: int,
-                 mqtt_username: Optional[str], mqtt_pw: Optional[str]):
+                 mqtt_username: Optional[str], mqtt_pw: Optional[str], scoped_topics: bool = False,
+                 mqtt_v5: bool = False, shard_group: Optional[str] = None, shard_name: Optional[str] = None,
+                 split_last_index_count: bool = False, repr_compat_clients: Optional[list] = None,
+                 baudrate_memory_path: Optional[str] = BAUDRATE_MEMORY_PATH):
         print("Setting up Bridge...")
 
         # Setting bridge name
@@ -168,6 +166,10 @@ class MainBridge:
         self.__mqtt_port = mqtt_port
         self.__mqtt_user = mqtt_username
         self.__mqtt_pw = mqtt_pw
+        self.__mqtt_v5 = mqtt_v5
+        self.__repr_compat_clients = repr_compat_clients if repr_compat_clients is not None else []
+
+        self.__baudrate_memory = BaudrateMemory(baudrate_memory_path)
 
         # API
         self.__api_port = 0
@@ -179,12 +181,26 @@ class MainBridge:
 
         self.__streaming_message_queue = []
 
+        # Every shard of a bridge uses the same bridge name, the clients can't tell them apart
+        if shard_group is not None and shard_name is None:
+            shard_name = f"{self.__bridge_name}_{gen_req_id()}"
+
         print("Setting up Network...")
+        # With scoped topics only requests to the bridge and broadcasts are received, needs all clients to use them
         self.__network_gadget = MQTTConnector(self.__bridge_name,
                                               self.__mqtt_ip,
                                               self.__mqtt_port,
-                                              None,
-                                              None)
+                                              self.__mqtt_user,
+                                              self.__mqtt_pw,
+                                              ["<bridge>", self.__bridge_name] if scoped_topics else None,
+                                              mqtt_v5=self.__mqtt_v5,
+                                              shard_group=shard_group,
+                                              shard_name=shard_name)
+        # Firmware expecting the number of parts as 'last_index' gets it unless it reports the capability otherwise
+        if split_last_index_count:
+            self.__network_gadget.set_split_settings(None, SplitSettings(last_index_count=True))
+        for client_name in self.__repr_compat_clients:
+            self.__network_gadget.set_client_repr_compat(client_name, True)
         self.__mqtt_callback_thread = BridgeMQTTThread(parent=self,
                                                        connector=self.__network_gadget)
         self.__mqtt_callback_thread.start()
@@ -192,8 +208,31 @@ class MainBridge:
         self.__load_json_schemas()
 
         self.__lock = threading.Lock()
+
+        if shard_group is not None:
+            print(f"Joining shard group '{shard_group}' as '{shard_name}'...")
+            self.__shard_coordinator = ShardCoordinator(shard_group,
+                                                        shard_name,
+                                                        self.__mqtt_ip,
+                                                        self.__mqtt_port,
+                                                        self.__get_shard_state,
+                                                        self.__network_gadget.set_shard_ring,
+                                                        self.__mqtt_user,
+                                                        self.__mqtt_pw)
         print("Ok.")
 
+    def close(self):
+        """Closes the connectors and hands the broker connections back"""
+
+        with self.__lock:
+            connectors = list(self.__connectors)
+            self.__connectors = []
+        for connector in connectors:
+            connector.close()
+        if self.__shard_coordinator is not None:
+            self.__shard_coordinator.close()
+        self.__network_gadget.close()
+
     def add_dummy_data(self):
         self.__add_client("dummy_client1",
                           1234567)
@@ -268,6 +307,8 @@ class MainBridge:
         if req.get_path() == "smarthome/heartbeat":
             if self.__verify_payload('bridge_heartbeat_request.json', req.get_payload()):
                 local_client = self.__get_or_create_client_from_request(req)
+                if "capabilities" in req_pl:
+                    self.__apply_client_capabilities(req.get_sender(), req_pl["capabilities"])
                 if local_client.needs_update():
                     self.__ask_for_update(local_client)
             return
@@ -398,12 +439,21 @@ class MainBridge:
 
         # Check client name?
 
+        # The upload is sent in the name of the bridge, if the client uses the scoped topics only the responses
+        # to the bridge have to be received
+        scoped = self.__network_gadget.get_client_scoped_topics(client_name)
         buf_mqtt_gadget = MQTTConnector(
             self.get_bridge_name() + "config_upload_" + str(gen_req_id()),
             self.__mqtt_ip,
             self.__mqtt_port,
             self.__mqtt_user,
-            self.__mqtt_pw)
+            self.__mqtt_pw,
+            [self.get_bridge_name()] if scoped else None,
+            mqtt_v5=self.__mqtt_v5)
+        buf_mqtt_gadget.set_client_scoped_topics(client_name, scoped)
+        buf_mqtt_gadget.set_split_settings(client_name, self.__network_gadget.get_split_settings(client_name))
+        buf_mqtt_gadget.set_client_codec(client_name, self.__network_gadget.get_client_codec(client_name))
+        buf_mqtt_gadget.set_client_repr_compat(client_name, client_name in self.__repr_compat_clients)
 
         # Launch Thread
         self.__chip_config_flash_thread = ChipConfigFlasherThread(
@@ -442,11 +492,14 @@ class MainBridge:
             return False, f"Could not connect to '{serial_port}'"
 
         # Get client name
-        client_name = get_connected_chip_id(buf_serial_gadget, self.get_bridge_name())
+        client_name = client_control_methods.get_connected_chip_id(buf_serial_gadget, self.get_bridge_name())
 
         if not client_name:
             return False, "Could not connect to serial client"
 
+        # Large configs are uploaded a lot faster if the chip supports a higher baudrate
+        buf_serial_gadget.negotiate_baudrate(client_name, memory=self.__baudrate_memory)
+
         # Launch Thread
         self.__chip_config_flash_thread = ChipConfigFlasherThread(
             self.get_bridge_name(),
@@ -632,6 +685,16 @@ class MainBridge:
                           {"server_time": int(time.time() / 1000)})
         self.__network_gadget.send_request(out_req, timeout=0)
 
+    def __apply_client_capabilities(self, client_name: str, capabilities: dict):
+        """Adjusts the way requests are encoded and split for the client to the capabilities it reported"""
+        default_settings = self.__network_gadget.get_split_settings(None)
+        self.__network_gadget.set_split_settings(client_name,
+                                                 SplitSettings.from_capabilities(capabilities, default_settings))
+        if "codecs" in capabilities:
+            self.__network_gadget.set_client_codec(client_name, select_codec(capabilities["codecs"]))
+        if "scoped_topics" in capabilities:
+            self.__network_gadget.set_client_scoped_topics(client_name, capabilities["scoped_topics"])
+
     def restart_client(self, client: SmarthomeClient) -> bool:
         """Sends out a request to restart the client and"""
 
@@ -737,6 +800,35 @@ class MainBridge:
 
     # endregion
 
+    # region SHARD METHODS
+
+    def __get_shard_state(self) -> dict:
+        """Returns the state this shard shares with the other shards of the bridge"""
+        return {"clients": [client.serialized() for client in list(self.get_all_clients())],
+                "gadgets": [gadget.serialized() for gadget in list(self.get_all_gadgets())]}
+
+    def get_shard_name(self) -> Optional[str]:
+        """Returns the name of the shard, None if the bridge is not sharded"""
+        if self.__shard_coordinator is None:
+            return None
+        return self.__shard_coordinator.get_shard_name()
+
+    def get_remote_clients(self) -> [dict]:
+        """Returns the serialized clients handled by the other shards of the bridge"""
+        if self.__shard_coordinator is None:
+            return []
+        return [client for state in self.__shard_coordinator.get_shard_states().values()
+                for client in state.get("clients", [])]
+
+    def get_remote_gadgets(self) -> [dict]:
+        """Returns the serialized gadgets handled by the other shards of the bridge"""
+        if self.__shard_coordinator is None:
+            return []
+        return [gadget for state in self.__shard_coordinator.get_shard_states().values()
+                for gadget in state.get("gadgets", [])]
+
+    # endregion
+
     # region CONNECTOR METHODS
 
     def get_all_connectors(self):
@@ -821,6 +913,18 @@ if __name__ == '__main__':
     parser.add_argument('--dummy_data', help='Adds dummy data for debugging.', action="store_true")
     parser.add_argument('--api_port', help='Port for the REST-API', type=int)
     parser.add_argument('--socket_port', help='Port for the Socket Server', type=int)
+    parser.add_argument('--scoped_topics', help='Only subscribe to requests to the bridge and broadcasts.',
+                        action="store_true")
+    parser.add_argument('--mqtt_v5', help='Route responses using MQTT v5 response topics.', action="store_true")
+    parser.add_argument('--shard_group', help='Share the clients with the other bridges of the group.', type=str)
+    parser.add_argument('--shard_name', help='Name of this bridge in the shard group, random if not set.', type=str)
+    parser.add_argument('--split_last_index_count', help='Announce the number of parts as last_index of split '
+                                                         'requests, for firmware built before the index semantics.',
+                        action="store_true")
+    parser.add_argument('--repr_compat_clients', help='Clients still sending python repr instead of JSON bodies.',
+                        type=str, nargs="+")
+    parser.add_argument('--baudrate_memory', help='File to remember the baudrates of the chips connected via USB in.',
+                        type=str, default=BAUDRATE_MEMORY_PATH)
     ARGS = parser.parse_args()
 
     print("Launching Bridge")
@@ -842,7 +946,9 @@ if __name__ == '__main__':
         sys.exit(22)
 
     # Create Bridge
-    bridge = MainBridge(buf_bridge_name, buf_mqtt_ip, buf_mqtt_port, None, None)
+    bridge = MainBridge(buf_bridge_name, buf_mqtt_ip, buf_mqtt_port, None, None, ARGS.scoped_topics,
+                        ARGS.mqtt_v5, ARGS.shard_group, ARGS.shard_name, ARGS.split_last_index_count,
+                        ARGS.repr_compat_clients, ARGS.baudrate_memory)
 
     # Insert dummy data if wanted
     if ARGS.dummy_data:
@@ -860,3 +966,12 @@ if __name__ == '__main__':
         bridge.run_socket_api()
     else:
         print("No port for Socket API configured.")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("Shutting down Bridge")
+    bridge.close()
+    # The API threads never end
+    os._exit(0)
@@ -1,6 +1,7 @@
+from __future__ import annotations
 from threading import Thread
 from chip_flasher import flash_chip
-from bridge import MainBridge
+from typing import TYPE_CHECKING
 
 from network_connector import NetworkConnector
 from typing import Optional
@@ -10,6 +11,10 @@ import api
 import socket_api
 import client_control_methods
 
+# The bridge imports this module, importing it back at runtime would be circular
+if TYPE_CHECKING:
+    from bridge import MainBridge
+
 
 class BridgeMQTTThread(Thread):
     __parent_object: MainBridge
@@ -23,10 +28,8 @@ class BridgeMQTTThread(Thread):
 
     def run(self):
         print("Starting Bridge MQTT Thread")
-        while True:
-            buf_req: Optional[Request] = self.__mqtt_connector.get_request()
-            if buf_req:
-                self.__parent_object.handle_request(buf_req)
+        for buf_req in self.__mqtt_connector.requests():
+            self.__parent_object.handle_request(buf_req)
 
 
 class BridgeAPIThread(Thread):
@@ -72,6 +75,8 @@ class ChipConfigFlasherThread(Thread):
                                             self.__sender,
                                             self.__network,
                                             self.__streaming_callback)
+        # The connector was only created for the upload
+        self.__network.close()
         print("Flashing done.")
 
 
@@ -29,9 +29,25 @@ __upload_gadget_no_gadget_in_cfg_code = 3
 
 
 def gen_req_id() -> int:
-    """Generates a random Request ID"""
+    """Generates a random Request ID, 0 is no valid ID"""
 
-    return random.randint(0, 1000000)
+    return random.randint(1, 1000000)
+
+
+def get_connected_chip_id(network: NetworkConnector, sender: str, timeout: int = 5) -> Optional[str]:
+    """Returns the name of the client at the other end of a point to point connection like a serial port"""
+
+    broadcast_req = Request(path="smarthome/broadcast/req",
+                            session_id=gen_req_id(),
+                            sender=sender,
+                            receiver=None,
+                            payload={})
+
+    responses = network.send_broadcast(broadcast_req, timeout, expected_count=1)
+
+    if responses:
+        return responses[0].get_sender()
+    return None
 
 
 def reset_config(client_name: str, reset_option: str, sender: str, network: NetworkConnector) -> bool:
@@ -82,7 +98,8 @@ def upload_gadget(client_name: str, gadget: dict, sender: str, network: NetworkC
 
 
 def write_config(client_name: str, config: dict, sender: str, network: NetworkConnector,
-                 print_callback: CallbackFunction = None):
+                 print_callback: CallbackFunction = None) -> bool:
+    """Writes the config to a client. Returns whether the client acknowledged it."""
 
     try:
         with open("json_schemas/client_config.json") as schema_file:
@@ -90,10 +107,10 @@ def write_config(client_name: str, config: dict, sender: str, network: NetworkCo
             validate(config, schema)
     except IOError:
         print("Config could not be written: Schema could not be loaded")
-        return
+        return False
     except ValidationError:
         print("Config could not be written: Validation failed")
-        return
+        return False
 
     payload_dict = {"type": "complete",
                     "reset_config": True,
@@ -106,11 +123,12 @@ def write_config(client_name: str, config: dict, sender: str, network: NetworkCo
                       receiver=client_name,
                       payload=payload_dict)
 
-    success, res = network.send_request_split(out_req, 50)
+    success, res = network.send_request_split(out_req)
 
     if success:
         if print_callback:
-            print_callback(LOG_SENDER, __upload_data_ok_code, f"Flashing '{attr}' was successful")
+            print_callback(LOG_SENDER, __upload_data_ok_code, f"Writing config to '{client_name}' was successful")
         print("Writing config was successful")
     else:
         print("Writing config failed")
+    return success is True
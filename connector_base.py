@@ -0,0 +1,132 @@
+"""Module to contain the parts of the network connectors shared by the synchronous and the asyncio ones"""
+import json
+from request import Request
+from split_requests import SplitRequestBuffer, SplitSettings, split_request_for_transport, needs_window_ack, \
+    get_window_ack, get_split_windows
+from wire_codecs import WireCodec, JSON_CODEC
+from request_validation import get_body_validator
+from typing import Optional, Callable
+from threading import Lock
+
+# Windows of parts to send before the last part of a split request, the last part and the settings used
+SplitPlan = tuple[list, Request, SplitSettings]
+
+
+class ConnectorBase:
+    """Class to implement the codecs, the split requests and the request validation of every connector"""
+
+    _request_validation_schema: dict
+
+    # Check the bodies of received requests have to pass, see request_validation.VALIDATION_MODES
+    _validate_body: Callable[[dict], bool]
+
+    # Maximum size in bytes of a single frame the transport can carry, None if there is no relevant limit
+    _max_frame_size: Optional[int] = None
+
+    # Whether the transport can carry the output of binary codecs
+    _binary_transport: bool = False
+
+    # Name the connector receives requests for, used to acknowledge windows of split requests
+    _own_name: Optional[str]
+
+    # Codecs to encode the bodies of requests to a client with, identified by the client. None holds the default.
+    __codecs: dict
+
+    __split_buffer: SplitRequestBuffer
+
+    # Settings to send split requests with, identified by the receiving client. None holds the default.
+    __split_settings: dict
+
+    # Lock for the codecs, the split settings and the split buffer
+    __lock: Lock
+
+    def __init__(self, own_name: Optional[str] = None):
+        self._own_name = own_name
+        self.__split_buffer = SplitRequestBuffer()
+        self.__split_settings = {None: SplitSettings()}
+        self.__codecs = {None: JSON_CODEC}
+        self.__lock = Lock()
+        with open("json_schemas/request_basic_structure.json", "r") as f:
+            self._request_validation_schema = json.load(f)
+        self._validate_body = get_body_validator("structural", self._request_validation_schema)
+
+    def _get_frame_size(self, req: Request) -> int:
+        """Returns the number of bytes the request takes up on the transport"""
+        return len(self._encode_body(req))
+
+    def _get_link_rate(self) -> Optional[float]:
+        """Returns the number of bytes per second the transport carries, None if it is not the bottleneck"""
+        return None
+
+    def _encode_body(self, req: Request) -> bytes:
+        """Encodes the body of the request with the codec selected for its receiver"""
+        return req.get_encoded_body(self.get_client_codec(req.get_receiver()))
+
+    def _add_to_split_buffer(self, received_request: Request) -> tuple[Optional[Request], Optional[Request]]:
+        """
+        Reassembles split requests.
+
+        Returns the received request or the reassembled one if it is complete, None otherwise. Returns the
+        acknowledgement to send for the received part as well, None if the part doesn't close a window.
+        """
+
+        with self.__lock:
+            buf_req = self.__split_buffer.add(received_request)
+        if buf_req is None and needs_window_ack(received_request, self._own_name):
+            return None, get_window_ack(received_request)
+        return buf_req, None
+
+    def _plan_split(self, req: Request, part_max_size: Optional[int]) -> Optional[SplitPlan]:
+        """Splits the request into the windows to send to its receiver, see 'send_request_split'. None on errors."""
+
+        settings = self.get_split_settings(req.get_receiver())
+        try:
+            parts = split_request_for_transport(req, part_max_size, settings, self._max_frame_size,
+                                                self._get_frame_size)
+        except RuntimeError as err:
+            print(err)
+            return None
+        return get_split_windows(parts, settings), parts[-1], settings
+
+    def _get_window_pause(self, settings: SplitSettings, window: [Request]) -> float:
+        """Returns the seconds to pause after sending a window that isn't acknowledged"""
+
+        return settings.get_pause([self._get_frame_size(part) for part in window], self._get_link_rate())
+
+    def set_split_settings(self, client_name: Optional[str], settings: SplitSettings):
+        """Sets the settings to send split requests to the client with. Sets the default if 'client_name' is None."""
+
+        with self.__lock:
+            self.__split_settings[client_name] = settings
+
+    def get_split_settings(self, client_name: Optional[str]) -> SplitSettings:
+        """Returns the settings split requests to the client are sent with"""
+
+        with self.__lock:
+            return self.__split_settings.get(client_name, self.__split_settings[None])
+
+    def set_client_codec(self, client_name: Optional[str], codec: WireCodec):
+        """Sets the codec to encode requests to the client with. Sets the default if 'client_name' is None."""
+
+        if codec.binary and not self._binary_transport:
+            print(f"Cannot use binary codec '{codec.name}' on this transport")
+            return
+        with self.__lock:
+            self.__codecs[client_name] = codec
+
+    def get_client_codec(self, client_name: Optional[str]) -> WireCodec:
+        """Returns the codec requests to the client are encoded with"""
+
+        with self.__lock:
+            return self.__codecs.get(client_name, self.__codecs[None])
+
+    def set_request_validation(self, mode: str):
+        """Sets how strictly the bodies of received requests are checked, see request_validation.VALIDATION_MODES"""
+
+        self._validate_body = get_body_validator(mode, self._request_validation_schema)
+
+    def get_split_stats(self) -> dict:
+        """Returns the counters of the buffer reassembling split requests"""
+
+        with self.__lock:
+            return self.__split_buffer.get_stats()
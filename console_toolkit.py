@@ -2,7 +2,6 @@ import serial
 import argparse
 import json
 import socket
-import random
 import os
 import sys
 from request import Request
@@ -10,6 +9,7 @@ from gadgetlib import GadgetIdentifier, str_to_gadget_identifier, str_to_gadget_
 from typing import Optional
 
 import client_control_methods
+from client_control_methods import gen_req_id
 from serial_connector import SerialConnector
 from mqtt_connector import MQTTConnector
 
@@ -31,6 +31,7 @@ parser.add_argument("--network", help="may either be 'serial' or 'mqtt'")
 # serial settings
 parser.add_argument('--serial_port', help='serial port to connect to.')
 parser.add_argument('--serial_baudrate', help='baudrate for the serial connection.')
+parser.add_argument('--serial_capture', help='records the serial traffic to the given capture file.')
 
 # # mqtt settings
 # parser.add_argument('--mqtt_port', help='port of the mqtt server.')
@@ -76,12 +77,6 @@ parser.add_argument('--arg_attributes_only',
 ARGS = parser.parse_args()
 
 
-def gen_req_id() -> int:
-    """Generates a random Request ID"""
-
-    return random.randint(0, 1000000)
-
-
 def get_sender() -> str:
     """Returns the name used as sender (local hostname)"""
 
@@ -99,7 +94,7 @@ def scan_for_clients() -> [str]:
                   None,
                   {})
 
-    responses = network_gadget.send_broadcast(req)
+    responses = network_gadget.send_broadcast(req, quiet_period=0.5)
 
     for broadcast_res in responses:
         client_names.append(broadcast_res.get_sender())
@@ -341,7 +336,8 @@ if __name__ == '__main__':
             serial_baudrate = 115200
 
         try:
-            network_gadget = SerialConnector(get_sender(), serial_port, serial_baudrate)
+            network_gadget = SerialConnector(get_sender(), serial_port, serial_baudrate,
+                                             capture_path=ARGS.serial_capture)
             print("Connected to serial port {}@{}".format(serial_port, serial_baudrate))
         except (FileNotFoundError, serial.serialutil.SerialException) as e:
             print("Unable to connect to serial port '{}'".format(serial_port))
@@ -349,7 +345,12 @@ if __name__ == '__main__':
 
         if ARGS.monitor_mode:
             if network_gadget is not None:
-                network_gadget.monitor()
+                try:
+                    network_gadget.monitor()
+                except KeyboardInterrupt:
+                    pass
+                # Completes the capture file
+                network_gadget.close()
                 sys.exit(0)
 
     else:
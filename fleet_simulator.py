@@ -0,0 +1,278 @@
+"""Module to simulate a fleet of Smarthome_ESP32 clients to load test a bridge"""
+import argparse
+import heapq
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+from client_control_methods import gen_req_id
+from mqtt_connector import MQTTConnector
+from mqtt_session import MEMORY_BROKER
+from request import Request
+
+
+def get_percentiles(samples: [float], percentiles: [int]) -> [Optional[float]]:
+    """Returns the percentiles of the samples, None for each of them if there are no samples"""
+
+    if not samples:
+        return [None for _ in percentiles]
+    ordered = sorted(samples)
+    return [ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] for p in percentiles]
+
+
+class VirtualClient:
+    """Class to represent a simulated Smarthome_ESP32 client"""
+
+    __name: str
+    __runtime_id: int
+    __gadgets: list
+
+    def __init__(self, name: str, gadget_count: int, characteristics: [int]):
+        self.__name = name
+        self.__runtime_id = gen_req_id()
+        self.__gadgets = [{"name": f"{name}_gadget_{index}",
+                           "type": 1,
+                           # The schema asks for 'val', the bridge reads 'value'
+                           "characteristics": [{"type": c_type, "min": 0, "max": 100, "step": 1, "val": 0, "value": 0}
+                                               for c_type in characteristics]}
+                          for index in range(gadget_count)]
+
+    def get_name(self) -> str:
+        return self.__name
+
+    def get_runtime_id(self) -> int:
+        return self.__runtime_id
+
+    def restart(self):
+        """Simulates a reboot, the bridge asks the client for a sync afterwards"""
+
+        self.__runtime_id = gen_req_id()
+
+    def get_heartbeat(self) -> Request:
+        return Request("smarthome/heartbeat", gen_req_id(), self.__name, "<bridge>",
+                       {"runtime_id": self.__runtime_id})
+
+    def get_update(self) -> Request:
+        """Returns an update of a random characteristic to a random value"""
+
+        gadget = random.choice(self.__gadgets)
+        characteristic = random.choice(gadget["characteristics"])
+        return Request("smarthome/remotes/gadget/update", gen_req_id(), self.__name, "<bridge>",
+                       {"name": gadget["name"], "characteristic": characteristic["type"],
+                        "value": random.randint(characteristic["min"], characteristic["max"])})
+
+    def handle_request(self, req: Request) -> Optional[Request]:
+        """Handles a request from the bridge and returns the response if there is any"""
+
+        if req.get_path() == "smarthome/sync":
+            return req.get_response(payload={"runtime_id": self.__runtime_id,
+                                             "gadgets": self.__gadgets,
+                                             "port_mapping": {},
+                                             "boot_mode": 1,
+                                             "sw_uploaded": "2021-01-01 00:00:00",
+                                             "sw_commit": "simulated",
+                                             "sw_branch": "master"})
+        if req.get_path() == "smarthome/sys" and req.get_payload().get("subject") == "reboot":
+            self.restart()
+            return req.get_response(ack=True)
+        if req.get_path() == "smarthome/config/write":
+            return req.get_response(ack=True)
+        return None
+
+
+class FleetSimulator:
+    """Class to simulate many clients on a single broker connection and measure the reactions of the bridge"""
+
+    __connector: MQTTConnector
+    __clients: dict
+
+    # Clients that were restarted to measure the latency, with the time their heartbeat was sent
+    __probes: dict
+    __latencies: list
+    __lost_probes: int
+
+    __sent: int
+    __running: bool
+    __lock: threading.Lock
+    __receiver_thread: threading.Thread
+
+    def __init__(self, mqtt_ip: str, mqtt_port: int, client_count: int, gadget_count: int = 2,
+                 characteristics: Optional[list] = None, mqtt_user: Optional[str] = None,
+                 mqtt_pw: Optional[str] = None):
+        self.__connector = MQTTConnector("fleet_simulator", mqtt_ip, mqtt_port, mqtt_user, mqtt_pw)
+        characteristics = characteristics if characteristics else [1, 3]
+        self.__clients = {}
+        for index in range(client_count):
+            client = VirtualClient(f"sim_{index:05d}", gadget_count, characteristics)
+            self.__clients[client.get_name()] = client
+        self.__probes = {}
+        self.__latencies = []
+        self.__lost_probes = 0
+        self.__sent = 0
+        self.__running = True
+        self.__lock = threading.Lock()
+        self.__receiver_thread = threading.Thread(target=self.__receive, daemon=True)
+        self.__receiver_thread.start()
+
+    def __receive(self):
+        """Answers the requests of the bridge in the name of the addressed clients"""
+
+        while self.__running:
+            req = self.__connector.get_request(timeout=0.5)
+            if req is None or req.get_sender() in self.__clients:
+                continue
+            client = self.__clients.get(req.get_receiver())
+            if client is None:
+                continue
+            if req.get_path() == "smarthome/sync":
+                with self.__lock:
+                    start = self.__probes.pop(client.get_name(), None)
+                    if start is not None:
+                        self.__latencies.append((time.time() - start) * 1000)
+            res = client.handle_request(req)
+            if res is not None:
+                self.__connector.send_request(res, 0)
+
+    def __send(self, req: Request):
+        self.__connector.send_request(req, 0)
+        self.__sent += 1
+
+    def connect_all(self, timeout: float = 30) -> int:
+        """Announces every client to the bridge and waits for their syncs. Returns the number of synced clients."""
+
+        with self.__lock:
+            self.__probes = {name: time.time() for name in self.__clients}
+        for client in self.__clients.values():
+            self.__send(client.get_heartbeat())
+        timeout_time = time.time() + timeout
+        while time.time() < timeout_time:
+            with self.__lock:
+                if not self.__probes:
+                    break
+            time.sleep(0.1)
+        with self.__lock:
+            missing = len(self.__probes)
+            self.__probes = {}
+            self.__latencies = []
+        return len(self.__clients) - missing
+
+    def run(self, duration: float, update_rate: float, heartbeat_interval: float = 10, probe_rate: float = 2,
+            probe_timeout: float = 5) -> dict:
+        """
+        Sends characteristic updates with a total of 'update_rate' per second and heartbeats for 'duration' seconds.
+
+        'probe_rate' clients per second are restarted, the time the bridge takes to ask them for a sync afterwards
+        is the measured latency. Returns the achieved rate, the latency percentiles and the number of lost probes.
+        """
+
+        with self.__lock:
+            self.__latencies = []
+            self.__lost_probes = 0
+        self.__sent = 0
+
+        start = time.time()
+        names = list(self.__clients)
+        # Events as (time, kind, client name), heartbeats are spread over their interval
+        events = [(start + random.uniform(0, heartbeat_interval), "heartbeat", name) for name in names]
+        if update_rate > 0:
+            events.append((start, "update", None))
+        if probe_rate > 0:
+            events.append((start, "probe", None))
+        heapq.heapify(events)
+
+        while events and events[0][0] < start + duration:
+            event_time, kind, name = heapq.heappop(events)
+            delay = event_time - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+            if kind == "heartbeat":
+                self.__send(self.__clients[name].get_heartbeat())
+                heapq.heappush(events, (event_time + heartbeat_interval, kind, name))
+            elif kind == "update":
+                self.__send(self.__clients[random.choice(names)].get_update())
+                heapq.heappush(events, (event_time + 1 / update_rate, kind, None))
+            else:
+                client = self.__clients[random.choice(names)]
+                client.restart()
+                with self.__lock:
+                    self.__probes[client.get_name()] = time.time()
+                self.__send(client.get_heartbeat())
+                heapq.heappush(events, (event_time + 1 / probe_rate, kind, None))
+
+        elapsed = time.time() - start
+        time.sleep(probe_timeout)
+        with self.__lock:
+            self.__lost_probes = len(self.__probes)
+            self.__probes = {}
+            latencies = list(self.__latencies)
+
+        p50, p90, p99 = get_percentiles(latencies, [50, 90, 99])
+        return {"rate": self.__sent / elapsed,
+                "p50": p50,
+                "p90": p90,
+                "p99": p99,
+                "probes": len(latencies),
+                "lost_probes": self.__lost_probes}
+
+    def find_saturation(self, rates: [float], step_duration: float = 10, max_p99: float = 500) -> Optional[float]:
+        """
+        Runs a step with each update rate and prints the results.
+
+        Returns the first rate the bridge could not keep up with, None if it handled all of them. The bridge is
+        saturated if the 99th latency percentile exceeds 'max_p99' milliseconds or a probe got lost.
+        """
+
+        print(f"{'target/s':>10} {'sent/s':>10} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'lost':>6}")
+        for rate in rates:
+            result = self.run(step_duration, rate)
+            print(f"{rate:10.0f} {result['rate']:10.1f} {format_ms(result['p50'])} {format_ms(result['p90'])} "
+                  f"{format_ms(result['p99'])} {result['lost_probes']:6d}")
+            if result["lost_probes"] > 0 or result["p99"] is None or result["p99"] > max_p99:
+                return rate
+        return None
+
+    def close(self):
+        self.__running = False
+        self.__receiver_thread.join()
+        self.__connector.close()
+
+
+def format_ms(value: Optional[float]) -> str:
+    return f"{value:8.1f}" if value is not None else f"{'-':>8}"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulates Smarthome_ESP32 clients to load test a bridge')
+    parser.add_argument('--mqtt_ip', help='IP of the MQTT Broker, omit to test a bridge started in this process',
+                        type=str)
+    parser.add_argument('--mqtt_port', help='Port of the MQTT Broker', type=int, default=1883)
+    parser.add_argument('--clients', help='Number of simulated clients', type=int, default=1000)
+    parser.add_argument('--gadgets', help='Number of gadgets per client', type=int, default=2)
+    parser.add_argument('--rates', help='Characteristic updates per second to step through', type=float, nargs="+",
+                        default=[10, 50, 100, 200, 500, 1000])
+    parser.add_argument('--step_duration', help='Seconds to run every step for', type=float, default=10)
+    parser.add_argument('--max_p99', help='Latency in ms at which the bridge is considered saturated', type=float,
+                        default=500)
+    ARGS = parser.parse_args()
+
+    sim_ip = ARGS.mqtt_ip
+    if sim_ip is None:
+        from bridge import MainBridge
+        sim_ip = MEMORY_BROKER
+        bridge = MainBridge("simulated_bridge", sim_ip, ARGS.mqtt_port, None, None)
+
+    simulator = FleetSimulator(sim_ip, ARGS.mqtt_port, ARGS.clients, ARGS.gadgets)
+    print(f"Synced {simulator.connect_all()} of {ARGS.clients} clients")
+    saturation = simulator.find_saturation(ARGS.rates, ARGS.step_duration, ARGS.max_p99)
+    if saturation is None:
+        print("The bridge handled all rates")
+    else:
+        print(f"The bridge is saturated at {saturation:.0f} updates per second")
+    simulator.close()
+
+    # The threads of a bridge started in this process never end
+    if ARGS.mqtt_ip is None:
+        os._exit(0)
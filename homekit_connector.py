@@ -2,6 +2,7 @@ import enum
 import json
 import time
 import paho.mqtt.client as mqtt
+from mqtt_session import MQTTSession, get_session, release_session
 from typing import Optional
 from gadgetlib import GadgetIdentifier
 from gadget import Characteristic, Gadget, CharacteristicIdentifier
@@ -86,6 +87,9 @@ class HomeConnector:
 
 class HomeKitConnector(HomeConnector):
 
+    # Broker connection, shared with the bridge and all other mqtt users of the process
+    __session: Optional[MQTTSession] = None
+    __subscription: int
     __own_name: str
     __ip: str
     __port: int
@@ -103,21 +107,15 @@ class HomeKitConnector(HomeConnector):
                  mqtt_user: Optional[str] = None, mqtt_pw: Optional[str] = None):
         super().__init__(bridge)
         self.__own_name = own_name
-        self.__client = mqtt.Client(self.__own_name + "_HomeBridge")
         self.__ip = mqtt_ip
         self.__port = mqtt_port
         self.__mqtt_username = mqtt_user
         self.__mqtt_password = mqtt_pw
+        self.__status_responses = Queue()
 
-        if self.__mqtt_username and self.__mqtt_password:
-            self.__client.username_pw_set(self.__mqtt_username, self.__mqtt_password)
-        try:
-            self.__client.connect(self.__ip, self.__port, 15)
-        except OSError:
-            print("Could not connect to MQTT Server.")
-        self.__client.loop_start()
-        self.__client.on_message = self.__on_message
-        self.__client.subscribe("homebridge/#")
+        self.__session = get_session(self.__own_name + "_HomeBridge", self.__ip, self.__port, self.__mqtt_username,
+                                     self.__mqtt_password)
+        self.__subscription = self.__session.subscribe(["homebridge/#"], self.__on_message)
 
         self.__mqtt_callback_thread = HomeKitMQTTThread(parent=self)
         self.__mqtt_callback_thread.start()
@@ -126,14 +124,20 @@ class HomeKitConnector(HomeConnector):
 
         self.__lock = Lock()
 
-    def __del__(self):
-        self.__client.disconnect()
+    def close(self):
+        """Stops receiving updates from homebridge and hands the broker connection back"""
+
+        if self.__session is None:
+            return
+        self.__session.unsubscribe(self.__subscription)
+        release_session(self.__session)
+        self.__session = None
 
     def get_name(self) -> str:
         return self.__own_name
 
     @staticmethod
-    def __on_message(client, userdata, message):
+    def __on_message(message: mqtt.MQTTMessage):
         global mqtt_res_queue
 
         topic = message.topic
@@ -176,7 +180,7 @@ class HomeKitConnector(HomeConnector):
         self.__send_request(buf_req)
 
     def __send_request(self, req: HomeKitRequest):
-        self.__client.publish(req.topic, json.dumps(req.message))
+        self.__session.publish(req.topic, json.dumps(req.message).encode())
 
     def update_characteristic(self, name: str, g_type: GadgetIdentifier,
                               characteristic: CharacteristicIdentifier, value: int) -> bool:
@@ -0,0 +1,17 @@
+from mqtt_connector import MQTTConnector
+from mqtt_session import MEMORY_BROKER
+from typing import Optional
+
+
+class InMemoryConnector(MQTTConnector):
+    """
+    Class to implement a connection to an in-process broker with mqtt topic semantics.
+
+    Connects to the bridge, the echo client or any other mqtt user of the process that was given MEMORY_BROKER as
+    broker ip and the same 'broker_id' as port.
+    """
+
+    def __init__(self, own_name: str, broker_id: int = 0, scoped_receivers: Optional[list] = None,
+                 mqtt_v5: bool = False, shard_group: Optional[str] = None, shard_name: Optional[str] = None):
+        super().__init__(own_name, MEMORY_BROKER, broker_id, scoped_receivers=scoped_receivers, mqtt_v5=mqtt_v5,
+                         shard_group=shard_group, shard_name=shard_name)
@@ -1,10 +1,38 @@
 from network_connector import NetworkConnector, Request, Req_Response
-from typing import Optional
-from queue import Queue
+from typing import Optional, Callable
 import paho.mqtt.client as mqtt
-import time
+from paho.mqtt.properties import Properties
+from paho.mqtt.packettypes import PacketTypes
 import json
-from jsonschema import validate, ValidationError
+from collections import OrderedDict
+from random import randint
+from threading import Lock
+from wire_codecs import detect_codec, JSON_CODEC
+from request_validation import check_request_structure
+from mqtt_session import MQTTSession, get_session, release_session
+from mqtt_publish_queue import PublishQueue, PublishClass, DEFAULT_PUBLISH_CLASS, DEFAULT_PUBLISH_CLASSES
+from shard_ring import ShardRing, get_shared_subscription, get_forward_topic, get_forwarded_topic
+
+
+# Requests to a single receiver are published below this prefix in the scoped topic scheme
+SCOPED_TOPIC_PREFIX = "smarthome/to/"
+
+# Topics of requests to all clients, connectors subscribe to them in the scoped topic scheme as well
+BROADCAST_TOPIC = "smarthome/broadcast/#"
+
+# Prefix of the topics MQTT v5 connectors receive the responses to their requests on.
+# It is outside of 'smarthome/#', so connectors subscribed to all requests don't have to decode the responses.
+RESPONSE_TOPIC_PREFIX = "smarthome_responses/"
+
+# Number of response topics of received MQTT v5 requests to remember until they are answered
+MAX_RESPONSE_ROUTES = 1000
+
+# Number of senders of dropped python repr bodies to remember, the least recently reported one is forgotten first
+MAX_DROPPED_REPR_SENDERS = 1000
+
+# Senders whose python repr bodies were dropped already, they are only reported once. Least recently reported first.
+__dropped_repr_senders = OrderedDict()
+__dropped_repr_senders_lock = Lock()
 
 
 def connect_callback(client, userdata, flags, reason_code, properties=None):
@@ -15,10 +43,125 @@ def disconnect_callback(client, userdata, reason_code, properties=None):
     print("MQTT disconnected.")
 
 
+def decode_repr_body(payload: bytes) -> Optional[dict]:
+    """Decodes a body some clients send as python repr ('None' and single quotes) instead of JSON"""
+
+    try:
+        return json.loads(payload.decode("utf-8").replace("'", '"').replace("None", "null"))
+    except (UnicodeDecodeError, ValueError):
+        return None
+
+
+def report_dropped_repr_body(sender):
+    """Reports a python repr body of a client that is not known to send them, once per client"""
+
+    with __dropped_repr_senders_lock:
+        if sender in __dropped_repr_senders:
+            __dropped_repr_senders.move_to_end(sender)
+            return
+        __dropped_repr_senders[sender] = True
+        while len(__dropped_repr_senders) > MAX_DROPPED_REPR_SENDERS:
+            __dropped_repr_senders.popitem(last=False)
+    print(f"Dropped python repr body sent by '{sender}', start the bridge with '--repr_compat_clients {sender}' "
+          f"to accept them")
+
+
+def decode_mqtt_message(topic: str, payload: bytes, validate_body: Callable[[dict], bool] = check_request_structure,
+                        repr_compat_clients: Optional[set] = None) -> Optional[Request]:
+    """
+    Decodes the payload of a mqtt message and returns the contained request if there is any.
+
+    The body has to pass 'validate_body'. Bodies that are no valid JSON are decoded as python repr if they were sent
+    by one of the 'repr_compat_clients'.
+    """
+
+    codec = detect_codec(payload) or JSON_CODEC
+    try:
+        body = codec.decode(payload)
+    except ValueError:
+        body = decode_repr_body(payload)
+        if not isinstance(body, dict):
+            print(f"Couldn't decode {codec.name} payload: {payload[:100]}")
+            return None
+        if body.get("sender") not in (repr_compat_clients or ()):
+            report_dropped_repr_body(body.get("sender"))
+            return None
+
+    if not validate_body(body):
+        print("Could not decode Request, Possible Reasons: Missing key(s) in request, Illegal Values for keys")
+        return None
+
+    try:
+        inc_req = Request.from_body(topic, body)
+        # print("Received: {}".format(inc_req.to_string()))
+        return inc_req
+
+    except (ValueError, KeyError, TypeError, RuntimeError):
+        print("Error creating Request")
+        return None
+
+
+def get_scoped_topic(path: str, receiver: Optional[str]) -> str:
+    """Returns the topic a request is published on to reach a receiver subscribed to the scoped topic scheme"""
+
+    if receiver is None or not path.startswith("smarthome/") or any(char in receiver for char in "/+#"):
+        return path
+    return SCOPED_TOPIC_PREFIX + receiver + path[len("smarthome"):]
+
+
+def get_request_path(topic: str) -> str:
+    """Returns the path of the request published on the topic, reverts the scoped topic scheme"""
+
+    if not topic.startswith(SCOPED_TOPIC_PREFIX):
+        return topic
+    _, sep, path = topic[len(SCOPED_TOPIC_PREFIX):].partition("/")
+    if not sep:
+        return topic
+    return "smarthome/" + path
+
+
+def get_subscriptions(scoped_receivers: Optional[list]) -> [str]:
+    """Returns the topics to subscribe to, only the ones addressed to 'scoped_receivers' if it is not None"""
+
+    if scoped_receivers is None:
+        return ["smarthome/#"]
+    return [SCOPED_TOPIC_PREFIX + receiver + "/#" for receiver in scoped_receivers] + [BROADCAST_TOPIC]
+
+
+def get_response_properties(response_topic: Optional[str], session_id: int) -> Properties:
+    """Returns the MQTT v5 properties routing the response to a request to the topic and waiter it belongs to"""
+
+    properties = Properties(PacketTypes.PUBLISH)
+    if response_topic is not None:
+        properties.ResponseTopic = response_topic
+    properties.CorrelationData = str(session_id).encode()
+    return properties
+
+
+def get_correlation_id(message: mqtt.MQTTMessage) -> Optional[int]:
+    """Returns the session id carried as correlation data of a MQTT v5 message, None if there is none"""
+
+    correlation_data = getattr(getattr(message, "properties", None), "CorrelationData", None)
+    try:
+        return int(correlation_data.decode())
+    except (AttributeError, ValueError, UnicodeDecodeError):
+        return None
+
+
+def get_mqtt_frame_size(topic: str, payload: bytes) -> int:
+    """Returns the size of the mqtt publish packet carrying the payload"""
+
+    # Fixed header, topic length and topic, payload
+    return 5 + 2 + len(topic.encode()) + len(payload)
+
+
 class MQTTConnector(NetworkConnector):
     """Class to implement a MQTT connection module"""
 
-    __client: mqtt.Client
+    # Broker connection, shared with all other mqtt users of the process connected to the same broker.
+    # The session keeps the connector alive until it is closed.
+    __session: Optional[MQTTSession] = None
+    __subscription: int
     __own_name: str
     __ip: str
     __port: int
@@ -26,106 +169,284 @@ class MQTTConnector(NetworkConnector):
     __mqtt_username: Optional[str]
     __mqtt_password: Optional[str]
 
-    __buf_queue: Queue
+    # Names to receive requests for in the scoped topic scheme, None to receive everything published
+    __scoped_receivers: Optional[list]
+
+    # Clients subscribed to the scoped topic scheme, requests to them are published on their scoped topics
+    __scoped_clients: set
+
+    # Clients known to send their bodies as python repr instead of JSON
+    __repr_compat_clients: set
+
+    # Queue the requests are published from and the settings to publish them with, identified by their path
+    __publish_queue: PublishQueue
+    __publish_classes: dict
+
+    # Seconds to wait for space in the full publish queue before a request is dropped
+    __publish_timeout: float
+
+    # Topic the broker delivers the responses to requests of this connector on, None if MQTT v5 is not used
+    __response_topic: Optional[str]
+    __response_subscription: Optional[int]
+
+    # Response topics and correlation data of received MQTT v5 requests, identified by sender and session id
+    __response_routes: OrderedDict
+    __response_routes_lock: Lock
+
+    # Shared subscription group of the shards of a bridge and the name of this shard, None if not sharded
+    __shard_group: Optional[str]
+    __shard_name: Optional[str]
+    __forward_subscription: Optional[int]
+
+    # Shards the senders of the received requests are assigned to, requests of other shards are forwarded to them
+    __shard_ring: Optional[ShardRing]
+
+    _push_receive = True
+
+    # Brokers accept far bigger messages, but there is no need to publish anything bigger in one piece
+    _max_frame_size = 256 * 1024
+
+    _binary_transport = True
 
     def __init__(self, own_name: str, mqtt_ip: str, mqtt_port: int, mqtt_user: Optional[str] = None,
-                 mqtt_pw: Optional[str] = None):
-        super().__init__()
+                 mqtt_pw: Optional[str] = None, scoped_receivers: Optional[list] = None,
+                 publish_queue_size: int = 1000, publish_timeout: float = 1, mqtt_v5: bool = False,
+                 shard_group: Optional[str] = None, shard_name: Optional[str] = None):
+        super().__init__(own_name)
         self.__own_name = own_name
-        self.__client = mqtt.Client(self.__own_name)
         self.__ip = mqtt_ip
         self.__port = mqtt_port
         self.__mqtt_username = mqtt_user
         self.__mqtt_password = mqtt_pw
-
-        self.__buf_queue = Queue()
-
-        if self.__mqtt_username and self.__mqtt_password:
-            self.__client.username_pw_set(self.__mqtt_username, self.__mqtt_password)
-        try:
-            self.__client.on_message = self.generate_callback(self.__buf_queue, self._request_validation_schema)
-            self.__client.on_disconnect = disconnect_callback
-            self.__client.on_connect = connect_callback
-
-            try:
-                self.__client.connect(self.__ip, self.__port, 10)
-            except OSError:
-                print("Could not connect to MQTT Server.")
-
-            self.__client.loop_start()
-            self.__client.subscribe("smarthome/#")
-
-        except ConnectionRefusedError as err:
-            print(err)
-
-    def __del__(self):
-        self.__client.disconnect()
-
-    @staticmethod
-    def generate_callback(request_queue: Queue, request_schema: dict):
-        """Generates a callback with captured queue"""
-
-        def buf_callback(client, userdata, message):
-            """Callback to attach to mqtt object, mqtt_res_queue gets catched in closure"""
-            topic = message.topic
-
-            try:
-                json_str = message.payload.decode("utf-8").replace("'", '"').replace("None", "null")
-            except UnicodeDecodeError:
-                print("Couldn't format json string")
-                return
-
-            try:
-                body = json.loads(json_str)
-            except json.decoder.JSONDecodeError:
-                print("Couldn't decode json: '{}'".format(json_str))
-                return
-
-            try:
-                validate(body, request_schema)
-            except ValidationError:
-                print("Could not decode Request, Possible Reasons: Missing key(s) in request, Illegal Values for keys")
-
-            try:
-                inc_req = Request(topic,
-                                  body["session_id"],
-                                  body["sender"],
-                                  body["receiver"],
-                                  body["payload"])
-                # print("Received: {}".format(inc_req.to_string()))
-
-                request_queue.put(inc_req)
-
-            except ValueError:
-                print("Error creating Request")
-
-        # Return closured callback
-        return buf_callback
-
-    def _receive_data(self) -> Optional[Request]:
-        if not self.__buf_queue.empty():
-            return self.__buf_queue.get()
-        return None
+        self.__scoped_receivers = scoped_receivers
+        self.__scoped_clients = set()
+        self.__repr_compat_clients = set()
+        self.__publish_classes = dict(DEFAULT_PUBLISH_CLASSES)
+        self.__publish_timeout = publish_timeout
+        self.__response_routes = OrderedDict()
+        self.__response_routes_lock = Lock()
+        if (shard_group is None) != (shard_name is None):
+            raise RuntimeError("Sharding needs both a shard group and a shard name")
+        self.__shard_group = shard_group
+        self.__shard_name = shard_name
+        self.__shard_ring = None
+
+        self.__session = get_session(self.__own_name, self.__ip, self.__port, self.__mqtt_username,
+                                     self.__mqtt_password, mqtt.MQTTv5 if mqtt_v5 else mqtt.MQTTv311,
+                                     self.__shard_group)
+        self.__publish_queue = PublishQueue(self.__session, publish_queue_size)
+
+        # Shards share the requests through the broker, each one only receives a part of them
+        subscriptions = get_subscriptions(self.__scoped_receivers)
+        self.__forward_subscription = None
+        if self.__shard_group is not None:
+            subscriptions = [get_shared_subscription(self.__shard_group, topic_filter)
+                             for topic_filter in subscriptions]
+            self.__forward_subscription = self.__session.subscribe(
+                [get_forward_topic(self.__shard_group, self.__shard_name, "#")], self.__on_forwarded,
+                self.__get_max_qos())
+        # Subscribing with a lower QoS than requests are published with would downgrade them on delivery
+        self.__subscription = self.__session.subscribe(subscriptions, self.__on_message, self.__get_max_qos())
+
+        # Connectors with the same name may share a session, so the response topic needs to be unique
+        self.__response_topic = None
+        self.__response_subscription = None
+        if mqtt_v5:
+            self.__response_topic = f"{RESPONSE_TOPIC_PREFIX}{self.__own_name}_{randint(0, 1000000)}"
+            self.__response_subscription = self.__session.subscribe([self.__response_topic], self.__on_response,
+                                                                    self.__get_max_qos())
+
+    def __on_message(self, message: mqtt.MQTTMessage):
+        """Callback for the mqtt network loop thread"""
+
+        self.__handle_message(message.topic, message, True)
+
+    def __on_forwarded(self, message: mqtt.MQTTMessage):
+        """Callback for the mqtt network loop thread, receives the requests other shards forwarded to this one"""
+
+        topic = get_forwarded_topic(self.__shard_group, self.__shard_name, message.topic)
+        if topic:
+            # Shards may disagree on the ring for a moment, forwarding again could send the request in circles
+            self.__handle_message(topic, message, False)
+
+    def __handle_message(self, topic: str, message: mqtt.MQTTMessage, forward: bool):
+        inc_req = decode_mqtt_message(get_request_path(topic), message.payload, self._validate_body,
+                                      self.__repr_compat_clients)
+        if inc_req is None:
+            return
+        if forward and self.__forward(inc_req, topic, message):
+            return
+        # Only MQTT v5 connections carry properties, the in-process broker hands them to every connector
+        properties = getattr(message, "properties", None) if self.__response_topic is not None else None
+        response_topic = getattr(properties, "ResponseTopic", None)
+        if response_topic is not None and inc_req.get_sender() != self.__own_name:
+            self.__add_response_route(inc_req, response_topic, getattr(properties, "CorrelationData", None))
+        self._process_received_request(inc_req)
+
+    def __forward(self, req: Request, topic: str, message: mqtt.MQTTMessage) -> bool:
+        """Forwards the received request to the shard its sender is assigned to. Returns False if it is this one."""
+
+        shard_ring = self.__shard_ring
+        if shard_ring is None or req.get_sender() == self.__own_name:
+            return False
+        shard = shard_ring.get_shard(req.get_sender())
+        if shard is None or shard == self.__shard_name:
+            return False
+        # The payload is passed on as received, the owning shard decodes it again
+        if not self.__publish_queue.put(get_forward_topic(self.__shard_group, shard, topic), message.payload,
+                                        message.qos, None, self.__get_publish_timeout(),
+                                        getattr(message, "properties", None)):
+            print(f"Publish queue is full, dropped request from '{req.get_sender()}' to shard '{shard}'")
+        return True
+
+    def __on_response(self, message: mqtt.MQTTMessage):
+        """Callback for the mqtt network loop thread, receives the responses the broker routes to this connector"""
+
+        # Late responses are dropped without decoding them
+        session_id = get_correlation_id(message)
+        if session_id not in self._pending_responses and session_id not in self._broadcast_responses:
+            return
+        inc_req = decode_mqtt_message(get_request_path(message.topic), message.payload, self._validate_body,
+                                      self.__repr_compat_clients)
+        if inc_req is not None:
+            self._process_received_request(inc_req)
+
+    def __add_response_route(self, req: Request, response_topic: str, correlation_data: Optional[bytes]):
+        """Remembers where to publish the response to a received MQTT v5 request"""
+
+        with self.__response_routes_lock:
+            self.__response_routes[(req.get_sender(), req.get_session_id())] = (response_topic, correlation_data)
+            while len(self.__response_routes) > MAX_RESPONSE_ROUTES:
+                self.__response_routes.popitem(last=False)
+
+    def __pop_response_route(self, req: Request) -> Optional[tuple]:
+        """Removes and returns the response topic and correlation data of the request the passed one responds to"""
+
+        with self.__response_routes_lock:
+            return self.__response_routes.pop((req.get_receiver(), req.get_session_id()), None)
+
+    def __get_properties(self, req: Request) -> Optional[Properties]:
+        """Returns the MQTT v5 properties for the responses to the request to reach this connector directly"""
+
+        if self.__response_topic is None:
+            return None
+        session_id = req.get_session_id()
+        if session_id not in self._pending_responses and session_id not in self._broadcast_responses:
+            return None
+        return get_response_properties(self.__response_topic, session_id)
+
+    def __get_topic(self, req: Request) -> str:
+        """Returns the topic to publish the request on"""
+
+        if req.get_receiver() in self.__scoped_clients:
+            return get_scoped_topic(req.get_path(), req.get_receiver())
+        return req.get_path()
+
+    def _get_frame_size(self, req: Request) -> int:
+        return get_mqtt_frame_size(self.__get_topic(req), self._encode_body(req))
 
     def _send_data(self, req: Request):
-        self.__client.publish(req.get_path(), json.dumps(req.get_body()))
-
-    def send_broadcast(self, req: Request, timeout: int = 6) -> [Request]:
-
-        responses: [Request] = []
-        json_str = json.dumps(req.get_body())
-        self.__client.publish(req.get_path(), json_str)
-        timeout_time = time.time() + timeout
-        while time.time() < timeout_time:
-            if not self._message_queue.empty():
-                res: Request = self._message_queue.get()
-                # print("Got from Queue: {}".format(res.to_string()))
-                if res.get_path() == "smarthome/broadcast/res" and res.get_session_id() == req.get_session_id():
-                    responses.append(res)
-        return responses
+        publish_class = self.get_publish_class(req.get_path())
+        topic = self.__get_topic(req)
+        properties = self.__get_properties(req)
+
+        # Responses to MQTT v5 requests go straight to the waiting sender, clients without v5 get them the old way
+        route = self.__pop_response_route(req)
+        if route is not None:
+            topic, correlation_data = route
+            properties = Properties(PacketTypes.PUBLISH)
+            if correlation_data is not None:
+                properties.CorrelationData = correlation_data
+
+        if not self.__publish_queue.put(topic, self._encode_body(req), publish_class.qos,
+                                        publish_class.get_coalesce_key(req), self.__get_publish_timeout(),
+                                        properties):
+            print(f"Publish queue is full, dropped request to '{req.get_receiver()}' on '{req.get_path()}'")
+
+    def __get_publish_timeout(self) -> float:
+        """Returns the seconds to wait for space in the publish queue"""
+
+        # The network loop delivering messages must not wait for the queue, its worker needs the loop to publish
+        if self.__session.in_dispatch():
+            return 0
+        return self.__publish_timeout
+
+    def set_publish_class(self, path: str, publish_class: PublishClass):
+        """Sets the settings to publish requests with the path with"""
+
+        self.__publish_classes[path] = publish_class
+
+    def __get_max_qos(self) -> int:
+        """Returns the highest QoS requests are published with"""
+
+        return max([DEFAULT_PUBLISH_CLASS.qos] +
+                   [publish_class.qos for publish_class in self.__publish_classes.values()])
+
+    def get_publish_class(self, path: str) -> PublishClass:
+        """Returns the settings requests with the path are published with"""
+
+        return self.__publish_classes.get(path, DEFAULT_PUBLISH_CLASS)
+
+    def publish_congested(self) -> bool:
+        """Returns whether the publish queue is filling up and senders should slow down"""
+
+        return self.__publish_queue.is_congested()
+
+    def get_publish_stats(self) -> dict:
+        """Returns the depth and the counters of the publish queue"""
+
+        return self.__publish_queue.get_stats()
+
+    def set_client_scoped_topics(self, client_name: str, scoped: bool):
+        """Sets whether the client is subscribed to the scoped topic scheme"""
+
+        if scoped:
+            self.__scoped_clients.add(client_name)
+        else:
+            self.__scoped_clients.discard(client_name)
+
+    def get_client_scoped_topics(self, client_name: str) -> bool:
+        """Returns whether requests to the client are published on its scoped topics"""
+
+        return client_name in self.__scoped_clients
+
+    def set_client_repr_compat(self, client_name: str, enabled: bool):
+        """Sets whether bodies sent by the client as python repr instead of JSON are accepted"""
+
+        if enabled:
+            self.__repr_compat_clients.add(client_name)
+        else:
+            self.__repr_compat_clients.discard(client_name)
+
+    def set_shard_ring(self, shard_ring: Optional[ShardRing]):
+        """Sets the shards the senders of requests are assigned to, None to handle every received request here"""
+
+        self.__shard_ring = shard_ring
+
+    def get_shard_ring(self) -> Optional[ShardRing]:
+        return self.__shard_ring
+
+    def get_response_topic(self) -> Optional[str]:
+        """Returns the topic responses to requests of this connector are routed to, None if MQTT v5 is not used"""
+
+        return self.__response_topic
 
     def connected(self) -> bool:
-        return self.__client.is_connected()
+        return self.__session is not None and self.__session.connected()
+
+    def close(self):
+        """Stops receiving requests and hands the broker connection back"""
+
+        if self.__session is None:
+            return
+        self.__publish_queue.close()
+        self.__session.unsubscribe(self.__subscription)
+        if self.__response_subscription is not None:
+            self.__session.unsubscribe(self.__response_subscription)
+        if self.__forward_subscription is not None:
+            self.__session.unsubscribe(self.__forward_subscription)
+        release_session(self.__session)
+        self.__session = None
 
 
 if __name__ == '__main__':
@@ -21,7 +21,7 @@ class EchoThread(threading.Thread):
 
     def run(self):
         while not self.__kill_flag:
-            buf_req = self.__connector.get_request()
+            buf_req = self.__connector.get_request(timeout=0.5)
             if buf_req and buf_req.get_receiver() == self.__listener_name:
                 print(f"Responding to Request from '{buf_req.get_sender()}' on '{buf_req.get_path()}'")
                 res = buf_req.get_response(payload=buf_req.get_payload())
@@ -62,6 +62,7 @@ class MQTTTestEchoClient:
     def quit(self):
         print("Shutting down Responder")
         self.__client_thread.kill()
+        self.__connector.close()
 
     def get_name(self):
         return "echo_tester"
@@ -0,0 +1,164 @@
+"""Module to contain the queue outgoing mqtt messages are published from"""
+import paho.mqtt.client as mqtt
+from paho.mqtt.properties import Properties
+from collections import OrderedDict
+from request import Request
+from split_requests import is_split_request
+from mqtt_session import MQTTSession
+from typing import Optional
+from threading import Thread, Condition
+
+
+class PublishClass:
+    """Class to represent the settings a kind of request is published with"""
+
+    qos: int
+
+    # Payload keys identifying the messages a newer one supersedes, None if messages are never superseded
+    coalesce_keys: Optional[list]
+
+    def __init__(self, qos: int = 0, coalesce_keys: Optional[list] = None):
+        if qos not in [0, 1, 2]:
+            raise RuntimeError(f"Illegal QoS {qos}")
+        self.qos = qos
+        self.coalesce_keys = coalesce_keys
+
+    def get_coalesce_key(self, req: Request) -> Optional[tuple]:
+        """Returns the key identifying the messages the request supersedes, None if it must not replace any"""
+
+        if self.coalesce_keys is None or is_split_request(req):
+            return None
+        payload = req.get_payload()
+        if any(key not in payload for key in self.coalesce_keys):
+            return None
+        return (req.get_receiver(),) + tuple(payload[key] for key in self.coalesce_keys)
+
+
+DEFAULT_PUBLISH_CLASS = PublishClass()
+
+# Settings for the kinds of requests that are not published with the default settings, identified by their path.
+# Only the latest value of a characteristic is relevant, configs must not get lost.
+DEFAULT_PUBLISH_CLASSES = {
+    "smarthome/remotes/gadget/to_client/update": PublishClass(0, ["name", "characteristic"]),
+    "smarthome/config/write": PublishClass(1)
+}
+
+
+class PublishQueue:
+    """Class to implement a bounded queue of outgoing messages, published by a worker thread"""
+
+    __session: MQTTSession
+    __max_size: int
+
+    # Messages waiting to be published, identified by their coalesce key or a unique number
+    __messages: OrderedDict
+    __next_key: int
+
+    # Seconds to wait for the broker connection to take a batch of messages before publishing the next one
+    __flush_timeout: float
+
+    __running: bool
+    __condition: Condition
+    __worker: Thread
+
+    __published: int
+    __coalesced: int
+    __dropped: int
+    __max_queued: int
+
+    def __init__(self, session: MQTTSession, max_size: int = 1000, flush_timeout: float = 5):
+        self.__session = session
+        self.__max_size = max_size
+        self.__messages = OrderedDict()
+        self.__next_key = 0
+        self.__flush_timeout = flush_timeout
+        self.__running = True
+        self.__condition = Condition()
+        self.__published = 0
+        self.__coalesced = 0
+        self.__dropped = 0
+        self.__max_queued = 0
+        self.__worker = Thread(target=self.__publish_messages, daemon=True)
+        self.__worker.start()
+
+    def __publish_messages(self):
+        """Publishes the queued messages in batches until the queue is closed"""
+
+        while True:
+            with self.__condition:
+                self.__condition.wait_for(lambda: self.__messages or not self.__running)
+                if not self.__messages:
+                    return
+                batch = list(self.__messages.values())
+                self.__messages.clear()
+                self.__condition.notify_all()
+
+            last_info = None
+            failed = 0
+            for topic, payload, qos, properties in batch:
+                info = self.__session.publish(topic, payload, qos, properties)
+                if info.rc == mqtt.MQTT_ERR_SUCCESS:
+                    last_info = info
+                else:
+                    failed += 1
+
+            # Waiting for the batch to leave keeps the messages in this queue instead of paho's unbounded one
+            if last_info is not None:
+                try:
+                    last_info.wait_for_publish(self.__flush_timeout)
+                except (RuntimeError, ValueError):
+                    pass
+
+            with self.__condition:
+                self.__published += len(batch) - failed
+                self.__dropped += failed
+
+    def put(self, topic: str, payload: bytes, qos: int = 0, coalesce_key: Optional[tuple] = None,
+            timeout: Optional[float] = 1, properties: Optional[Properties] = None) -> bool:
+        """
+        Queues a message, replaces a queued message with the same topic and 'coalesce_key' if there is one.
+
+        Blocks up to 'timeout' seconds while the queue is full. Returns False if the message was dropped.
+        """
+
+        key = None if coalesce_key is None else (topic, coalesce_key)
+        with self.__condition:
+            if key is None or key not in self.__messages:
+                has_space = self.__condition.wait_for(lambda: len(self.__messages) < self.__max_size or
+                                                      not self.__running or key in self.__messages, timeout)
+                if not has_space or not self.__running:
+                    self.__dropped += 1
+                    return False
+            if key is None:
+                key = self.__next_key
+                self.__next_key += 1
+            elif key in self.__messages:
+                self.__coalesced += 1
+            self.__messages[key] = (topic, payload, qos, properties)
+            self.__max_queued = max(self.__max_queued, len(self.__messages))
+            self.__condition.notify_all()
+        return True
+
+    def is_congested(self) -> bool:
+        """Returns whether the queue is filled more than three quarters, senders should slow down"""
+
+        with self.__condition:
+            return len(self.__messages) * 4 > self.__max_size * 3
+
+    def get_stats(self) -> dict:
+        """Returns the queue depth and the counters of the published, coalesced and dropped messages"""
+
+        with self.__condition:
+            return {"queued": len(self.__messages),
+                    "max_queued": self.__max_queued,
+                    "published": self.__published,
+                    "coalesced": self.__coalesced,
+                    "dropped": self.__dropped}
+
+    def close(self):
+        """Publishes the remaining messages and stops the worker"""
+
+        with self.__condition:
+            self.__running = False
+            self.__condition.notify_all()
+        self.__worker.join()
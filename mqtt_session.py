@@ -0,0 +1,322 @@
+"""Module to contain the broker connections shared by all mqtt users of the process"""
+import paho.mqtt.client as mqtt
+from abc import ABC, abstractmethod
+from paho.mqtt.properties import Properties
+from random import randint
+from typing import Optional, Callable
+from threading import Lock, local
+
+MessageCallback = Callable[[mqtt.MQTTMessage], None]
+
+# Address of the in-process broker, connects all users of the process without a real broker
+MEMORY_BROKER = "memory"
+
+SHARED_SUBSCRIPTION_PREFIX = "$share/"
+
+
+def split_shared_filter(topic_filter: str) -> (Optional[str], str):
+    """Returns the group of a shared subscription and the filter the topics are matched against"""
+
+    if not topic_filter.startswith(SHARED_SUBSCRIPTION_PREFIX):
+        return None, topic_filter
+    group, _, topic_filter = topic_filter[len(SHARED_SUBSCRIPTION_PREFIX):].partition("/")
+    return group, topic_filter
+
+
+class MQTTSession(ABC):
+    """Class to implement the dispatching of received messages to the consumers subscribed to their topics"""
+
+    __key: tuple
+
+    # Topic filters and callbacks of the consumers, identified by the handle returned on subscribing
+    __consumers: dict
+
+    # Number of consumers subscribed to each topic filter, filters are only subscribed on the broker once
+    __filter_counts: dict
+
+    # Highest QoS any consumer asked for on each topic filter, the filters are subscribed with it
+    __filter_qos: dict
+
+    # Marks the threads currently handing a message to the consumers
+    __dispatching: local
+
+    __next_handle: int
+
+    # Number of messages delivered to shared subscriptions, used to pick the next member of a group
+    __shared_deliveries: int
+
+    # Whether the session has to pick the member of a shared subscription group receiving a message.
+    # Brokers do that on their own and only send a message to the session they picked.
+    _balance_shared_subscriptions: bool = False
+
+    # Number of users sharing the session, the connection is closed when the last one releases it
+    __users: int
+
+    _lock: Lock
+
+    def __init__(self, key: tuple):
+        self.__key = key
+        self.__consumers = {}
+        self.__filter_counts = {}
+        self.__filter_qos = {}
+        self.__dispatching = local()
+        self.__next_handle = 0
+        self.__shared_deliveries = 0
+        self.__users = 0
+        self._lock = Lock()
+
+    def _subscribe_filters(self, topic_filters: [tuple]):
+        """Subscribes the topic filters on the broker, passed as pairs of filter and QoS"""
+        pass
+
+    def _unsubscribe_filters(self, topic_filters: [str]):
+        """Unsubscribes the topic filters on the broker"""
+        pass
+
+    def _get_topic_filters(self) -> [tuple]:
+        """Returns all topic filters any consumer is subscribed to together with the QoS to subscribe them with"""
+
+        with self._lock:
+            return list(self.__filter_qos.items())
+
+    def in_dispatch(self) -> bool:
+        """Returns whether the calling thread is handing a received message to the consumers"""
+
+        return getattr(self.__dispatching, "active", False)
+
+    def _dispatch(self, message: mqtt.MQTTMessage):
+        """Hands the message to every consumer subscribed to its topic"""
+
+        with self._lock:
+            consumers = list(self.__consumers.values())
+        callbacks = []
+        shared_groups = {}
+        for topic_filters, callback in consumers:
+            groups = set()
+            for topic_filter in topic_filters:
+                group, topic_filter = split_shared_filter(topic_filter)
+                if mqtt.topic_matches_sub(topic_filter, message.topic):
+                    groups.add(group)
+            if None in groups or (groups and not self._balance_shared_subscriptions):
+                callbacks.append(callback)
+            else:
+                for group in groups:
+                    shared_groups.setdefault(group, []).append(callback)
+
+        # Every shared subscription group receives the message once, the members take turns
+        for members in shared_groups.values():
+            with self._lock:
+                self.__shared_deliveries += 1
+                callbacks.append(members[self.__shared_deliveries % len(members)])
+
+        # The in-process broker dispatches on the publishing thread, which may be dispatching already
+        was_dispatching = self.in_dispatch()
+        self.__dispatching.active = True
+        try:
+            self.__call_consumers(callbacks, message)
+        finally:
+            self.__dispatching.active = was_dispatching
+
+    @staticmethod
+    def __call_consumers(callbacks: list, message: mqtt.MQTTMessage):
+        for callback in callbacks:
+            # A failing consumer must not stop the network loop all other consumers depend on
+            try:
+                callback(message)
+            except Exception as err:
+                print(f"Error handling mqtt message on '{message.topic}': {err}")
+
+    def get_key(self) -> tuple:
+        """Returns the broker and credentials the session was opened for"""
+
+        return self.__key
+
+    def subscribe(self, topic_filters: [str], callback: MessageCallback, qos: int = 0) -> int:
+        """
+        Subscribes a consumer to the topic filters. The callback is called once for every matching message.
+
+        The broker delivers messages with the lower of 'qos' and the QoS they were published with.
+        Returns a handle to unsubscribe the consumer with.
+        """
+
+        with self._lock:
+            handle = self.__next_handle
+            self.__next_handle += 1
+            self.__consumers[handle] = (list(topic_filters), callback)
+            # Filters are subscribed again if a consumer needs a higher QoS than the earlier ones
+            new_filters = [(topic_filter, qos) for topic_filter in topic_filters
+                           if self.__filter_qos.get(topic_filter, -1) < qos]
+            for topic_filter in topic_filters:
+                self.__filter_counts[topic_filter] = self.__filter_counts.get(topic_filter, 0) + 1
+            for topic_filter, filter_qos in new_filters:
+                self.__filter_qos[topic_filter] = filter_qos
+        if new_filters:
+            self._subscribe_filters(new_filters)
+        return handle
+
+    def unsubscribe(self, handle: int):
+        """Removes the consumer, topic filters no other consumer uses are unsubscribed on the broker"""
+
+        with self._lock:
+            if handle not in self.__consumers:
+                return
+            topic_filters, _ = self.__consumers.pop(handle)
+            unused_filters = []
+            for topic_filter in topic_filters:
+                self.__filter_counts[topic_filter] -= 1
+                if self.__filter_counts[topic_filter] <= 0:
+                    del self.__filter_counts[topic_filter]
+                    del self.__filter_qos[topic_filter]
+                    unused_filters.append(topic_filter)
+        if unused_filters:
+            self._unsubscribe_filters(unused_filters)
+
+    @abstractmethod
+    def publish(self, topic: str, payload: bytes, qos: int = 0,
+                properties: Optional[Properties] = None) -> mqtt.MQTTMessageInfo:
+        """Publishes the payload on the topic. The properties are only transmitted by MQTT v5 sessions."""
+
+    def connected(self) -> bool:
+        return False
+
+    def add_user(self):
+        with self._lock:
+            self.__users += 1
+
+    def remove_user(self) -> bool:
+        """Removes a user of the session. Returns whether it was the last one."""
+
+        with self._lock:
+            self.__users -= 1
+            return self.__users <= 0
+
+    def close(self):
+        """Closes the connection to the broker"""
+        pass
+
+
+class BrokerSession(MQTTSession):
+    """Class to represent one connection to a mqtt broker"""
+
+    __client: mqtt.Client
+
+    def __init__(self, key: tuple, client_id: str, mqtt_ip: str, mqtt_port: int, mqtt_user: Optional[str] = None,
+                 mqtt_pw: Optional[str] = None, protocol: int = mqtt.MQTTv311):
+        super().__init__(key)
+        self.__client = mqtt.Client(client_id, protocol=protocol)
+
+        if mqtt_user and mqtt_pw:
+            self.__client.username_pw_set(mqtt_user, mqtt_pw)
+        self.__client.on_message = self.__on_message
+        self.__client.on_connect = self.__on_connect
+        self.__client.on_disconnect = self.__on_disconnect
+
+        try:
+            self.__client.connect(mqtt_ip, mqtt_port, 10)
+        except (OSError, ConnectionRefusedError):
+            print("Could not connect to MQTT Server.")
+        self.__client.loop_start()
+
+    def __on_connect(self, client, userdata, flags, reason_code, properties=None):
+        """Callback for the mqtt network loop thread, restores the subscriptions after reconnecting"""
+
+        print("MQTT connected.")
+        topic_filters = self._get_topic_filters()
+        if topic_filters:
+            self._subscribe_filters(topic_filters)
+
+    @staticmethod
+    def __on_disconnect(client, userdata, reason_code, properties=None):
+        print("MQTT disconnected.")
+
+    def __on_message(self, client, userdata, message: mqtt.MQTTMessage):
+        """Callback for the mqtt network loop thread"""
+
+        self._dispatch(message)
+
+    def _subscribe_filters(self, topic_filters: [tuple]):
+        self.__client.subscribe(topic_filters)
+
+    def _unsubscribe_filters(self, topic_filters: [str]):
+        self.__client.unsubscribe(topic_filters)
+
+    def publish(self, topic: str, payload: bytes, qos: int = 0,
+                properties: Optional[Properties] = None) -> mqtt.MQTTMessageInfo:
+        return self.__client.publish(topic, payload, qos, properties=properties)
+
+    def connected(self) -> bool:
+        return self.__client.is_connected()
+
+    def close(self):
+        self.__client.disconnect()
+        self.__client.loop_stop()
+
+
+class MemorySession(MQTTSession):
+    """Class to implement an in-process broker, published messages are handed to the consumers directly"""
+
+    _balance_shared_subscriptions = True
+
+    def publish(self, topic: str, payload: bytes, qos: int = 0,
+                properties: Optional[Properties] = None) -> mqtt.MQTTMessageInfo:
+        message = mqtt.MQTTMessage(topic=topic.encode())
+        message.payload = payload
+        message.qos = qos
+        message.properties = properties
+        self._dispatch(message)
+
+        info = mqtt.MQTTMessageInfo(0)
+        info._set_as_published()
+        return info
+
+    def connected(self) -> bool:
+        return True
+
+
+# Open sessions of the process, identified by broker address, username and protocol version
+_sessions: dict = {}
+_sessions_lock = Lock()
+
+
+def get_session(client_name: str, mqtt_ip: str, mqtt_port: int, mqtt_user: Optional[str] = None,
+                mqtt_pw: Optional[str] = None, protocol: int = mqtt.MQTTv311,
+                shared_group: Optional[str] = None) -> MQTTSession:
+    """
+    Returns the session connected to the broker, opens a new one if there is none yet.
+    Passing MEMORY_BROKER as 'mqtt_ip' returns the in-process broker identified by 'mqtt_port',
+    it carries the properties of MQTT v5 regardless of 'protocol'.
+
+    Users of shared subscriptions pass their 'shared_group' to get a connection only used by the group. A broker
+    delivers every message matching a plain subscription of a connection, the session could not tell those apart
+    from the ones it was picked for by the shared subscription. The in-process broker makes that distinction itself.
+
+    The session has to be handed back using 'release_session' once it is not needed anymore.
+    """
+
+    if mqtt_ip == MEMORY_BROKER:
+        protocol = None
+        shared_group = None
+    key = (mqtt_ip, mqtt_port, mqtt_user, protocol, shared_group)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None and mqtt_ip == MEMORY_BROKER:
+            session = MemorySession(key)
+            _sessions[key] = session
+        elif session is None:
+            # Brokers drop connections sharing a client id, so the id has to be unique
+            session = BrokerSession(key, f"{client_name}_{randint(0, 1000000)}", mqtt_ip, mqtt_port, mqtt_user,
+                                    mqtt_pw, protocol)
+            _sessions[key] = session
+        session.add_user()
+        return session
+
+
+def release_session(session: MQTTSession):
+    """Hands back a session, the connection is closed if nobody else uses it"""
+
+    with _sessions_lock:
+        if not session.remove_user():
+            return
+        if _sessions.get(session.get_key()) is session:
+            del _sessions[session.get_key()]
+    session.close()
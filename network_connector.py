@@ -1,187 +1,326 @@
-import json
 from request import Request
+from connector_base import ConnectorBase
+from split_requests import is_window_ack
 from typing import Optional
-from queue import Queue
-from datetime import datetime, timedelta
-from time import sleep
+from queue import Queue, Empty
+from threading import Event, Lock
+from time import sleep, time
 
 Req_Response = tuple[Optional[bool], Optional[Request]]
 
 
-class NetworkConnector:
-    """Class to implement an network interface prototype"""
+class PendingResponse:
+    """Class to represent a sent request waiting for its response"""
 
-    _message_queue: Queue
-    _request_validation_schema: dict
+    __request: Request
+    __event: Event
+    __response: Optional[Request]
 
-    __part_data: dict
+    def __init__(self, req: Request):
+        self.__request = req
+        self.__event = Event()
+        self.__response = None
 
-    def __init__(self):
-        self._connected = False
-        self._message_queue = Queue()
-        self.__part_data = {}
-        with open("json_schemas/request_basic_structure.json", "r") as f:
-            self._request_validation_schema = json.load(f)
+    def get_request(self) -> Request:
+        """Returns the request waiting for a response"""
 
-    def _send_data(self, req: Request):
-        print(f"Not implemented: '_send_data'")
+        return self.__request
 
-    def _receive_data(self) -> Optional[Request]:
-        print(f"Not implemented: '_receive_data'")
-        return None
+    def matches(self, res: Request) -> bool:
+        """Checks whether the passed request is a response to the waiting request"""
 
-    def get_request(self) -> Optional[Request]:
-        """Returns a request if there is one"""
+        return res.get_session_id() == self.__request.get_session_id() and \
+            res.get_sender() != self.__request.get_sender()
 
-        self.__receive()
+    def set_response(self, res: Request):
+        """Saves the response and wakes up the waiting thread"""
 
-        if not self._message_queue.empty():
-            return self._message_queue.get()
-        return None
+        self.__response = res
+        self.__event.set()
 
-    def __receive(self):
-        received_request = self._receive_data()
-        if received_request:
-            req_payload = received_request.get_payload()
-            if "package_index" in req_payload and "split_payload" in req_payload:
-                id_str = str(received_request.get_session_id())
-                p_index = req_payload["package_index"]
-                split_payload = req_payload["split_payload"]
-                if p_index == 0:
-                    if "last_index" in req_payload:
-                        l_index = req_payload["last_index"]
-                        buf_json = {"start_req": received_request, "last_index": l_index, "payload_bits": []}
-                        for i in range(l_index + 1):
-                            buf_json["payload_bits"].append(None)
-                        buf_json["payload_bits"][0] = split_payload
-                        self.__part_data[id_str] = buf_json
-                    else:
-                        print("Received first block of split request without last_index")
-                else:
-                    if id_str in self.__part_data:
-                        req_data = self.__part_data[id_str]
-                        req_data["payload_bits"][p_index] = split_payload
-                        if p_index >= req_data["last_index"]:
-                            end_data = ""
-                            for str_data in req_data["payload_bits"]:
-                                if str_data is None:
-                                    print("Detected missing data block")
-                                    break
-                                end_data += str_data
-                            try:
-                                end_data = end_data.replace("$*$", '"')
-                                json_data = json.loads(end_data)
-                                first_req: Request = req_data["start_req"]
-
-                                out_req = Request(first_req.get_path(),
-                                                  first_req.get_session_id(),
-                                                  first_req.get_sender(),
-                                                  first_req.get_receiver(),
-                                                  json_data)
-                                self._message_queue.put(out_req)
-                                del self.__part_data[id_str]
-                            except json.decoder.JSONDecodeError:
-                                print("Received illegal payload")
-
-                    else:
-                        print("Received a followup-block with no entry in storage")
+    def get_response(self) -> Optional[Request]:
+        """Returns the response if there is one"""
 
-            else:
-                self._message_queue.put(received_request)
+        return self.__response
 
-    def send_request(self, req: Request, timeout: int = 6) -> Req_Response:
-        """
-        Sends a request and waits for a response by default.
+    def is_done(self) -> bool:
+        """Returns whether a response was received"""
 
-        Returns the Ack-Status of the response, the status message of the response and the response itself.
-        """
-        self._send_data(req)
-        if timeout > 0:
-            timeout_time = datetime.now() + timedelta(seconds=timeout)
-            checked_requests_list = Queue()
-            while datetime.now() < timeout_time:
+        return self.__event.is_set()
 
-                self.__receive()
+    def wait(self, timeout: float) -> bool:
+        """Blocks until a response was received or the timeout is reached. Returns whether there is a response."""
 
-                if not self._message_queue.empty():
-                    res: Request = self._message_queue.get()
-                    if res.get_session_id() == req.get_session_id() and req.get_sender() != res.get_sender():
-                        res_ack = res.get_ack()
+        return self.__event.wait(timeout)
 
-                        # Put checked requests back in queue
-                        while not checked_requests_list.empty():
-                            self._message_queue.put(checked_requests_list.get())
 
-                        return res_ack, res
+class NetworkConnector(ConnectorBase):
+    """Class to implement an network interface prototype"""
 
-                    # Save request to put it back in queue later
-                    checked_requests_list.put(res)
+    _message_queue: Queue
 
-            # Put checked requests back in queue
-            while not checked_requests_list.empty():
-                self._message_queue.put(checked_requests_list.get())
-            return None, None
+    # Lists of requests waiting for their responses, identified by their session id
+    _pending_responses: dict
 
-        return None, None
+    # Queues collecting the responses to sent broadcasts, identified by their session id
+    _broadcast_responses: dict
 
-    def send_broadcast(self, req: Request, timeout: int = 5) -> [Request]:
-        responses: [Request] = []
-        self._send_data(req)
-        timeout_time = datetime.now() + timedelta(seconds=timeout)
-        # checked_requests_list = Queue()
-        while datetime.now() < timeout_time:
-            if not self._message_queue.empty():
-                res: Request = self._message_queue.get()
-                # print("Got from Queue: {}".format(res.to_string()))
-                if res.get_path() == "smarthome/broadcast/res" and res.get_session_id() == req.get_session_id():
-                    responses.append(res)
-        return responses
+    # Whether the connector delivers received requests on its own by calling '_process_received_request' (True)
+    # or needs to be polled using '_receive_data' (False)
+    _push_receive: bool = False
 
-    def send_request_split(self, req: Request, part_max_size: int = 30, timeout: int = 6) -> Req_Response:
-        session_id = req.get_session_id()
-        path = req.get_path()
-        sender = req.get_sender()
-        receiver = req.get_receiver()
+    # Lock for the pending responses and the broadcasts waiting for responses
+    __lock: Lock
 
-        payload_str = json.dumps(req.get_payload())
+    # Locks making sure only one thread at a time reads from or writes to the transport
+    __receive_lock: Lock
+    __send_lock: Lock
 
-        # Make string ready to be contained in json itself
-        payload_str = payload_str.replace('"', "$*$")
+    def __init__(self, own_name: Optional[str] = None):
+        super().__init__(own_name)
+        self._connected = False
+        self._message_queue = Queue()
+        self._pending_responses = {}
+        self._broadcast_responses = {}
+        self.__lock = Lock()
+        self.__receive_lock = Lock()
+        self.__send_lock = Lock()
 
-        payload_len = len(payload_str)
-        parts = []
-        start = 0
-        package_index = 0
+    def _send_data(self, req: Request):
+        print(f"Not implemented: '_send_data'")
 
-        while start < payload_len:
-            end = start + part_max_size
-            payload_part = payload_str[start:(end if end < payload_len else payload_len)]
-            parts.append(payload_part)
-            start = end
+    def _receive_data(self) -> Optional[Request]:
+        """Polls the transport for a request. Not needed for connectors using '_push_receive'."""
+        return None
 
-        last_index = len(parts)
+    def get_request(self, timeout: Optional[float] = 0) -> Optional[Request]:
+        """
+        Returns a request if there is one.
 
-        for payload_part in parts:
+        Waits up to 'timeout' seconds for a request to arrive, forever if 'timeout' is None.
+        """
 
-            out_dict = {"package_index": package_index, "split_payload": payload_part}
-            if package_index == 0:
-                out_dict["last_index"] = last_index
+        if self._push_receive:
+            try:
+                if timeout is not None and timeout <= 0:
+                    return self._message_queue.get_nowait()
+                return self._message_queue.get(timeout=timeout)
+            except Empty:
+                return None
+
+        timeout_time = None if timeout is None else time() + timeout
+        while True:
+            if self._message_queue.empty():
+                self.__receive()
+            if not self._message_queue.empty():
+                return self._message_queue.get()
+            if timeout_time is not None and time() >= timeout_time:
+                return None
+
+    def requests(self, timeout: Optional[float] = None):
+        """Yields the received requests until there was none for 'timeout' seconds. Runs forever if it is None."""
+
+        while True:
+            req = self.get_request(timeout)
+            if req is None:
+                return
+            yield req
+
+    def __send(self, req: Request):
+        with self.__send_lock:
+            self._send_data(req)
+
+    def __receive(self, blocking: bool = True) -> bool:
+        """Polls the transport once. Returns False if another thread is currently reading and 'blocking' is unset."""
+
+        if not self.__receive_lock.acquire(blocking):
+            return False
+        try:
+            received_request = self._receive_data()
+        finally:
+            self.__receive_lock.release()
+        if received_request:
+            self._process_received_request(received_request)
+        return True
+
+    def _process_received_request(self, received_request: Request):
+        """Reassembles split requests and hands them to a waiting sender or the message queue"""
+
+        buf_req, window_ack = self._add_to_split_buffer(received_request)
+        if buf_req is None:
+            if window_ack is not None:
+                self.__send(window_ack)
+            return
+
+        with self.__lock:
+            broadcast_responses: Optional[Queue] = None
+            pending = None
+            if buf_req.get_path() == "smarthome/broadcast/res":
+                broadcast_responses = self._broadcast_responses.get(buf_req.get_session_id())
+            if broadcast_responses is None:
+                pending = self.__pop_pending_response(buf_req)
+
+        if broadcast_responses is not None:
+            broadcast_responses.put(buf_req)
+        elif pending is not None:
+            pending.set_response(buf_req)
+        else:
+            self._message_queue.put(buf_req)
+
+    def __pop_pending_response(self, res: Request) -> Optional[PendingResponse]:
+        """Removes and returns the oldest pending request the passed request responds to. Needs '__lock'."""
+
+        pending_list: Optional[list] = self._pending_responses.get(res.get_session_id())
+        if not pending_list:
+            return None
+        for pending in pending_list:
+            if pending.matches(res):
+                pending_list.remove(pending)
+                if not pending_list:
+                    del self._pending_responses[res.get_session_id()]
+                return pending
+        return None
 
-            out_req = Request(path,
-                              session_id,
-                              sender,
-                              receiver,
-                              out_dict)
-            if package_index == last_index:
-                res_ack, res = self.send_request(out_req, timeout)
+    def __add_pending_response(self, pending: PendingResponse):
+        with self.__lock:
+            self._pending_responses.setdefault(pending.get_request().get_session_id(), []).append(pending)
+
+    def __remove_pending_response(self, pending: PendingResponse):
+        session_id = pending.get_request().get_session_id()
+        with self.__lock:
+            pending_list: Optional[list] = self._pending_responses.get(session_id)
+            if pending_list and pending in pending_list:
+                pending_list.remove(pending)
+                if not pending_list:
+                    del self._pending_responses[session_id]
+
+    def __wait_for_response(self, pending: PendingResponse, timeout: float) -> bool:
+        """Waits for the pending request to be answered. Returns whether a response was received."""
+
+        if self._push_receive:
+            return pending.wait(timeout)
+
+        timeout_time = time() + timeout
+        while not pending.is_done():
+            remaining = timeout_time - time()
+            if remaining <= 0:
+                break
+            if not self.__receive(blocking=False):
+                # Another thread is reading and completes this request as soon as its response arrives
+                pending.wait(min(remaining, 0.05))
+        return pending.is_done()
 
-                return res_ack, res
+    def send_request(self, req: Request, timeout: int = 6) -> Req_Response:
+        """
+        Sends a request and waits for a response by default.
+
+        Returns the Ack-Status of the response and the response itself.
+        """
+        if timeout <= 0:
+            self.__send(req)
+            return None, None
+
+        pending = PendingResponse(req)
+        self.__add_pending_response(pending)
+        try:
+            self.__send(req)
+            if self.__wait_for_response(pending, timeout):
+                res = pending.get_response()
+                return res.get_ack(), res
+            return None, None
+        finally:
+            self.__remove_pending_response(pending)
+
+    def __wait_for_broadcast_response(self, responses: Queue, timeout_time: float) -> Optional[Request]:
+        """Waits until a response to the broadcast arrives or 'timeout_time' is reached"""
+
+        while True:
+            try:
+                if self._push_receive:
+                    return responses.get(timeout=max(timeout_time - time(), 0))
+                return responses.get_nowait()
+            except Empty:
+                if self._push_receive or time() >= timeout_time:
+                    return None
+            if not self.__receive(blocking=False):
+                # Another thread is reading and hands over the responses
+                sleep(0.01)
+
+    def iter_broadcast(self, req: Request, timeout: float = 5, expected_count: Optional[int] = None,
+                       quiet_period: Optional[float] = None):
+        """
+        Sends a broadcast and yields the responses as they arrive.
+
+        Stops after 'timeout' seconds, after 'expected_count' responses or if there was no response for
+        'quiet_period' seconds after the first one. Other received requests are left in the message queue.
+        """
+        session_id = req.get_session_id()
+        responses = Queue()
+        with self.__lock:
+            self._broadcast_responses[session_id] = responses
+        try:
+            self.__send(req)
+            timeout_time = time() + timeout
+            res_count = 0
+            while expected_count is None or res_count < expected_count:
+                wait_until = timeout_time
+                if quiet_period is not None and res_count > 0:
+                    wait_until = min(timeout_time, time() + quiet_period)
+                res = self.__wait_for_broadcast_response(responses, wait_until)
+                if res is None:
+                    return
+                res_count += 1
+                yield res
+        finally:
+            with self.__lock:
+                del self._broadcast_responses[session_id]
+
+    def send_broadcast(self, req: Request, timeout: float = 5, expected_count: Optional[int] = None,
+                       quiet_period: Optional[float] = None) -> [Request]:
+        """Sends a broadcast and returns the responses, see 'iter_broadcast'"""
+
+        return list(self.iter_broadcast(req, timeout, expected_count, quiet_period))
+
+    def send_request_split(self, req: Request, part_max_size: Optional[int] = None, timeout: int = 6,
+                           window_retries: int = 3) -> Req_Response:
+        """
+        Splits the request into parts and sends them in windows.
+
+        Requests fitting into a single frame of the transport and the client are sent as they are, others are split
+        into the biggest fitting parts unless 'part_max_size' or a part size for the client is set.
+        Waits for the receiver to acknowledge every window if it supports that and retransmits unacknowledged
+        windows up to 'window_retries' times. Pauses after every window otherwise.
+        Returns the Ack-Status of the response to the last part and the response itself.
+        """
+        plan = self._plan_split(req, part_max_size)
+        if plan is None:
+            return False, None
+        windows, last_part, settings = plan
+
+        for window in windows:
+            if not settings.window_acks:
+                for payload_part in window:
+                    self.send_request(payload_part, 0)
+                sleep(self._get_window_pause(settings, window))
+                continue
+
+            for _ in range(window_retries):
+                for payload_part in window[:-1]:
+                    self.send_request(payload_part, 0)
+                _, res = self.send_request(window[-1], timeout)
+                if is_window_ack(res, window[-1]):
+                    break
             else:
-                self.send_request(out_req, 0)
-            package_index += 1
-            sleep(0.1)
-        return False, None
+                print("Window of split request was not acknowledged")
+                return None, None
+
+        return self.send_request(last_part, timeout)
 
     def connected(self) -> bool:
         print("!!Not implemented!!")
         return False
+
+    def close(self):
+        """Closes the underlying connection"""
+
+        pass
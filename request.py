@@ -5,12 +5,19 @@ from typing import Optional
 class Request:
     """Class to represent a network request"""
 
+    # Requests are created for every received message, slots keep them small and cheap to create
+    __slots__ = ("__path", "__session_id", "__sender", "__receiver", "__payload", "__encoded_codec", "__encoded_body")
+
     __path: str
     __session_id: int
     __sender: str
     __receiver: Optional[str]
     __payload: dict
 
+    # Encoded body and the codec it was encoded with, None if it was not encoded yet
+    __encoded_codec: Optional[str]
+    __encoded_body: Optional[bytes]
+
     def __init__(self, path: str, session_id: int, sender: str, receiver: Optional[str], payload: dict):
         """Constructor for the request"""
 
@@ -26,6 +33,14 @@ class Request:
         self.__sender = sender
         self.__receiver = receiver
         self.__payload = payload
+        self.__encoded_codec = None
+        self.__encoded_body = None
+
+    @staticmethod
+    def from_body(path: str, body: dict):  # -> Request
+        """Creates a request from a decoded body"""
+
+        return Request(path, body["session_id"], body["sender"], body["receiver"], body["payload"])
 
     def get_path(self) -> str:
         """Returns the path"""
@@ -60,37 +75,36 @@ class Request:
                 "receiver": self.__receiver,
                 "payload": self.__payload}
 
+    def get_encoded_body(self, codec) -> bytes:
+        """
+        Returns the body encoded with the passed WireCodec, the result is cached.
+
+        The payload must not be changed after the body was encoded, create a new request instead.
+        """
+
+        if self.__encoded_codec != codec.name:
+            self.__encoded_body = codec.encode(self.get_body())
+            self.__encoded_codec = codec.name
+        return self.__encoded_body
+
     def get_ack(self) -> Optional[bool]:
         """Returns the 'ack' if there is one in the payload and 'None' otherwise"""
 
-        if "ack" in self.__payload:
-            return self.__payload["ack"]
-        return None
+        return self.__payload.get("ack")
 
     def get_status_msg(self) -> Optional[str]:
         """Returns the 'status_msg' if there is one in the payload and 'None' otherwise"""
 
-        if "status_msg" in self.__payload:
-            return self.__payload["status_msg"]
-        return None
+        return self.__payload.get("status_msg")
 
     def get_response(self, ack: bool = None, payload: dict = None, path: str = None):  # -> Request:
         """Generates a response"""
 
-        if not path:
-            new_path = self.__path
-        else:
-            new_path = path
-
-        if not payload:
-            new_payload = {}
-        else:
-            new_payload = payload
-
+        new_payload = payload if payload else {}
         if ack is not None:
             new_payload["ack"] = ack
 
-        return Request(path=new_path,
+        return Request(path=path if path else self.__path,
                        session_id=self.__session_id,
                        sender=self.__receiver,
                        receiver=self.__sender,
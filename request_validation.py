@@ -0,0 +1,38 @@
+"""Module to contain the checks run on the bodies of received requests"""
+from typing import Callable
+from jsonschema.validators import validator_for
+
+# Ways to check received bodies: not at all, by a hand-written check of the basic structure or against the schema
+VALIDATION_MODES = ["none", "structural", "schema"]
+
+
+def check_request_structure(body) -> bool:
+    """Checks the structure described by 'json_schemas/request_basic_structure.json' without jsonschema"""
+
+    if not isinstance(body, dict):
+        return False
+    session_id = body.get("session_id")
+    receiver = body.get("receiver")
+    return (isinstance(session_id, int) and not isinstance(session_id, bool) and session_id >= 0
+            and isinstance(body.get("sender"), str)
+            and (receiver is None or isinstance(receiver, str))
+            and isinstance(body.get("payload"), dict))
+
+
+def accept_any_body(body) -> bool:
+    """Accepts every body, requests are only checked while they are created"""
+    return True
+
+
+def get_body_validator(mode: str, schema: dict) -> Callable[[dict], bool]:
+    """Returns a function checking received bodies the way 'mode' describes, schema validators are built only once"""
+
+    if mode == "none":
+        return accept_any_body
+    if mode == "structural":
+        return check_request_structure
+    if mode == "schema":
+        validator_class = validator_for(schema)
+        validator_class.check_schema(schema)
+        return validator_class(schema).is_valid
+    raise RuntimeError(f"Unknown validation mode '{mode}', use one of {VALIDATION_MODES}")
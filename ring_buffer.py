@@ -0,0 +1,99 @@
+"""Module to contain a bounded byte buffer for data received from a stream"""
+from typing import Optional
+
+
+class RingBuffer:
+    """
+    Class to implement a fixed size ring buffer of bytes.
+
+    Writing to a full buffer overwrites the oldest bytes, so a peer sending without line breaks can't exhaust
+    the memory. The number of overwritten bytes is counted.
+    """
+
+    __buffer: bytearray
+    __capacity: int
+
+    # Index of the oldest byte and the number of bytes stored
+    __start: int
+    __size: int
+
+    __dropped: int
+
+    def __init__(self, capacity: int = 64 * 1024):
+        if capacity < 1:
+            raise RuntimeError(f"Illegal ring buffer capacity: {capacity}")
+        self.__capacity = capacity
+        self.__buffer = bytearray(capacity)
+        self.__start = 0
+        self.__size = 0
+        self.__dropped = 0
+
+    def __len__(self) -> int:
+        return self.__size
+
+    def get_capacity(self) -> int:
+        return self.__capacity
+
+    def get_dropped(self) -> int:
+        """Returns the number of bytes that were overwritten before they were read"""
+        return self.__dropped
+
+    def write(self, data: bytes):
+        """Appends the data, overwrites the oldest bytes if there is not enough space left"""
+
+        if len(data) >= self.__capacity:
+            self.__dropped += self.__size + len(data) - self.__capacity
+            self.__buffer[:] = data[-self.__capacity:]
+            self.__start = 0
+            self.__size = self.__capacity
+            return
+
+        overflow = self.__size + len(data) - self.__capacity
+        if overflow > 0:
+            self.__dropped += overflow
+            self.__start = (self.__start + overflow) % self.__capacity
+            self.__size -= overflow
+
+        end = (self.__start + self.__size) % self.__capacity
+        first_part = min(len(data), self.__capacity - end)
+        self.__buffer[end:end + first_part] = data[:first_part]
+        self.__buffer[:len(data) - first_part] = data[first_part:]
+        self.__size += len(data)
+
+    def find(self, sub: bytes) -> int:
+        """Returns the offset of the first occurrence of the single byte 'sub' from the oldest byte, -1 if missing"""
+
+        end = self.__start + self.__size
+        index = self.__buffer.find(sub, self.__start, min(end, self.__capacity))
+        if index >= 0:
+            return index - self.__start
+        if end > self.__capacity:
+            index = self.__buffer.find(sub, 0, end - self.__capacity)
+            if index >= 0:
+                return index + self.__capacity - self.__start
+        return -1
+
+    def read(self, size: int) -> bytes:
+        """Removes and returns up to 'size' of the oldest bytes"""
+
+        size = min(size, self.__size)
+        end = self.__start + size
+        if end <= self.__capacity:
+            data = bytes(self.__buffer[self.__start:end])
+        else:
+            data = bytes(self.__buffer[self.__start:]) + bytes(self.__buffer[:end - self.__capacity])
+        self.__start = end % self.__capacity
+        self.__size -= size
+        return data
+
+    def read_line(self) -> Optional[bytes]:
+        """Removes and returns the oldest complete line including its line break, None if there is none"""
+
+        index = self.find(b"\n")
+        if index < 0:
+            return None
+        return self.read(index + 1)
+
+    def clear(self):
+        self.__start = 0
+        self.__size = 0
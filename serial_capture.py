@@ -0,0 +1,163 @@
+"""Module to record the traffic of a serial port and replay it without the hardware"""
+import struct
+import time
+from threading import Lock
+from typing import Optional, BinaryIO
+from urllib.parse import urlparse, parse_qs
+
+import serial
+
+# Capture files start with the magic, followed by one record per chunk of bytes read or written
+CAPTURE_MAGIC = b"SHSCAP1\n"
+
+# Record header: microseconds since the start of the capture, direction and length of the data
+RECORD_HEADER = struct.Struct("<QBI")
+
+DIRECTION_RX = 0
+DIRECTION_TX = 1
+
+REPLAY_SCHEME = "replay://"
+
+
+class CaptureWriter:
+    """Class to write the bytes passing a serial port to a capture file, together with the time they passed it"""
+
+    __file: Optional[BinaryIO]
+    __start: float
+    __lock: Lock
+
+    def __init__(self, path: str):
+        self.__file = open(path, "wb")
+        self.__file.write(CAPTURE_MAGIC)
+        self.__start = time.monotonic()
+        self.__lock = Lock()
+
+    def write(self, direction: int, data: bytes):
+        timestamp = int((time.monotonic() - self.__start) * 1000000)
+        with self.__lock:
+            if self.__file is None:
+                return
+            self.__file.write(RECORD_HEADER.pack(timestamp, direction, len(data)))
+            self.__file.write(data)
+
+    def close(self):
+        with self.__lock:
+            if self.__file is not None:
+                self.__file.close()
+                self.__file = None
+
+
+def read_capture(path: str) -> [tuple]:
+    """Returns the records of a capture file as (seconds since the start, direction, data)"""
+
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(CAPTURE_MAGIC):
+        raise RuntimeError(f"'{path}' is no serial capture")
+
+    records = []
+    offset = len(CAPTURE_MAGIC)
+    while offset + RECORD_HEADER.size <= len(data):
+        timestamp, direction, length = RECORD_HEADER.unpack_from(data, offset)
+        offset += RECORD_HEADER.size
+        records.append((timestamp / 1000000, direction, data[offset:offset + length]))
+        offset += length
+    return records
+
+
+class ReplaySerial:
+    """
+    Class to implement a fake serial port returning the received bytes of a capture.
+
+    The bytes are returned at the recorded times divided by 'speed', a speed of 0 returns them as fast as they are
+    read. Written bytes are discarded. Reading fails with a SerialException after the end of the capture.
+    Implements the part of the pyserial interface the serial connectors use.
+    """
+
+    __chunks: list
+    __next_chunk: int
+    __pending: bytes
+    __speed: float
+    __start: float
+    __open: bool
+
+    baudrate: int
+    timeout: Optional[float]
+
+    def __init__(self, path: str, speed: float = 1, baudrate: int = 115200, timeout: Optional[float] = None):
+        self.__chunks = [(timestamp, data) for timestamp, direction, data in read_capture(path)
+                         if direction == DIRECTION_RX]
+        self.__next_chunk = 0
+        self.__pending = b""
+        self.__speed = speed
+        self.__start = time.monotonic()
+        self.__open = True
+        self.baudrate = baudrate
+        self.timeout = timeout
+
+    def __get_replay_time(self) -> float:
+        """Returns the point of the capture the replay is at"""
+
+        if self.__speed <= 0:
+            return float("inf")
+        return (time.monotonic() - self.__start) * self.__speed
+
+    def __collect(self):
+        """Moves the chunks that are due from the capture to the pending bytes"""
+
+        replay_time = self.__get_replay_time()
+        due = []
+        while self.__next_chunk < len(self.__chunks) and self.__chunks[self.__next_chunk][0] <= replay_time:
+            due.append(self.__chunks[self.__next_chunk][1])
+            self.__next_chunk += 1
+        if due:
+            self.__pending += b"".join(due)
+
+    @property
+    def in_waiting(self) -> int:
+        self.__collect()
+        return len(self.__pending)
+
+    def read(self, size: int = 1) -> bytes:
+        if not self.__open:
+            raise serial.serialutil.PortNotOpenError()
+        self.__collect()
+        if not self.__pending:
+            if self.__next_chunk >= len(self.__chunks):
+                raise serial.serialutil.SerialException("End of the capture")
+            # Waits for the next chunk, but not longer than the timeout
+            delay = (self.__chunks[self.__next_chunk][0] - self.__get_replay_time()) / self.__speed
+            if self.timeout is not None:
+                delay = min(delay, self.timeout)
+            time.sleep(max(delay, 0))
+            self.__collect()
+        data = self.__pending[:size]
+        self.__pending = self.__pending[size:]
+        return data
+
+    def write(self, data: bytes) -> int:
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.__open = False
+
+
+def open_serial_port(url: str, baudrate: int, timeout: Optional[float] = None):
+    """
+    Opens a serial port. Besides device paths and pyserial urls, 'replay://<capture file>?speed=<factor>' opens a
+    replay of a capture file.
+    """
+
+    if not url.startswith(REPLAY_SCHEME):
+        return serial.serial_for_url(url, baudrate=baudrate, timeout=timeout)
+
+    parsed = urlparse(url)
+    path = parsed.netloc + parsed.path
+    try:
+        speed = float(parse_qs(parsed.query).get("speed", ["1"])[0])
+        return ReplaySerial(path, speed, baudrate, timeout)
+    except (IOError, ValueError, RuntimeError) as err:
+        raise serial.serialutil.SerialException(f"Could not open replay of '{path}': {err}")
@@ -1,13 +1,47 @@
 from network_connector import NetworkConnector, Request, Req_Response
-from typing import Optional
+from serial_frame_parser import SerialFrameParser
+from baudrate_memory import BaudrateMemory, DEFAULT_BAUDRATE_MEMORY
+from serial_capture import CaptureWriter, open_serial_port, DIRECTION_RX, DIRECTION_TX
+from typing import Optional, Callable
+from threading import Thread
 import serial
-import re
-import time
 import json
-from jsonschema import validate, ValidationError
+import random
+import time
+
+# Path of the handshake switching the baudrate of a chip. The chip acknowledges the new rate at the old one and
+# switches afterwards. If it doesn't receive a request with 'confirm' set at the new rate within a second,
+# it falls back to the old one.
+BAUDRATE_PATH = "smarthome/serial/baudrate"
+
+# Baudrates of the high speed mode, the USB-UART bridges of the ESP32 boards handle them reliably
+HIGH_SPEED_BAUDRATES = [921600, 460800]
+
+# Seconds to wait for the handshake responses, chips without high speed mode don't answer at all
+BAUDRATE_TIMEOUT = 1
+
+# Seconds the chip takes to switch its uart after acknowledging a baudrate
+BAUDRATE_SWITCH_DELAY = 0.05
+
+# Number of confirmations sent at the new baudrate before switching back, the chip keeps the new rate as soon as one
+# of them reached it even if its response got lost
+BAUDRATE_CONFIRM_ATTEMPTS = 2
+
+# Seconds the baudrates a chip failed on are skipped by later negotiations, failures might be transient
+BAUDRATE_FAILURE_TTL = 600
+
+
+def encode_serial_request(req: Request, body: Optional[bytes] = None) -> bytes:
+    """Encodes a request to be sent as line on the serial port. Uses the already encoded 'body' if passed."""
+
+    if body is None:
+        body = json.dumps(req.get_body()).encode()
+
+    return b"!r_p[" + req.get_path().encode() + b"]_b[" + body + b"]_\n"
+
 
 class SerialConnector(NetworkConnector):
-    """Class to implement a MQTT connection module"""
+    """Class to implement a serial connection module"""
 
     __client: serial.Serial
     __own_name: str
@@ -15,110 +49,228 @@ class SerialConnector(NetworkConnector):
     __port: str
     __connected: bool
 
-    def __init__(self, own_name: str, port: str, baudrate: int):
-        super().__init__()
+    # Baudrate the port was opened with and the chip the current one was negotiated with, None if not negotiated
+    __initial_baud_rate: int
+    __negotiated_chip: Optional[str]
+
+    # Parser holding the bytes read from the port that don't form a complete line yet
+    __parser: SerialFrameParser
+
+    # Thread draining the port, received requests are delivered as soon as their line is complete
+    __reader_thread: Optional[Thread] = None
+    __running: bool = False
+
+    # Writer recording the traffic of the port, None if it is not recorded
+    __capture: Optional[CaptureWriter] = None
+
+    # Whether received lines are printed instead of decoded and the function printing them
+    __monitor_mode: bool
+    __monitor_output: Callable[[str], None]
+
+    # Size of the default uart receive buffer of the ESP32, longer lines risk getting cut off
+    _max_frame_size = 256
+
+    _push_receive = True
+
+    def __init__(self, own_name: str, port: str, baudrate: int, read_buffer_size: int = 64 * 1024,
+                 capture_path: Optional[str] = None):
+        super().__init__(own_name)
         self.__own_name = own_name
         self.__baud_rate = baudrate
+        self.__initial_baud_rate = baudrate
+        self.__negotiated_chip = None
         self.__port = port
+        self.__connected = False
+        self.__parser = SerialFrameParser(self._validate_body, read_buffer_size)
+        self.__running = False
+        self.__monitor_mode = False
+        self.__monitor_output = print
         try:
-            self.__client = serial.Serial(port=self.__port, baudrate=self.__baud_rate, timeout=1)
+            # Accepts pyserial urls like 'loop://' and capture replays besides device paths.
+            # The short timeout only lets the reader thread notice the connector being closed.
+            self.__client = open_serial_port(self.__port, self.__baud_rate, 0.1)
             self.__connected = True
         except serial.serialutil.SerialException:
-            pass
+            return
+        if capture_path is not None:
+            self.__capture = CaptureWriter(capture_path)
+
+        self.__running = True
+        self.__reader_thread = Thread(target=self.__read_serial, daemon=True)
+        self.__reader_thread.start()
 
     def __del__(self):
+        # The baudrate can't be restored while collecting the connector, the port might be gone already
         try:
-            self.__client.close()
-        except AttributeError:
+            self.__stop()
+        except Exception:
             pass
-        print(f"Closing Serial Connection to '{self.__port}@{self.__baud_rate}'")
-        pass
-
-    @staticmethod
-    def __decode_line(line) -> Optional[Request]:
-        """Decodes a line and extracts a request if there is any"""
-
-        if line[:3] == "!r_":
-            elems = re.findall("_([a-z])\[(.+?)\]", line)
-            req_dict = {}
-            for elem_type, val in elems:
-                if elem_type in req_dict:
-                    print("Double key in request: '{}'".format(elem_type))
-                    return None
-                else:
-                    req_dict[elem_type] = val
-            for key in ["p", "b"]:
-                if key not in req_dict:
-                    print("Missig key in request: '{}'".format(key))
-                    return None
-            try:
-                json_body = json.loads(req_dict["b"])
-
-                try:
-                    validate(body, request_schema)
-                except ValidationError:
-                    print("Could not decode Request, Possible Reasons:"
-                          "Missing key(s) in request, Illegal Values for keys")
-                    return None
-
-                out_req = Request(path=req_dict["p"],
-                                  session_id=json_body["session_id"],
-                                  sender=json_body["sender"],
-                                  receiver=json_body["receiver"],
-                                  payload=json_body["payload"])
-
-                return out_req
-            except ValueError:
-                return None
-        return None
 
     def __send_serial(self, req: Request) -> bool:
         """Sends a request on the serial port"""
 
-        json_str = json.dumps(req.get_body())
-
-        req_line = "!r_p[{}]_b[{}]_\n".format(req.get_path(),
-                                              json_str)
-        # print("Sending '{}'".format(req_line[:-1]))
-        self.__client.write(req_line.encode())
+        data = encode_serial_request(req, self._encode_body(req))
+        if self.__capture is not None:
+            self.__capture.write(DIRECTION_TX, data)
+        self.__client.write(data)
         return True
 
-    def __read_serial(self, timeout: int = 0, monitor_mode: bool = False) -> Optional[Request]:
-        """Tries to read a line from the serial port"""
+    def __read_serial(self):
+        """Drains the port into the read buffer and handles every complete line until the connector is closed"""
 
-        timeout_time = time.time() + timeout
-        while True:
+        while self.__running:
             try:
-                ser_bytes = self.__client.readline().decode()
-                # if ser_bytes.startswith("!"):
-                # print("   -> {}".format(ser_bytes[:-1]))
-                if monitor_mode:
-                    print(ser_bytes[:-1])
+                data = self.__client.read(max(1, self.__client.in_waiting))
+            except (FileNotFoundError, OSError, TypeError, serial.serialutil.SerialException):
+                # Closing the port from another thread makes pending reads fail as well
+                if self.__running:
+                    print("Lost connection to serial port")
+                self.__connected = False
+                return
+            if not data:
+                continue
+            if self.__capture is not None:
+                self.__capture.write(DIRECTION_RX, data)
+            for item in self.__parser.feed(data):
+                if isinstance(item, Request):
+                    self.__handle_request(item)
                 else:
-                    if ser_bytes.startswith("Backtrace: 0x"):
-                        print("Client crashed with {}".format(ser_bytes[:-1]))
-                        return None
-                    read_buf_req = self.__decode_line(ser_bytes)
-                    if read_buf_req:
-                        return read_buf_req
-            except (FileNotFoundError, serial.serialutil.SerialException):
-                print("Lost connection to serial port")
-                return None
-            if (timeout > 0) and (time.time() > timeout_time):
-                return None
+                    self.__handle_line(item)
+
+    def __handle_request(self, req: Request):
+        if self.__monitor_mode:
+            self.__monitor_output(req.to_string())
+            return
+        self._process_received_request(req)
+
+    def __handle_line(self, line: bytes):
+        """Handles a line of debug output of the client"""
+
+        ser_bytes = line.decode(errors="replace").rstrip("\r\n")
+        if self.__monitor_mode:
+            self.__monitor_output(ser_bytes)
+        elif ser_bytes.startswith("Backtrace: 0x"):
+            print("Client crashed with {}".format(ser_bytes))
+
+    def _get_frame_size(self, req: Request) -> int:
+        return len(encode_serial_request(req, self._encode_body(req)))
+
+    def _get_link_rate(self) -> Optional[float]:
+        # Every byte takes a start and a stop bit on the uart
+        return self.__baud_rate / 10
 
     def _send_data(self, req: Request):
         self.__send_serial(req)
 
-    def _receive_data(self) -> Optional[Request]:
-        return self.__read_serial()
+    def set_request_validation(self, mode: str):
+        super().set_request_validation(mode)
+        self.__parser.set_body_validator(self._validate_body)
+
+    def __switch_baudrate(self, chip_id: str, baudrate: int) -> bool:
+        """Switches the chip and the port to the baudrate. Returns False if the chip could not be switched."""
+
+        ack, _ = self.send_request(Request(BAUDRATE_PATH, random.randint(1, 1000000), self.__own_name, chip_id,
+                                           {"baudrate": baudrate}), BAUDRATE_TIMEOUT)
+        if ack is not True:
+            return False
+
+        old_baud_rate = self.__client.baudrate
+        self.__client.flush()
+        self.__client.baudrate = baudrate
+        time.sleep(BAUDRATE_SWITCH_DELAY)
+        for _ in range(BAUDRATE_CONFIRM_ATTEMPTS):
+            ack, _ = self.send_request(Request(BAUDRATE_PATH, random.randint(1, 1000000), self.__own_name, chip_id,
+                                               {"baudrate": baudrate, "confirm": True}), BAUDRATE_TIMEOUT)
+            if ack is True:
+                self.__baud_rate = baudrate
+                return True
+
+        # The chip falls back on its own when the confirmation doesn't reach it
+        self.__client.baudrate = old_baud_rate
+        time.sleep(BAUDRATE_TIMEOUT)
+        return False
+
+    def negotiate_baudrate(self, chip_id: str, baudrates: Optional[list] = None,
+                           memory: BaudrateMemory = DEFAULT_BAUDRATE_MEMORY) -> int:
+        """
+        Switches to the fastest of the baudrates the chip supports, stays at the current one if there is none.
+
+        The result is remembered in 'memory', so later negotiations skip the rates the chip failed on for
+        BAUDRATE_FAILURE_TTL seconds. Returns the baudrate used afterwards.
+        """
+
+        baudrates = baudrates if baudrates is not None else HIGH_SPEED_BAUDRATES
+        known_maximum = memory.get(chip_id)
+        failed = False
+        for baudrate in sorted(baudrates, reverse=True):
+            if baudrate <= self.__baud_rate:
+                break
+            if known_maximum is not None and baudrate > known_maximum:
+                continue
+            if self.__switch_baudrate(chip_id, baudrate):
+                print(f"Switched '{chip_id}' to {baudrate} baud")
+                self.__negotiated_chip = chip_id
+                # A maximum below a failed rate is only kept for a while, the failure might have been transient
+                memory.set(chip_id, baudrate, BAUDRATE_FAILURE_TTL if failed else None)
+                return baudrate
+            failed = True
+
+        if failed:
+            memory.set(chip_id, self.__baud_rate, BAUDRATE_FAILURE_TTL)
+        return self.__baud_rate
 
-    def monitor(self):
-        self.__read_serial(0, True)
+    def get_baudrate(self) -> int:
+        return self.__baud_rate
+
+    def get_dropped_bytes(self) -> int:
+        """Returns the number of received bytes that were dropped because the read buffer overflowed"""
+
+        return self.__parser.get_dropped_bytes()
+
+    def get_frame_stats(self) -> dict:
+        """Returns the numbers of decoded and rejected frames and of the dropped bytes"""
+
+        return self.__parser.get_stats()
+
+    def monitor(self, output: Callable[[str], None] = print):
+        """Prints every line received using 'output' until the connection is lost"""
+
+        self.__monitor_output = output
+        self.__monitor_mode = True
+        if self.__reader_thread is not None:
+            self.__reader_thread.join()
 
     def connected(self) -> bool:
         return self.__connected
 
+    def close(self):
+        """Stops the reader thread and closes the port"""
+
+        if not self.__running:
+            return
+        # The chip keeps a negotiated baudrate until it reboots, the next connection expects the initial one
+        if self.__connected and self.__negotiated_chip is not None and self.__baud_rate != self.__initial_baud_rate:
+            try:
+                switched = self.__switch_baudrate(self.__negotiated_chip, self.__initial_baud_rate)
+            except (OSError, serial.serialutil.SerialException):
+                switched = False
+            if not switched:
+                print(f"Could not switch '{self.__negotiated_chip}' back to {self.__initial_baud_rate} baud")
+        self.__stop()
+        print(f"Closing Serial Connection to '{self.__port}@{self.__baud_rate}'")
+
+    def __stop(self):
+        """Stops the reader thread and closes the port and the capture"""
+
+        if not self.__running:
+            return
+        self.__running = False
+        self.__reader_thread.join()
+        self.__client.close()
+        if self.__capture is not None:
+            self.__capture.close()
+        self.__connected = False
+
 
 if __name__ == '__main__':
     import sys
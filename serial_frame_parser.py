@@ -0,0 +1,117 @@
+"""Module to extract the requests from the byte stream received on a serial port"""
+from typing import Optional, Callable, Union
+
+from request import Request
+from request_validation import check_request_structure
+from ring_buffer import RingBuffer
+from wire_codecs import JSON_CODEC
+
+# A frame looks like '!r_p[<path>]_b[<json body>]_' and ends with the line
+FRAME_START = b"!r_p["
+PATH_END = b"]_b["
+FRAME_END = b"]_"
+
+
+def find_serial_frame(line: bytes) -> Optional[tuple]:
+    """
+    Returns the path and the body of the frame in the line, None if there is none.
+
+    The frame may be preceded by debug output on the same line. The body is delimited by the end of the line,
+    so it may contain brackets itself.
+    """
+
+    start = line.find(FRAME_START)
+    if start < 0:
+        return None
+    path_start = start + len(FRAME_START)
+    path_end = line.find(PATH_END, path_start)
+    if path_end < 0:
+        return None
+
+    end = len(line)
+    while end > 0 and line[end - 1] in b"\r\n":
+        end -= 1
+    body_start = path_end + len(PATH_END)
+    if end - len(FRAME_END) < body_start or not line.endswith(FRAME_END, 0, end):
+        return None
+    return line[path_start:path_end], line[body_start:end - len(FRAME_END)]
+
+
+def decode_serial_frame(path: bytes, body: bytes,
+                        validate_body: Callable[[dict], bool] = check_request_structure) -> Optional[Request]:
+    """Decodes the path and body of a frame, returns None if they don't form a valid request"""
+
+    try:
+        json_body = JSON_CODEC.decode(body)
+    except ValueError:
+        print(f"Couldn't decode serial frame body: {body[:100]}")
+        return None
+    if not validate_body(json_body):
+        print("Could not decode Request, Possible Reasons: Missing key(s) in request, Illegal Values for keys")
+        return None
+    try:
+        return Request.from_body(path.decode(), json_body)
+    except (ValueError, KeyError, TypeError, RuntimeError):
+        print("Error creating Request")
+        return None
+
+
+class SerialFrameParser:
+    """
+    Class to implement an incremental parser for the frames received on a serial port.
+
+    Bytes can be fed in chunks of any size, frames split over several reads are completed by later ones.
+    """
+
+    __buffer: RingBuffer
+    __validate_body: Callable[[dict], bool]
+
+    __frames: int
+    __rejected: int
+
+    def __init__(self, validate_body: Callable[[dict], bool] = check_request_structure,
+                 buffer_size: int = 64 * 1024):
+        self.__buffer = RingBuffer(buffer_size)
+        self.__validate_body = validate_body
+        self.__frames = 0
+        self.__rejected = 0
+
+    def set_body_validator(self, validate_body: Callable[[dict], bool]):
+        self.__validate_body = validate_body
+
+    def feed(self, data: bytes) -> [Union[Request, bytes]]:
+        """
+        Adds received bytes to the parser.
+
+        Returns the requests of all frames completed by the data and the lines without frames (debug output of the
+        client) in the order they were received. Invalid frames are dropped.
+        """
+
+        self.__buffer.write(data)
+        items = []
+        while True:
+            line = self.__buffer.read_line()
+            if line is None:
+                return items
+            frame = find_serial_frame(line)
+            if frame is None:
+                items.append(line)
+                continue
+            req = decode_serial_frame(frame[0], frame[1], self.__validate_body)
+            if req is None:
+                self.__rejected += 1
+            else:
+                self.__frames += 1
+                items.append(req)
+
+    def get_dropped_bytes(self) -> int:
+        """Returns the number of received bytes that were dropped because the buffer overflowed"""
+
+        return self.__buffer.get_dropped()
+
+    def get_stats(self) -> dict:
+        """Returns the numbers of decoded and rejected frames and of the dropped bytes"""
+
+        return {"frames": self.__frames,
+                "rejected": self.__rejected,
+                "dropped_bytes": self.__buffer.get_dropped()}
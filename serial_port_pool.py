@@ -0,0 +1,192 @@
+"""Module to operate the chips connected to many serial ports at once"""
+import argparse
+import socket
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Callable, TypeVar, Union
+
+import client_control_methods
+import config_functions
+from chip_flasher import get_serial_ports
+from baudrate_memory import BaudrateMemory, BAUDRATE_MEMORY_PATH
+from serial_connector import SerialConnector, HIGH_SPEED_BAUDRATES
+
+Result = TypeVar("Result")
+
+# Operation run on a single port, gets the port, the name of the chip connected to it and the connector
+PortOperation = Callable[[str, Optional[str], SerialConnector], Result]
+
+
+class SerialPortPool:
+    """
+    Class to implement a pool of serial connections, operations are run on all ports in parallel.
+
+    Every port gets a thread of its own for the duration of an operation, as the serial connectors wait for the
+    responses of their chips synchronously.
+    """
+
+    __sender: str
+    __baud_rate: int
+
+    # Highest baudrates negotiated with the chips
+    __baudrate_memory: BaudrateMemory
+
+    # Open connections and the names of the chips connected to them, identified by the port
+    __connectors: dict
+    __chip_ids: dict
+
+    __executor: ThreadPoolExecutor
+
+    def __init__(self, sender: str, ports: [str], baudrate: int = 115200, max_workers: Optional[int] = None,
+                 baudrate_memory_path: Optional[str] = BAUDRATE_MEMORY_PATH):
+        self.__sender = sender
+        self.__baud_rate = baudrate
+        self.__baudrate_memory = BaudrateMemory(baudrate_memory_path)
+        self.__chip_ids = {}
+        self.__executor = ThreadPoolExecutor(max_workers=max_workers or max(1, len(ports)),
+                                             thread_name_prefix="serial_port_pool")
+
+        # Opening a port resets most boards, opening them one after the other would add up the delays
+        connectors = dict(zip(ports, self.__executor.map(self.__open_port, ports)))
+        self.__connectors = {port: connector for port, connector in connectors.items() if connector.connected()}
+        for port in ports:
+            if port not in self.__connectors:
+                print(f"Could not connect to '{port}'")
+
+    def __open_port(self, port: str) -> SerialConnector:
+        return SerialConnector(self.__sender, port, self.__baud_rate)
+
+    def get_ports(self) -> [str]:
+        """Returns the ports that could be opened"""
+
+        return list(self.__connectors)
+
+    def get_connector(self, port: str) -> Optional[SerialConnector]:
+        return self.__connectors.get(port)
+
+    def get_chip_ids(self) -> dict:
+        """Returns the names of the chips found by 'discover_chip_ids', identified by their port"""
+
+        return dict(self.__chip_ids)
+
+    def run(self, operation: PortOperation, ports: Optional[list] = None) -> dict:
+        """
+        Runs the operation on every port in parallel, or only on the passed ones.
+
+        Returns the results of the operation identified by the port. Ports the operation failed on hold None.
+        """
+
+        ports = [port for port in (ports if ports is not None else self.__connectors) if port in self.__connectors]
+        futures = {port: self.__executor.submit(operation, port, self.__chip_ids.get(port), self.__connectors[port])
+                   for port in ports}
+        results = {}
+        for port, future in futures.items():
+            try:
+                results[port] = future.result()
+            except Exception as err:
+                print(f"Operation on '{port}' failed: {err}")
+                results[port] = None
+        return results
+
+    def discover_chip_ids(self, timeout: int = 5) -> dict:
+        """Asks the chip on every port for its name. Returns the names identified by the port, None if not found."""
+
+        self.__chip_ids = self.run(lambda port, chip_id, connector: client_control_methods.get_connected_chip_id(
+            connector, self.__sender, timeout))
+        return self.get_chip_ids()
+
+    def negotiate_baudrates(self, baudrates: Optional[list] = None) -> dict:
+        """Switches every chip that was discovered to the fastest baudrate it supports. Returns the baudrates used."""
+
+        def negotiate(port: str, chip_id: Optional[str], connector: SerialConnector) -> int:
+            if chip_id is None:
+                return connector.get_baudrate()
+            return connector.negotiate_baudrate(chip_id, baudrates, self.__baudrate_memory)
+
+        return self.run(negotiate)
+
+    def write_configs(self, config: Union[dict, Callable[[str, str], dict]]) -> dict:
+        """
+        Writes a config to every chip that was discovered.
+
+        'config' is either written to all chips or a function returning the config for a port and chip name.
+        Returns whether the upload succeeded identified by the port.
+        """
+
+        def write(port: str, chip_id: Optional[str], connector: SerialConnector) -> bool:
+            if chip_id is None:
+                return False
+            chip_config = config(port, chip_id) if callable(config) else config
+            return client_control_methods.write_config(chip_id, chip_config, self.__sender, connector)
+
+        return self.run(write)
+
+    def reset_configs(self, reset_option: str) -> dict:
+        """Resets the config of every chip that was discovered, see 'client_control_methods.reset_config'"""
+
+        return self.run(lambda port, chip_id, connector: chip_id is not None and client_control_methods.reset_config(
+            chip_id, reset_option, self.__sender, connector) is True)
+
+    def reboot(self) -> dict:
+        """Reboots every chip that was discovered"""
+
+        return self.run(lambda port, chip_id, connector: chip_id is not None and client_control_methods.reboot_client(
+            chip_id, self.__sender, connector))
+
+    def monitor(self):
+        """Prints the output of all chips prefixed with their port until all connections are lost"""
+
+        self.run(lambda port, chip_id, connector: connector.monitor(lambda line: print(f"[{port}] {line}")))
+
+    def close(self):
+        for connector in self.__connectors.values():
+            connector.close()
+        self.__executor.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs operations on the chips connected to many serial ports at once')
+    parser.add_argument('--ports', help='Serial ports to use, all detected usb ports if omitted', type=str, nargs="+")
+    parser.add_argument('--baudrate', help='Baudrate of the serial connections', type=int, default=115200)
+    parser.add_argument('--config', help='Name of the config to write to every chip', type=str)
+    parser.add_argument('--reset_config', help='Resets the configs, either complete, config, gadgets or erase',
+                        type=str)
+    parser.add_argument('--reboot', help='Reboots the chips', action="store_true")
+    parser.add_argument('--monitor', help='Prints the output of all chips', action="store_true")
+    parser.add_argument('--high_speed', help=f'Switches the chips supporting it to one of {HIGH_SPEED_BAUDRATES} '
+                                             f'baud for the uploads', action="store_true")
+    parser.add_argument('--baudrate_memory', help='File to remember the baudrates of the chips in', type=str,
+                        default=BAUDRATE_MEMORY_PATH)
+    ARGS = parser.parse_args()
+
+    pool_ports = ARGS.ports if ARGS.ports else get_serial_ports()
+    if not pool_ports:
+        print("No serial ports found")
+        sys.exit(1)
+
+    pool = SerialPortPool(socket.gethostname(), pool_ports, ARGS.baudrate, baudrate_memory_path=ARGS.baudrate_memory)
+    if ARGS.monitor:
+        pool.monitor()
+        sys.exit(0)
+
+    for pool_port, pool_chip in pool.discover_chip_ids().items():
+        print(f"{pool_port}: {pool_chip if pool_chip is not None else 'no chip found'}")
+
+    if ARGS.high_speed:
+        print(f"Baudrates: {pool.negotiate_baudrates()}")
+
+    if ARGS.reset_config:
+        print(f"Reset: {pool.reset_configs(ARGS.reset_config)}")
+
+    if ARGS.config:
+        pool_configs, _ = config_functions.load_configs()
+        pool_config = next((cfg for cfg in pool_configs if cfg["name"] == ARGS.config), None)
+        if pool_config is None:
+            print(f"Config '{ARGS.config}' does not exist")
+        else:
+            print(f"Config written: {pool.write_configs(pool_config)}")
+
+    if ARGS.reboot:
+        print(f"Reboot: {pool.reboot()}")
+
+    pool.close()
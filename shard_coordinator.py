@@ -0,0 +1,142 @@
+"""Module to let the shards of a bridge find each other and share their state"""
+import json
+import threading
+import time
+from typing import Optional, Callable
+
+import paho.mqtt.client as mqtt
+
+from mqtt_session import MQTTSession, get_session, release_session
+from shard_ring import ShardRing, get_state_topic
+
+StateProvider = Callable[[], dict]
+RingListener = Callable[[ShardRing], None]
+
+
+class ShardCoordinator:
+    """
+    Class to implement the coordination channel of the shards of a bridge.
+
+    Every shard publishes its state periodically. Shards that stay silent for longer than 'timeout' seconds are
+    removed from the ring, the ring listener is called with the new ring whenever the shards change.
+    """
+
+    __group: str
+    __shard_name: str
+
+    __session: Optional[MQTTSession] = None
+    __subscription: int
+
+    __state_provider: StateProvider
+    __ring_listener: RingListener
+
+    # Time the last state of each other shard was received and the state itself, identified by the shard name
+    __shard_states: dict
+
+    __interval: float
+    __timeout: float
+
+    __running: bool
+    __lock: threading.Lock
+    __wakeup: threading.Event
+    __thread: threading.Thread
+
+    def __init__(self, group: str, shard_name: str, mqtt_ip: str, mqtt_port: int, state_provider: StateProvider,
+                 ring_listener: RingListener, mqtt_user: Optional[str] = None, mqtt_pw: Optional[str] = None,
+                 interval: float = 5, timeout: float = 15):
+        if timeout <= interval:
+            raise RuntimeError("The timeout has to be longer than the interval the states are published in")
+        self.__group = group
+        self.__shard_name = shard_name
+        self.__state_provider = state_provider
+        self.__ring_listener = ring_listener
+        self.__shard_states = {}
+        self.__interval = interval
+        self.__timeout = timeout
+        self.__running = True
+        self.__lock = threading.Lock()
+        self.__wakeup = threading.Event()
+
+        # Until other shards are heard of, this one handles every request
+        self.__ring_listener(ShardRing([self.__shard_name]))
+
+        self.__session = get_session(f"{shard_name}_coordinator", mqtt_ip, mqtt_port, mqtt_user, mqtt_pw)
+        self.__subscription = self.__session.subscribe([get_state_topic(group)], self.__on_state)
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def __on_state(self, message: mqtt.MQTTMessage):
+        """Callback for the mqtt network loop thread"""
+
+        try:
+            data = json.loads(message.payload)
+            shard_name = data["shard"]
+            state = data["state"]
+        except (ValueError, KeyError, TypeError):
+            print(f"Received malformed shard state on '{message.topic}'")
+            return
+        if shard_name == self.__shard_name:
+            return
+        with self.__lock:
+            is_new = shard_name not in self.__shard_states
+            self.__shard_states[shard_name] = (time.time(), state)
+        if is_new:
+            print(f"Shard '{shard_name}' joined")
+            self.__update_ring()
+            # Lets the new shard know about this one right away instead of after the next interval
+            self.__wakeup.set()
+
+    def __run(self):
+        """Publishes the state of this shard and removes the shards that went silent until closed"""
+
+        while self.__running:
+            self.__publish_state()
+            with self.__lock:
+                timeout_time = time.time() - self.__timeout
+                silent = [name for name, (last_seen, _) in self.__shard_states.items() if last_seen < timeout_time]
+                for name in silent:
+                    del self.__shard_states[name]
+            if silent:
+                print(f"Shard(s) {', '.join(silent)} left")
+                self.__update_ring()
+            self.__wakeup.wait(self.__interval)
+            self.__wakeup.clear()
+
+    def __publish_state(self):
+        try:
+            state = self.__state_provider()
+        except Exception as err:
+            print(f"Could not read the state of shard '{self.__shard_name}': {err}")
+            return
+        payload = json.dumps({"shard": self.__shard_name, "state": state}).encode()
+        self.__session.publish(get_state_topic(self.__group, self.__shard_name), payload)
+
+    def __update_ring(self):
+        self.__ring_listener(ShardRing(self.get_shards()))
+
+    def get_shard_name(self) -> str:
+        return self.__shard_name
+
+    def get_shards(self) -> [str]:
+        """Returns the names of all shards currently alive, including this one"""
+
+        with self.__lock:
+            return sorted([self.__shard_name] + list(self.__shard_states))
+
+    def get_shard_states(self) -> dict:
+        """Returns the last states the other shards published, identified by their names"""
+
+        with self.__lock:
+            return {name: state for name, (_, state) in self.__shard_states.items()}
+
+    def close(self):
+        """Stops publishing the state, the other shards take over the clients of this one after the timeout"""
+
+        if self.__session is None:
+            return
+        self.__running = False
+        self.__wakeup.set()
+        self.__thread.join()
+        self.__session.unsubscribe(self.__subscription)
+        release_session(self.__session)
+        self.__session = None
@@ -0,0 +1,70 @@
+"""Module to assign the clients to the shards of a bridge running in several processes"""
+import hashlib
+from bisect import bisect
+from typing import Optional
+
+# Prefix of the topics the shards of a bridge coordinate on. It is outside of 'smarthome/#', so connectors
+# subscribed to all requests don't have to decode them.
+SHARD_TOPIC_PREFIX = "smarthome_shards/"
+
+
+def get_shared_subscription(group: str, topic_filter: str) -> str:
+    """Returns the filter subscribing to the topic filter as a member of the shared subscription group"""
+
+    return f"$share/{group}/{topic_filter}"
+
+
+def get_forward_topic(group: str, shard_name: str, topic: str = "") -> str:
+    """Returns the topic a message published on 'topic' is forwarded to the shard on"""
+
+    return f"{SHARD_TOPIC_PREFIX}{group}/to/{shard_name}/{topic}"
+
+
+def get_forwarded_topic(group: str, shard_name: str, topic: str) -> Optional[str]:
+    """Returns the topic a message forwarded to the shard was originally published on"""
+
+    prefix = get_forward_topic(group, shard_name)
+    if not topic.startswith(prefix):
+        return None
+    return topic[len(prefix):]
+
+
+def get_state_topic(group: str, shard_name: Optional[str] = None) -> str:
+    """Returns the topic the shard publishes its state on, the filter for the states of all shards without a name"""
+
+    return f"{SHARD_TOPIC_PREFIX}{group}/state/{shard_name if shard_name is not None else '+'}"
+
+
+def get_hash(key: str) -> int:
+    # The builtin hash is salted per process, every shard has to compute the same ring
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class ShardRing:
+    """Class to implement a consistent hash ring, adding or removing a shard only moves the clients of that shard"""
+
+    __shards: list
+
+    # Positions of the virtual nodes on the ring and the shard owning each of them, sorted by position
+    __positions: list
+    __owners: list
+
+    def __init__(self, shards: [str], virtual_nodes: int = 64):
+        if virtual_nodes < 1:
+            raise RuntimeError(f"Illegal number of virtual nodes: {virtual_nodes}")
+        self.__shards = sorted(set(shards))
+        nodes = sorted((get_hash(f"{shard}#{index}"), shard)
+                       for shard in self.__shards for index in range(virtual_nodes))
+        self.__positions = [position for position, _ in nodes]
+        self.__owners = [shard for _, shard in nodes]
+
+    def get_shards(self) -> [str]:
+        return list(self.__shards)
+
+    def get_shard(self, key: str) -> Optional[str]:
+        """Returns the shard the key is assigned to, None if the ring is empty"""
+
+        if not self.__positions:
+            return None
+        index = bisect(self.__positions, get_hash(key)) % len(self.__positions)
+        return self.__owners[index]
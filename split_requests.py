@@ -0,0 +1,498 @@
+"""Module to split big requests into parts and to reassemble them on the receiving side"""
+import base64
+import json
+from collections import OrderedDict
+from request import Request
+from time import monotonic
+from typing import Optional, Callable
+
+
+# Seconds paused after every part sent to clients that don't report their capabilities, as older firmware expects
+DEFAULT_PAUSE = 0.1
+
+# Seconds a client reporting its capabilities takes to handle a part of a split request once it has received it
+PART_PROCESSING_TIME = 0.02
+
+# Biggest frame in bytes sent to clients that don't report their receive buffer, the ESP32 firmware receives serial
+# lines and MQTT packets into buffers of this size
+DEFAULT_RECEIVE_BUFFER_SIZE = 256
+
+# Encodings for the payload of split requests. 'legacy' replaces the quotes and is understood by every firmware.
+SPLIT_ENCODINGS = ["legacy", "base64", "base85"]
+
+
+def encode_split_payload(payload: dict, encoding: str) -> str:
+    """Encodes the payload to a string that can be contained in the parts of a split request without escaping"""
+
+    if encoding == "legacy":
+        # Make string ready to be contained in json itself
+        return json.dumps(payload).replace('"', "$*$")
+
+    payload_bytes = json.dumps(payload, separators=(",", ":")).encode()
+    if encoding == "base64":
+        return base64.b64encode(payload_bytes).decode("ascii")
+    if encoding == "base85":
+        return base64.b85encode(payload_bytes).decode("ascii")
+    raise RuntimeError(f"Unknown split encoding '{encoding}'")
+
+
+def decode_split_payload(payload_str: str, encoding: str) -> dict:
+    """Decodes the joined parts of a split request. Raises ValueError if they cannot be decoded."""
+
+    if encoding == "legacy":
+        return json.loads(payload_str.replace("$*$", '"'))
+    if encoding == "base64":
+        return json.loads(base64.b64decode(payload_str, validate=True))
+    if encoding == "base85":
+        return json.loads(base64.b85decode(payload_str))
+    raise ValueError(f"Unknown split encoding '{encoding}'")
+
+
+def is_split_request(req: Request) -> bool:
+    """Returns whether the request is a part of a split request"""
+
+    req_payload = req.get_payload()
+    return "package_index" in req_payload and "split_payload" in req_payload
+
+
+def needs_window_ack(req: Request, own_name: Optional[str]) -> bool:
+    """Checks whether the request is a part of a split request to 'own_name' closing a window"""
+
+    return own_name is not None and req.get_receiver() == own_name and \
+        is_split_request(req) and req.get_payload().get("ack_window") is True
+
+
+def get_window_ack(req: Request) -> Request:
+    """Returns the acknowledgement for the part closing a window"""
+
+    return req.get_response(ack=True, payload={"package_index": req.get_payload()["package_index"]})
+
+
+def is_window_ack(res: Optional[Request], closing_part: Request) -> bool:
+    """Checks whether the response acknowledges the window closed by the passed part"""
+
+    return res is not None and res.get_payload().get("package_index") == closing_part.get_payload()["package_index"]
+
+
+class SplitSettings:
+    """Class to contain the parameters used to send split requests to a client"""
+
+    # Maximum number of payload characters per part, None to use the biggest parts fitting into a frame
+    part_size: Optional[int]
+
+    # Maximum size in bytes of a frame the client can receive, None if the client has no limit
+    receive_buffer_size: Optional[int]
+
+    # Number of parts sent in a row before waiting for an acknowledgement or pausing
+    window_size: int
+
+    # Whether the receiver acknowledges the last part of every window
+    window_acks: bool
+
+    # Seconds to pause after every window if the receiver does not acknowledge them, None to derive the pause from
+    # the size of the window and the speed of the transport
+    pause: Optional[float]
+
+    # Encoding of the split payload, one of SPLIT_ENCODINGS
+    encoding: str
+
+    # Whether 'last_index' announces the number of parts instead of the index of the last one, as firmware built
+    # before the index semantics expects it
+    last_index_count: bool
+
+    def __init__(self, part_size: Optional[int] = None, window_size: int = 1, window_acks: bool = False,
+                 pause: Optional[float] = DEFAULT_PAUSE, receive_buffer_size: Optional[int] = DEFAULT_RECEIVE_BUFFER_SIZE,
+                 encoding: str = "legacy", last_index_count: bool = False):
+        self.part_size = part_size
+        self.encoding = encoding
+        self.receive_buffer_size = receive_buffer_size
+        self.window_size = window_size
+        self.window_acks = window_acks
+        self.pause = pause
+        self.last_index_count = last_index_count
+
+    @staticmethod
+    def from_capabilities(capabilities: dict, default):  # -> SplitSettings
+        """
+        Creates the settings for a client from the capabilities it reported, using 'default' for missing ones.
+
+        The pause after every window is derived from the transport for clients reporting any capabilities.
+        """
+
+        return SplitSettings(capabilities.get("split_part_size", default.part_size),
+                             capabilities.get("split_window", default.window_size),
+                             capabilities.get("split_window_acks", default.window_acks),
+                             None if capabilities else default.pause,
+                             capabilities.get("receive_buffer_size", default.receive_buffer_size),
+                             capabilities.get("split_encoding", default.encoding),
+                             capabilities.get("split_last_index_count", default.last_index_count))
+
+    def get_pause(self, frame_sizes: [int], link_rate: Optional[float]) -> float:
+        """
+        Returns the seconds to pause after sending a window of frames with the passed sizes.
+
+        'link_rate' is the number of bytes per second the transport carries, None if the transport is not the
+        bottleneck. Without a fixed pause the window gets the time to be transferred and handled by the client.
+        """
+
+        if self.pause is not None:
+            return self.pause
+        transfer_time = sum(frame_sizes) / link_rate if link_rate else 0
+        return transfer_time + PART_PROCESSING_TIME * len(frame_sizes)
+
+    def get_frame_limit(self, transport_limit: Optional[int]) -> Optional[int]:
+        """Returns the biggest frame both the transport and the client can handle, None if there is no limit"""
+
+        limits = [limit for limit in [transport_limit, self.receive_buffer_size] if limit is not None]
+        return min(limits) if limits else None
+
+
+def split_request(req: Request, part_max_size: int = 30, encoding: str = "legacy",
+                  last_index_count: bool = False) -> [Request]:
+    """
+    Splits the payload of the request into parts of 'part_max_size' characters and returns a request for each.
+
+    The first part announces the index of the last part, or the number of parts if 'last_index_count' is set.
+    """
+
+    session_id = req.get_session_id()
+    path = req.get_path()
+    sender = req.get_sender()
+    receiver = req.get_receiver()
+
+    payload_str = encode_split_payload(req.get_payload(), encoding)
+
+    payload_len = len(payload_str)
+    parts = []
+    start = 0
+
+    while start < payload_len:
+        end = start + part_max_size
+        payload_part = payload_str[start:(end if end < payload_len else payload_len)]
+        parts.append(payload_part)
+        start = end
+
+    last_index = len(parts) if last_index_count else len(parts) - 1
+
+    out_requests = []
+    for package_index, payload_part in enumerate(parts):
+
+        out_dict = {"package_index": package_index, "split_payload": payload_part}
+        if package_index == 0:
+            out_dict["last_index"] = last_index
+            if encoding != "legacy":
+                out_dict["split_encoding"] = encoding
+
+        out_requests.append(Request(path,
+                                    session_id,
+                                    sender,
+                                    receiver,
+                                    out_dict))
+    return out_requests
+
+
+class SplitSession:
+    """Class to collect the parts of a single split request"""
+
+    __first_req: Request
+    __last_index: Optional[int]
+    __encoding: str
+    __parts: dict
+    __size: int
+
+    # Monotonic time the last part was received
+    last_update: float
+
+    def __init__(self, first_req: Request, now: float):
+        self.__first_req = first_req
+        self.__last_index = None
+        self.__encoding = "legacy"
+        self.__parts = {}
+        self.__size = 0
+        self.last_update = now
+
+    def get_size(self) -> int:
+        """Returns the number of payload characters buffered for this request"""
+
+        return self.__size
+
+    def get_last_index(self) -> Optional[int]:
+        """Returns the index of the last part if the first part was received already"""
+
+        return self.__last_index
+
+    def set_last_index(self, last_index: int):
+        self.__last_index = last_index
+
+    def get_encoding(self) -> str:
+        """Returns the encoding of the split payload"""
+
+        return self.__encoding
+
+    def set_encoding(self, encoding: str):
+        self.__encoding = encoding
+
+    def has_part(self, index: int) -> bool:
+        return index in self.__parts
+
+    def add_part(self, index: int, split_payload: str):
+        """Saves a part of the payload"""
+
+        self.__parts[index] = split_payload
+        self.__size += len(split_payload)
+
+    def complete(self) -> bool:
+        """Returns whether every part was received"""
+
+        if self.__last_index is None or len(self.__parts) < self.__last_index + 1:
+            return False
+        return all(i in self.__parts for i in range(self.__last_index + 1))
+
+    def get_payload_str(self) -> str:
+        """Joins the received parts to the complete payload string"""
+
+        return "".join([self.__parts[i] for i in range(self.__last_index + 1)])
+
+    def get_first_request(self) -> Request:
+        """Returns the first received part to read path, sender and receiver from"""
+
+        return self.__first_req
+
+
+def split_request_to_fit(req: Request, frame_limit: int, get_frame_size: Callable[[Request], int],
+                         encoding: str = "legacy", last_index_count: bool = False) -> [Request]:
+    """
+    Splits the request into the biggest parts whose frames are no bigger than 'frame_limit' bytes.
+
+    'get_frame_size' returns the number of bytes a request takes up on the transport.
+    """
+
+    # Estimate the space left for the payload in a part, including the flag to acknowledge a window
+    empty_payload = {"package_index": 99999, "split_payload": "", "last_index": 99999, "ack_window": True}
+    if encoding != "legacy":
+        empty_payload["split_encoding"] = encoding
+    empty_part = Request(req.get_path(), req.get_session_id(), req.get_sender(), req.get_receiver(), empty_payload)
+    part_size = frame_limit - get_frame_size(empty_part)
+
+    while part_size > 0:
+        parts = split_request(req, part_size, encoding, last_index_count)
+        excess = max(get_frame_size(part) for part in parts) + len(', "ack_window": true') - frame_limit
+        if excess <= 0:
+            return parts
+        # Escaped characters take up more space than estimated
+        part_size -= excess
+
+    raise RuntimeError(f"Frame limit of {frame_limit} bytes is too small to split the request")
+
+
+def split_request_for_transport(req: Request, part_max_size: Optional[int], settings: SplitSettings,
+                                transport_limit: Optional[int], get_frame_size: Callable[[Request], int]) -> [Request]:
+    """
+    Returns the requests to send in order to transfer the passed one.
+
+    Splits only if 'part_max_size' is set or the request does not fit into a single frame for the client and
+    returns the request itself otherwise.
+    """
+
+    if part_max_size:
+        return split_request(req, part_max_size, settings.encoding, settings.last_index_count)
+
+    frame_limit = settings.get_frame_limit(transport_limit)
+    if frame_limit is None or get_frame_size(req) <= frame_limit:
+        return [req]
+
+    if settings.part_size:
+        return split_request(req, settings.part_size, settings.encoding, settings.last_index_count)
+    return split_request_to_fit(req, frame_limit, get_frame_size, settings.encoding, settings.last_index_count)
+
+
+def get_split_windows(parts: [Request], settings: SplitSettings) -> [[Request]]:
+    """
+    Groups every part but the last one into windows of 'settings.window_size' parts.
+
+    The last part of every window asks for an acknowledgement if the receiver sends them.
+    """
+
+    window_size = max(settings.window_size, 1)
+    windows = []
+    for start in range(0, len(parts) - 1, window_size):
+        window = parts[start:min(start + window_size, len(parts) - 1)]
+        if settings.window_acks:
+            # Encoded bodies are cached, so the marked part is a new request instead of a changed one
+            closing_part = window[-1]
+            window[-1] = Request(closing_part.get_path(), closing_part.get_session_id(), closing_part.get_sender(),
+                                 closing_part.get_receiver(), dict(closing_part.get_payload(), ack_window=True))
+        windows.append(window)
+    return windows
+
+
+class SplitRequestBuffer:
+    """Class to collect the parts of split requests until they can be reassembled"""
+
+    # Seconds an incomplete split request is kept after receiving its latest part
+    __ttl: float
+
+    # Maximum number of payload characters buffered for all incomplete split requests together
+    __max_buffer_size: int
+
+    # Incomplete split requests identified by sender and session id, least recently updated first
+    __sessions: OrderedDict
+    __buffer_size: int
+
+    # Seconds blocks of a completed split request are dropped as late duplicates
+    __duplicate_window: float
+
+    # Recently completed split requests to drop late duplicate blocks, oldest first. Identified by sender and session
+    # id, holding the time they were completed and the index of their last part.
+    __completed_sessions: OrderedDict
+
+    __completed_count: int
+    __expired_count: int
+    __evicted_count: int
+
+    def __init__(self, ttl: float = 30, max_buffer_size: int = 1000000, duplicate_window: float = 2):
+        self.__ttl = ttl
+        self.__duplicate_window = duplicate_window
+        self.__max_buffer_size = max_buffer_size
+        self.__sessions = OrderedDict()
+        self.__buffer_size = 0
+        self.__completed_sessions = OrderedDict()
+        self.__completed_count = 0
+        self.__expired_count = 0
+        self.__evicted_count = 0
+
+    def add(self, received_request: Request) -> Optional[Request]:
+        """
+        Adds a received request to the buffer.
+
+        Returns the request itself if it is no split request, the reassembled request if the passed one completed
+        its split request and None otherwise.
+        """
+
+        if not is_split_request(received_request):
+            return received_request
+
+        now = monotonic()
+        self.__remove_expired(now)
+
+        req_payload = received_request.get_payload()
+        p_index = req_payload["package_index"]
+        split_payload = req_payload["split_payload"]
+        if not isinstance(p_index, int) or p_index < 0 or not isinstance(split_payload, str):
+            print("Received illegal block of split request")
+            return None
+
+        session_key = (received_request.get_sender(), received_request.get_session_id())
+        if self.__is_late_duplicate(session_key, received_request):
+            return None
+
+        session: Optional[SplitSession] = self.__sessions.get(session_key)
+        if session is None:
+            session = SplitSession(received_request, now)
+            self.__sessions[session_key] = session
+        else:
+            session.last_update = now
+            self.__sessions.move_to_end(session_key)
+
+        if p_index == 0:
+            if not isinstance(req_payload.get("last_index"), int):
+                print("Received first block of split request without last_index")
+                self.__remove(session_key)
+                return None
+            session.set_last_index(req_payload["last_index"])
+            session.set_encoding(req_payload.get("split_encoding", "legacy"))
+
+        last_index = session.get_last_index()
+        if last_index is not None and p_index > last_index:
+            print("Received block of split request exceeding last_index")
+            return None
+
+        if session.has_part(p_index):
+            # Duplicate block, e.g. because the sender retransmitted it
+            return None
+
+        self.__make_room(len(split_payload), session_key)
+        if session_key not in self.__sessions:
+            print("Split request is too big to be buffered")
+            return None
+
+        session.add_part(p_index, split_payload)
+        self.__buffer_size += len(split_payload)
+
+        if not session.complete():
+            return None
+
+        self.__remove(session_key)
+        try:
+            json_data = decode_split_payload(session.get_payload_str(), session.get_encoding())
+        except ValueError:
+            print("Received illegal payload")
+            return None
+        if not isinstance(json_data, dict):
+            print("Received split request with a payload that is no object")
+            return None
+
+        # Only transfers that were handed on are remembered, the sender may retry the others using the same id
+        self.__completed_sessions.pop(session_key, None)
+        self.__completed_sessions[session_key] = (now, last_index)
+        self.__completed_count += 1
+        first_req = session.get_first_request()
+        return Request(first_req.get_path(),
+                       first_req.get_session_id(),
+                       first_req.get_sender(),
+                       first_req.get_receiver(),
+                       json_data)
+
+    def __is_late_duplicate(self, session_key: tuple, req: Request) -> bool:
+        """
+        Checks whether the block repeats a part of a split request completed within the duplicate window.
+
+        A first block always starts a new transfer, so senders can reuse the session id or retry a transfer whose
+        response got lost. Other blocks only count as duplicates while no new transfer was started.
+        """
+
+        completed = self.__completed_sessions.get(session_key)
+        if completed is None:
+            return False
+        p_index = req.get_payload()["package_index"]
+        if p_index == 0:
+            del self.__completed_sessions[session_key]
+            return False
+        return session_key not in self.__sessions and p_index <= completed[1]
+
+    def __remove(self, session_key: tuple):
+        session: SplitSession = self.__sessions.pop(session_key)
+        self.__buffer_size -= session.get_size()
+
+    def __remove_expired(self, now: float):
+        """Drops every split request that did not receive a block within the ttl"""
+
+        while self.__completed_sessions and \
+                now - next(iter(self.__completed_sessions.values()))[0] >= self.__duplicate_window:
+            self.__completed_sessions.popitem(last=False)
+
+        while self.__sessions:
+            session_key, session = next(iter(self.__sessions.items()))
+            if now - session.last_update < self.__ttl:
+                return
+            self.__remove(session_key)
+            self.__expired_count += 1
+
+    def __make_room(self, size: int, session_key: tuple):
+        """Drops the least recently updated split requests until 'size' more characters fit into the buffer"""
+
+        while self.__sessions and self.__buffer_size + size > self.__max_buffer_size:
+            oldest_key = next(iter(self.__sessions))
+            self.__remove(oldest_key)
+            self.__evicted_count += 1
+            if oldest_key == session_key:
+                return
+
+    def get_stats(self) -> dict:
+        """Returns counters for the completed, expired and evicted split requests"""
+
+        return {"completed": self.__completed_count,
+                "expired": self.__expired_count,
+                "evicted": self.__evicted_count,
+                "pending": len(self.__sessions),
+                "buffered_size": self.__buffer_size}
@@ -1,6 +1,42 @@
+import asyncio
+import io
+import json
+import os
+import tempfile
 import unittest
-from serial_connector import SerialConnector
-from time import sleep
+from contextlib import redirect_stdout
+from math import ceil
+from queue import Queue, Empty
+from random import uniform
+from threading import Thread, Timer, Event
+from time import sleep, time
+
+import paho.mqtt.client as mqtt
+from jsonschema import validate
+
+import client_control_methods
+import mqtt_session
+import wire_codecs
+from async_network_connector import AsyncNetworkConnector
+from async_serial_connector import AsyncSerialConnector
+from baudrate_memory import BaudrateMemory
+from fleet_simulator import VirtualClient, get_percentiles
+from in_memory_connector import InMemoryConnector
+from mqtt_connector import decode_mqtt_message, get_scoped_topic, get_request_path, get_subscriptions, \
+    report_dropped_repr_body, MAX_DROPPED_REPR_SENDERS
+from mqtt_publish_queue import PublishQueue, PublishClass
+from network_connector import NetworkConnector
+from request_validation import get_body_validator
+from ring_buffer import RingBuffer
+from serial_capture import read_capture, DIRECTION_RX, DIRECTION_TX
+from serial_connector import SerialConnector, encode_serial_request, BAUDRATE_PATH
+from serial_frame_parser import SerialFrameParser
+from serial_port_pool import SerialPortPool
+from shard_coordinator import ShardCoordinator
+from shard_ring import ShardRing
+from split_requests import SplitRequestBuffer, SplitSettings, split_request, get_split_windows, PART_PROCESSING_TIME, \
+    DEFAULT_PAUSE, DEFAULT_RECEIVE_BUFFER_SIZE
+from virtual_esp32 import VirtualESP32
 
 from mqtt_echo_client import MQTTTestEchoClient
 from mqtt_connector import MQTTConnector, Request
@@ -22,7 +58,7 @@ def test_mqtt_connector():
     i = 0
 
     while i < 5:
-        buf_req = connector.get_request()
+        buf_req = connector.get_request(timeout=1)
         if buf_req:
             print(buf_req.get_body())
             i += 1
@@ -63,6 +99,1077 @@ class BridgeUnitTest(unittest.TestCase):
         self.assertTrue(mqtt_test_split())
 
 
+class ResponderConnector(NetworkConnector):
+    """Connector answering every request addressed to 'responder' after a short delay"""
+
+    _push_receive = True
+
+    def __init__(self, delay: float = 0.05):
+        super().__init__()
+        self.__delay = delay
+
+    def _send_data(self, req: Request):
+        if req.get_path() == "smarthome/broadcast/req":
+            for i, name in enumerate(["chip_a", "chip_b"]):
+                res = Request("smarthome/broadcast/res", req.get_session_id(), name, req.get_sender(), {})
+                Timer(self.__delay * (i + 1), self._process_received_request, [res]).start()
+        elif req.get_receiver() == "responder":
+            res = req.get_response(ack=True, payload={"echo": req.get_payload()})
+            Timer(self.__delay, self._process_received_request, [res]).start()
+
+    def connected(self) -> bool:
+        return True
+
+
+class PolledResponderConnector(NetworkConnector):
+    """Connector answering in random order, which has to be polled like the serial connector"""
+
+    def __init__(self):
+        super().__init__()
+        self.__responses = Queue()
+
+    def _send_data(self, req: Request):
+        if req.get_receiver() == "responder":
+            res = req.get_response(ack=True, payload={"echo": req.get_payload()})
+            Timer(uniform(0.01, 0.2), self.__responses.put, [res]).start()
+
+    def _receive_data(self):
+        try:
+            return self.__responses.get(timeout=0.1)
+        except Empty:
+            return None
+
+    def connected(self) -> bool:
+        return True
+
+
+class NetworkConnectorUnitTest(unittest.TestCase):
+
+    def test_send_request_response(self):
+        connector = ResponderConnector()
+        out_req = Request("smarthome/test", 1001, "tester", "responder", {"value": 3})
+
+        res_ack, res = connector.send_request(out_req, timeout=2)
+
+        self.assertTrue(res_ack)
+        self.assertEqual(res.get_payload()["echo"], {"value": 3})
+        self.assertIsNone(connector.get_request())
+
+    def test_send_request_keeps_unrelated_traffic(self):
+        connector = ResponderConnector()
+        unrelated = Request("smarthome/heartbeat", 555, "client", "<bridge>", {"runtime_id": 1})
+        connector._process_received_request(unrelated)
+
+        res_ack, res = connector.send_request(Request("smarthome/test", 1002, "tester", "responder", {}), timeout=2)
+
+        self.assertTrue(res_ack)
+        self.assertIs(connector.get_request(), unrelated)
+
+    def test_send_request_timeout(self):
+        connector = ResponderConnector()
+        start = time()
+
+        res_ack, res = connector.send_request(Request("smarthome/test", 1003, "tester", "nobody", {}), timeout=1)
+
+        self.assertIsNone(res)
+        self.assertGreaterEqual(time() - start, 0.9)
+
+    def test_get_request_blocks_until_delivery(self):
+        connector = ResponderConnector()
+        incoming = Request("smarthome/heartbeat", 1004, "client", "<bridge>", {"runtime_id": 1})
+        Timer(0.1, connector._process_received_request, [incoming]).start()
+
+        self.assertIsNone(connector.get_request())
+        self.assertIs(connector.get_request(timeout=2), incoming)
+        self.assertEqual(list(connector.requests(timeout=0.1)), [])
+
+
+class SplitRequestBufferUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.big_req = Request("smarthome/config/write", 4000, "tester", "chip", {"config": {"data": "x" * 200}})
+
+    def test_reassemble_out_of_order_with_duplicates(self):
+        buffer = SplitRequestBuffer()
+        parts = split_request(self.big_req, 30)
+        shuffled = parts[1:] + parts[:1] + [parts[2]]
+
+        results = [buffer.add(part) for part in shuffled]
+
+        completed = [res for res in results if res is not None]
+        self.assertEqual(len(completed), 1)
+        self.assertEqual(completed[0].get_payload(), self.big_req.get_payload())
+        self.assertEqual(buffer.get_stats()["completed"], 1)
+        self.assertEqual(buffer.get_stats()["pending"], 0)
+
+    def test_binary_safe_encodings(self):
+        payload = {"text": 'quote " $*$ back\\slash \u00fc', "list": [1, 2.5, None]}
+        req = Request("smarthome/config/write", 4010, "tester", "chip", payload)
+
+        for encoding in ["base64", "base85"]:
+            buffer = SplitRequestBuffer()
+            results = [buffer.add(part) for part in split_request(req, 16, encoding)]
+            self.assertEqual(results[-1].get_payload(), payload)
+
+    def test_reused_session_id(self):
+        buffer = SplitRequestBuffer()
+        parts = split_request(self.big_req, 30)
+        self.assertIsNotNone([buffer.add(part) for part in parts][-1])
+
+        # Late duplicates of the finished transfer are dropped, a new transfer with the same id is not
+        self.assertIsNone(buffer.add(parts[1]))
+        new_req = Request("smarthome/config/write", 4000, "tester", "chip", {"config": {"data": "n" * 150}})
+        results = [buffer.add(part) for part in split_request(new_req, 30)]
+        self.assertEqual(results[-1].get_payload(), new_req.get_payload())
+
+        # An identical retry, e.g. after the response got lost, is handed on again
+        results = [buffer.add(part) for part in split_request(new_req, 30)]
+        self.assertEqual(results[-1].get_payload(), new_req.get_payload())
+
+    def test_reused_session_id_same_first_part(self):
+        buffer = SplitRequestBuffer()
+        first_req = Request("smarthome/config/write", 4000, "tester", "chip",
+                            {"config": {"data": "x" * 100, "name": "first"}})
+        second_req = Request("smarthome/config/write", 4000, "tester", "chip",
+                             {"config": {"data": "x" * 100, "name": "second"}})
+        first_parts = split_request(first_req, 30)
+        second_parts = split_request(second_req, 30)
+        self.assertEqual(first_parts[0].get_payload(), second_parts[0].get_payload())
+
+        self.assertEqual([buffer.add(part) for part in first_parts][-1].get_payload(), first_req.get_payload())
+        self.assertEqual([buffer.add(part) for part in second_parts][-1].get_payload(), second_req.get_payload())
+        self.assertEqual(buffer.get_stats()["completed"], 2)
+        self.assertEqual(buffer.get_stats()["pending"], 0)
+
+    def test_duplicate_window(self):
+        buffer = SplitRequestBuffer(duplicate_window=0.05)
+        parts = split_request(self.big_req, 30)
+        [buffer.add(part) for part in parts]
+        sleep(0.1)
+
+        self.assertIsNone(buffer.add(parts[1]))
+        self.assertEqual(buffer.get_stats()["pending"], 1)
+
+    def test_retry_after_illegal_payload(self):
+        buffer = SplitRequestBuffer()
+        broken = {"package_index": 0, "split_payload": "{$*$a", "last_index": 0}
+        self.assertIsNone(buffer.add(Request("smarthome/config/write", 4020, "tester", "chip", broken)))
+        self.assertIsNone(buffer.add(Request("smarthome/config/write", 4020, "tester", "chip",
+                                             {"package_index": 0, "split_payload": "[1, 2]", "last_index": 0})))
+
+        retry = buffer.add(Request("smarthome/config/write", 4020, "tester", "chip",
+                                   {"package_index": 0, "split_payload": "{$*$a$*$: 1}", "last_index": 0}))
+        self.assertEqual(retry.get_payload(), {"a": 1})
+
+    def test_last_index_count(self):
+        parts = split_request(self.big_req, 30)
+        legacy_parts = split_request(self.big_req, 30, last_index_count=True)
+
+        self.assertEqual(parts[0].get_payload()["last_index"], len(parts) - 1)
+        self.assertEqual(legacy_parts[0].get_payload()["last_index"], len(parts))
+
+        # Clients report the semantics they expect in their heartbeat
+        capabilities = {"split_last_index_count": True}
+        with open("json_schemas/bridge_heartbeat_request.json") as f:
+            validate({"runtime_id": 1, "capabilities": capabilities}, json.load(f))
+        self.assertTrue(SplitSettings.from_capabilities(capabilities, SplitSettings()).last_index_count)
+
+    def test_expire_incomplete(self):
+        buffer = SplitRequestBuffer(ttl=0.05)
+        buffer.add(split_request(self.big_req, 30)[0])
+        sleep(0.1)
+
+        buffer.add(Request("smarthome/config/write", 4001, "tester", "chip",
+                           {"package_index": 0, "split_payload": "{}", "last_index": 0}))
+
+        self.assertEqual(buffer.get_stats()["expired"], 1)
+        self.assertEqual(buffer.get_stats()["buffered_size"], 0)
+
+    def test_evict_least_recently_used(self):
+        buffer = SplitRequestBuffer(max_buffer_size=100)
+        for session_id in [4002, 4003, 4004, 4005]:
+            buffer.add(Request("smarthome/config/write", session_id, "tester", "chip",
+                               {"package_index": 0, "split_payload": "a" * 30, "last_index": 1}))
+
+        stats = buffer.get_stats()
+        self.assertEqual(stats["evicted"], 1)
+        self.assertEqual(stats["pending"], 3)
+        self.assertLessEqual(stats["buffered_size"], 100)
+
+
+class LinkedConnector(NetworkConnector):
+    """Connector delivering every sent request to its peer"""
+
+    _push_receive = True
+
+    def __init__(self, own_name: str):
+        super().__init__(own_name)
+        self.peer = None
+        self.sent = []
+
+    def _send_data(self, req: Request):
+        self.sent.append(req)
+        Timer(0, self.peer._process_received_request, [req]).start()
+
+    def connected(self) -> bool:
+        return True
+
+
+def start_linked_echo(own_name: str) -> (LinkedConnector, LinkedConnector):
+    """Creates a linked pair of connectors, the one named 'own_name' echoes every request it receives"""
+
+    sender = LinkedConnector("tester")
+    responder = LinkedConnector(own_name)
+    sender.peer = responder
+    responder.peer = sender
+
+    def echo():
+        for req in responder.requests(timeout=3):
+            if req.get_receiver() == own_name:
+                responder.send_request(req.get_response(ack=True, payload=dict(req.get_payload())), 0)
+
+    Thread(target=echo, daemon=True).start()
+    return sender, responder
+
+
+class SplitWindowUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.payload = {"config": {"data": "y" * 500, "value": 55.6}}
+
+    def test_window_acks(self):
+        sender, responder = start_linked_echo("responder")
+        sender.set_split_settings("responder", SplitSettings(part_size=20, window_size=8, window_acks=True,
+                                                                   receive_buffer_size=200))
+
+        out_req = Request("smarthome/config/write", 5000, "tester", "responder", self.payload)
+
+        res_ack, res = sender.send_request_split(out_req, timeout=2)
+
+        self.assertTrue(res_ack)
+        self.assertEqual(res.get_payload()["config"], self.payload["config"])
+        window_acks = [req for req in responder.sent if "package_index" in req.get_payload()]
+        self.assertEqual(len(window_acks), ceil((len(split_request(out_req, 20)) - 1) / 8))
+
+    def test_paced_windows(self):
+        sender, responder = start_linked_echo("responder")
+        sender.set_split_settings(None, SplitSettings(window_size=4, pause=0.01, receive_buffer_size=180))
+
+        res_ack, res = sender.send_request_split(Request("smarthome/config/write", 5001, "tester", "responder",
+                                                         self.payload), timeout=2)
+
+        self.assertTrue(res_ack)
+        self.assertEqual(res.get_payload()["config"], self.payload["config"])
+        self.assertTrue(all(sender._get_frame_size(req) <= 180 for req in sender.sent))
+
+    def test_pause_from_link_rate(self):
+        self.assertEqual(SplitSettings(pause=0.5).get_pause([200, 200], 11520), 0.5)
+        self.assertEqual(SplitSettings().get_pause([200, 200], 11520), DEFAULT_PAUSE)
+
+        # Clients reporting their capabilities get the pause their frames need
+        settings = SplitSettings.from_capabilities({"split_window": 2}, SplitSettings())
+        self.assertAlmostEqual(settings.get_pause([200, 200], 11520), 400 / 11520 + 2 * PART_PROCESSING_TIME)
+        self.assertAlmostEqual(settings.get_pause([200], None), PART_PROCESSING_TIME)
+
+    def test_split_windows(self):
+        parts = split_request(Request("smarthome/config/write", 5004, "tester", "responder", self.payload), 100)
+        windows = get_split_windows(parts, SplitSettings(window_size=2, window_acks=True))
+
+        self.assertEqual([len(window) for window in windows], [2, 2, 1])
+        self.assertEqual([part.get_payload().get("ack_window") for part in windows[0]], [None, True])
+        self.assertNotIn("ack_window", parts[1].get_payload())
+
+    def test_no_split_if_frame_fits(self):
+        sender, responder = start_linked_echo("responder")
+        sender.set_split_settings("responder", SplitSettings.from_capabilities({"receive_buffer_size": 4096},
+                                                                               SplitSettings()))
+
+        res_ack, res = sender.send_request_split(Request("smarthome/config/write", 5002, "tester", "responder",
+                                                         self.payload), timeout=2)
+
+        self.assertTrue(res_ack)
+        self.assertEqual(len(sender.sent), 1)
+
+    def test_split_for_unknown_buffer(self):
+        sender, responder = start_linked_echo("responder")
+
+        res_ack, res = sender.send_request_split(Request("smarthome/config/write", 5003, "tester", "responder",
+                                                         self.payload), timeout=2)
+
+        self.assertTrue(res_ack)
+        self.assertGreater(len(sender.sent), 1)
+        self.assertTrue(all(sender._get_frame_size(req) <= DEFAULT_RECEIVE_BUFFER_SIZE for req in sender.sent))
+
+
+def send_concurrently(connector: NetworkConnector, count: int) -> dict:
+    """Sends 'count' requests from separate threads and returns the echoed payloads by request index"""
+
+    results = {}
+
+    def send(index: int):
+        req = Request("smarthome/test", 3000 + index, "tester", "responder", {"i": index})
+        _, res = connector.send_request(req, timeout=3)
+        results[index] = None if res is None else res.get_payload()["echo"]["i"]
+
+    threads = [Thread(target=send, args=[i]) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class ConcurrentRequestsUnitTest(unittest.TestCase):
+
+    def test_concurrent_requests_push(self):
+        results = send_concurrently(ResponderConnector(), 40)
+        self.assertEqual(results, {i: i for i in range(40)})
+
+    def test_concurrent_requests_polled(self):
+        connector = PolledResponderConnector()
+        results = send_concurrently(connector, 20)
+        self.assertEqual(results, {i: i for i in range(20)})
+        self.assertIsNone(connector.get_request())
+
+    def test_shared_session_id(self):
+        connector = ResponderConnector()
+        results = []
+
+        def send(value: int):
+            _, res = connector.send_request(Request("smarthome/test", 3100, "tester", "responder", {"v": value}), 2)
+            results.append(res)
+
+        threads = [Thread(target=send, args=[i]) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len([res for res in results if res is not None]), 5)
+
+
+class WireCodecUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        with open("json_schemas/request_basic_structure.json", "r") as f:
+            self.schema = json.load(f)
+        self.req = Request("smarthome/remotes/gadget/update", 7000, "chip", "<bridge>",
+                           {"name": "lamp", "characteristic": 3, "value": 47})
+
+    def check_round_trip(self, codec: wire_codecs.WireCodec):
+        payload = codec.encode(self.req.get_body())
+        self.assertIs(wire_codecs.detect_codec(payload), codec)
+        res = decode_mqtt_message(self.req.get_path(), payload)
+        self.assertEqual(res.get_body(), self.req.get_body())
+
+    def test_json(self):
+        self.check_round_trip(wire_codecs.JSON_CODEC)
+
+    def test_json_quotes_kept(self):
+        self.req.get_payload()["label"] = "it's None"
+        self.check_round_trip(wire_codecs.JSON_CODEC)
+
+    def test_repr_compat(self):
+        payload = str(self.req.get_body()).encode()
+        self.assertIsNone(decode_mqtt_message(self.req.get_path(), payload))
+        res = decode_mqtt_message(self.req.get_path(), payload, repr_compat_clients={"chip"})
+        self.assertEqual(res.get_body(), self.req.get_body())
+
+    def test_repr_reports_bounded(self):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            report_dropped_repr_body("repr_sender_0")
+            report_dropped_repr_body("repr_sender_0")
+            for index in range(1, MAX_DROPPED_REPR_SENDERS + 1):
+                report_dropped_repr_body(f"repr_sender_{index}")
+            # The first sender was forgotten to make room for the others
+            report_dropped_repr_body("repr_sender_0")
+
+        self.assertEqual(output.getvalue().count("by 'repr_sender_0'"), 2)
+
+    def test_validation_modes(self):
+        body = dict(self.req.get_body(), session_id="7000")
+        for mode in ["structural", "schema"]:
+            self.assertFalse(get_body_validator(mode, self.schema)(body))
+            self.assertTrue(get_body_validator(mode, self.schema)(dict(body, session_id=7000, receiver=None)))
+        self.assertRaises(RuntimeError, get_body_validator, "strict", self.schema)
+
+    @unittest.skipIf(wire_codecs.msgpack is None, "msgpack is not installed")
+    def test_msgpack(self):
+        self.check_round_trip(wire_codecs.get_codec("msgpack"))
+
+    @unittest.skipIf(wire_codecs.cbor2 is None, "cbor2 is not installed")
+    def test_cbor(self):
+        self.check_round_trip(wire_codecs.get_codec("cbor"))
+
+    def test_select_codec(self):
+        self.assertIs(wire_codecs.select_codec(["zstd"]), wire_codecs.JSON_CODEC)
+        self.assertFalse(wire_codecs.select_codec(["msgpack", "cbor", "json"], allow_binary=False).binary)
+
+    def test_encoded_body_cache(self):
+        encoded = self.req.get_encoded_body(wire_codecs.JSON_CODEC)
+        self.assertIs(self.req.get_encoded_body(wire_codecs.JSON_CODEC), encoded)
+        self.assertEqual(wire_codecs.JSON_CODEC.decode(encoded), self.req.get_body())
+
+
+class MQTTTopicUnitTest(unittest.TestCase):
+
+    def test_scoped_topic_round_trip(self):
+        topic = get_scoped_topic("smarthome/config/write", "chip_a")
+        self.assertEqual(topic, "smarthome/to/chip_a/config/write")
+        self.assertEqual(get_request_path(topic), "smarthome/config/write")
+        self.assertEqual(get_request_path("smarthome/heartbeat"), "smarthome/heartbeat")
+
+    def test_unscoped_receivers(self):
+        self.assertEqual(get_scoped_topic("smarthome/broadcast/req", None), "smarthome/broadcast/req")
+        self.assertEqual(get_scoped_topic("smarthome/sync", "chip/a"), "smarthome/sync")
+
+    def test_subscriptions(self):
+        self.assertEqual(get_subscriptions(None), ["smarthome/#"])
+        self.assertEqual(get_subscriptions(["<bridge>"]), ["smarthome/to/<bridge>/#", "smarthome/broadcast/#"])
+
+
+class MQTTSessionUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        # Nothing listens there, the session stays disconnected
+        self.session = mqtt_session.get_session("tester", "127.0.0.1", 1)
+
+    def tearDown(self):
+        mqtt_session.release_session(self.session)
+
+    def test_shared_session(self):
+        other = mqtt_session.get_session("other", "127.0.0.1", 1)
+        self.assertIs(other, self.session)
+        mqtt_session.release_session(other)
+        self.assertIs(mqtt_session.get_session("other", "127.0.0.1", 1), self.session)
+        mqtt_session.release_session(self.session)
+
+    def test_shared_group_session(self):
+        shard_session = mqtt_session.get_session("shard", "127.0.0.1", 1, shared_group="bridges")
+        self.assertIsNot(shard_session, self.session)
+        mqtt_session.release_session(shard_session)
+
+        memory_session = mqtt_session.get_session("tester", mqtt_session.MEMORY_BROKER, 7)
+        self.assertIs(mqtt_session.get_session("shard", mqtt_session.MEMORY_BROKER, 7, shared_group="bridges"),
+                      memory_session)
+        mqtt_session.release_session(memory_session)
+        mqtt_session.release_session(memory_session)
+
+    def test_topic_dispatch(self):
+        received = {"smarthome": [], "homebridge": []}
+        self.session.subscribe(["smarthome/#", "smarthome/heartbeat"], received["smarthome"].append)
+        handle = self.session.subscribe(["homebridge/#"], received["homebridge"].append)
+
+        for topic in [b"smarthome/heartbeat", b"homebridge/from/set"]:
+            self.session._dispatch(mqtt.MQTTMessage(topic=topic))
+        self.session.unsubscribe(handle)
+        self.session._dispatch(mqtt.MQTTMessage(topic=b"homebridge/from/set"))
+
+        self.assertEqual(len(received["smarthome"]), 1)
+        self.assertEqual(len(received["homebridge"]), 1)
+
+
+    def test_filter_qos(self):
+        first = self.session.subscribe(["smarthome/#"], lambda message: None)
+        second = self.session.subscribe(["smarthome/#", "homebridge/#"], lambda message: None, 1)
+
+        self.assertEqual(sorted(self.session._get_topic_filters()), [("homebridge/#", 1), ("smarthome/#", 1)])
+        self.session.unsubscribe(first)
+        self.session.unsubscribe(second)
+        self.assertEqual(self.session._get_topic_filters(), [])
+
+    def test_in_dispatch(self):
+        states = []
+        self.session.subscribe(["smarthome/#"], lambda message: states.append(self.session.in_dispatch()))
+        self.session._dispatch(mqtt.MQTTMessage(topic=b"smarthome/heartbeat"))
+
+        self.assertEqual(states, [True])
+        self.assertFalse(self.session.in_dispatch())
+
+
+class BlockingSession:
+    """Stands in for a broker session, publishing blocks until it is released"""
+
+    def __init__(self):
+        self.published = []
+        self.release = Event()
+
+    def publish(self, topic: str, payload: bytes, qos: int = 0, properties=None):
+        self.release.wait(5)
+        self.published.append((topic, payload, qos))
+        info = mqtt.MQTTMessageInfo(0)
+        info._set_as_published()
+        return info
+
+
+class PublishQueueUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.session = BlockingSession()
+        self.queue = PublishQueue(self.session, max_size=3)
+        # The worker takes the first message and blocks, the following ones stay queued
+        self.queue.put("smarthome/first", b"0")
+        sleep(0.1)
+
+    def tearDown(self):
+        self.session.release.set()
+        self.queue.close()
+
+    def test_coalesce(self):
+        for value in range(5):
+            self.queue.put("smarthome/update", str(value).encode(), coalesce_key=("lamp", 1))
+        self.queue.put("smarthome/update", b"other", coalesce_key=("fan", 1))
+        self.assertEqual(self.queue.get_stats()["coalesced"], 4)
+
+        self.session.release.set()
+        self.queue.close()
+        self.assertEqual([payload for _, payload, _ in self.session.published], [b"0", b"4", b"other"])
+
+    def test_backpressure(self):
+        for value in range(3):
+            self.assertTrue(self.queue.put("smarthome/update", str(value).encode(), timeout=0))
+        self.assertTrue(self.queue.is_congested())
+        self.assertFalse(self.queue.put("smarthome/update", b"3", timeout=0.1))
+        self.assertEqual(self.queue.get_stats()["dropped"], 1)
+        self.assertEqual(self.queue.get_stats()["max_queued"], 3)
+
+    def test_publish_class(self):
+        publish_class = PublishClass(0, ["name", "characteristic"])
+        req = Request("smarthome/remotes/gadget/to_client/update", 1, "<bridge>", "chip",
+                      {"name": "lamp", "characteristic": 1, "value": 5})
+        self.assertEqual(publish_class.get_coalesce_key(req), ("chip", "lamp", 1))
+        self.assertIsNone(PublishClass(1).get_coalesce_key(req))
+        self.assertRaises(RuntimeError, PublishClass, 3)
+
+
+class InMemoryConnectorUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.responder = MQTTTestEchoClient(mqtt_session.MEMORY_BROKER, 7)
+        self.connector = InMemoryConnector("tester", 7)
+
+    def tearDown(self):
+        self.responder.quit()
+        self.connector.close()
+
+    def test_echo(self):
+        out_req = Request("smarthome/test", 1334544, "tester", self.responder.get_name(), {"value": 55.6})
+        _, res = self.connector.send_request(out_req, timeout=2)
+        self.assertEqual(res.get_payload(), {"value": 55.6})
+
+    def test_echo_split(self):
+        out_payload = {"test": "main long test", "more_data": 12223222332423}
+        out_req = Request("smarthome/test", 1334545, "tester", self.responder.get_name(), out_payload)
+        _, res = self.connector.send_request_split(out_req, part_max_size=15, timeout=2)
+        self.assertEqual(res.get_payload(), out_payload)
+
+    def test_separate_brokers(self):
+        other = InMemoryConnector("other", 8)
+        out_req = Request("smarthome/test", 1334546, "other", self.responder.get_name(), {})
+        self.assertEqual(other.send_request(out_req, timeout=0.2), (None, None))
+        other.close()
+
+
+class MQTTv5UnitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.requester = InMemoryConnector("v5_requester", 9, mqtt_v5=True)
+        self.responder = InMemoryConnector("v5_responder", 9, mqtt_v5=True)
+        self.observed = []
+        self.session = mqtt_session.get_session("observer", mqtt_session.MEMORY_BROKER, 9)
+        self.observer = self.session.subscribe(["smarthome/#"], lambda message: self.observed.append(message.topic))
+
+    def tearDown(self):
+        self.session.unsubscribe(self.observer)
+        mqtt_session.release_session(self.session)
+        self.requester.close()
+        self.responder.close()
+
+    def respond(self):
+        req = self.responder.get_request(timeout=2)
+        self.assertIsNotNone(req)
+        self.responder.send_request(req.get_response(payload={"echo": req.get_payload()["value"]}), 0)
+
+    def test_response_routed_to_response_topic(self):
+        responder = Thread(target=self.respond)
+        responder.start()
+        out_req = Request("smarthome/test", 5500, "v5_requester", "v5_responder", {"value": 3})
+        _, res = self.requester.send_request(out_req, timeout=2)
+        responder.join()
+
+        self.assertEqual(res.get_payload(), {"echo": 3})
+        # Only the request was published on the shared topics
+        self.assertEqual(self.observed, ["smarthome/test"])
+        self.assertTrue(self.requester.get_response_topic().startswith("smarthome_responses/v5_requester"))
+
+    def test_legacy_response(self):
+        # Clients without MQTT v5 ignore the response topic and answer on the request path
+        self.responder.close()
+        self.responder = InMemoryConnector("v5_responder", 9)
+        responder = Thread(target=self.respond)
+        responder.start()
+        out_req = Request("smarthome/test", 5501, "v5_requester", "v5_responder", {"value": 4})
+        _, res = self.requester.send_request(out_req, timeout=2)
+        responder.join()
+
+        self.assertEqual(res.get_payload(), {"echo": 4})
+        self.assertEqual(self.observed, ["smarthome/test", "smarthome/test"])
+
+
+class ShardingUnitTest(unittest.TestCase):
+
+    def test_ring_moves_few_clients(self):
+        clients = [f"client_{index}" for index in range(1000)]
+        ring = ShardRing(["shard_a", "shard_b", "shard_c"])
+        grown = ShardRing(["shard_a", "shard_b", "shard_c", "shard_d"])
+        moved = [name for name in clients if ring.get_shard(name) != grown.get_shard(name)]
+
+        # Only the clients now assigned to the new shard move
+        self.assertTrue(all(grown.get_shard(name) == "shard_d" for name in moved))
+        self.assertLess(len(moved), 400)
+        self.assertIsNone(ShardRing([]).get_shard("client_0"))
+
+    def test_requests_pinned_to_shard(self):
+        ring = ShardRing(["shard_a", "shard_b"])
+        shards = {name: InMemoryConnector("bridge", 10, shard_group="bridges", shard_name=name)
+                  for name in ring.get_shards()}
+        for shard in shards.values():
+            shard.set_shard_ring(ring)
+        client = InMemoryConnector("clients", 10)
+
+        senders = [f"client_{index}" for index in range(20)]
+        for session_id, sender in enumerate(senders):
+            client.send_request(Request("smarthome/heartbeat", session_id + 1, sender, "<bridge>", {}), 0)
+        received = []
+        for name, shard in shards.items():
+            for req in shard.requests(timeout=0.3):
+                self.assertEqual(ring.get_shard(req.get_sender()), name)
+                received.append(req.get_sender())
+
+        self.assertEqual(sorted(received), sorted(senders))
+        client.close()
+        for shard in shards.values():
+            shard.close()
+
+    def test_coordinators_find_each_other(self):
+        rings = {}
+        coordinators = [ShardCoordinator("bridges", name, mqtt_session.MEMORY_BROKER, 11,
+                                         lambda name=name: {"clients": [name]},
+                                         lambda ring, name=name: rings.__setitem__(name, ring.get_shards()),
+                                         interval=0.05, timeout=0.5)
+                        for name in ["shard_a", "shard_b"]]
+        sleep(0.2)
+
+        self.assertEqual(rings, {"shard_a": ["shard_a", "shard_b"], "shard_b": ["shard_a", "shard_b"]})
+        self.assertEqual(coordinators[0].get_shard_states(), {"shard_b": {"clients": ["shard_b"]}})
+
+        coordinators[1].close()
+        sleep(0.8)
+        self.assertEqual(rings["shard_a"], ["shard_a"])
+        coordinators[0].close()
+
+
+class FleetSimulatorUnitTest(unittest.TestCase):
+
+    def test_sync_response(self):
+        client = VirtualClient("sim_00001", 3, [1, 3])
+        sync_req = Request("smarthome/sync", 4000, "<bridge>", "sim_00001", {"server_time": 0})
+        res = client.handle_request(sync_req)
+
+        with open("json_schemas/bridge_sync_request.json", "r") as f:
+            validate(res.get_payload(), json.load(f))
+        self.assertEqual(res.get_receiver(), "<bridge>")
+        self.assertEqual(len(res.get_payload()["gadgets"]), 3)
+
+    def test_restart_changes_runtime_id(self):
+        client = VirtualClient("sim_00001", 1, [1])
+        runtime_id = client.get_heartbeat().get_payload()["runtime_id"]
+        reboot_req = Request("smarthome/sys", 4001, "<bridge>", "sim_00001", {"subject": "reboot"})
+        self.assertTrue(client.handle_request(reboot_req).get_ack())
+        self.assertNotEqual(client.get_heartbeat().get_payload()["runtime_id"], runtime_id)
+
+    def test_percentiles(self):
+        self.assertEqual(get_percentiles(list(range(100)), [50, 99]), [50, 99])
+        self.assertEqual(get_percentiles([], [50]), [None])
+
+
+class RingBufferUnitTest(unittest.TestCase):
+
+    def test_lines_across_wrap(self):
+        buffer = RingBuffer(16)
+        buffer.write(b"0123456789")
+        self.assertEqual(buffer.read(8), b"01234567")
+        buffer.write(b"ab\ncdefgh\nij")
+
+        self.assertEqual(buffer.read_line(), b"89ab\n")
+        self.assertEqual(buffer.read_line(), b"cdefgh\n")
+        self.assertIsNone(buffer.read_line())
+        self.assertEqual(len(buffer), 2)
+
+    def test_overflow_drops_oldest(self):
+        buffer = RingBuffer(8)
+        buffer.write(b"abcdef")
+        buffer.write(b"ghij\n")
+        self.assertEqual(buffer.get_dropped(), 3)
+        self.assertEqual(buffer.read_line(), b"defghij\n")
+
+        buffer.write(b"x" * 20)
+        self.assertEqual(buffer.get_dropped(), 15)
+        self.assertEqual(buffer.read(20), b"x" * 8)
+
+
+class SerialFrameParserUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.req = Request("smarthome/test", 4711, "chip", "<bridge>", {"list": [1, [2]], "text": "a]_b[c"})
+        self.frame = encode_serial_request(self.req)
+
+    def test_split_reads(self):
+        parser = SerialFrameParser()
+        stream = b"boot debug output\r\n" + self.frame + b"[D] " + self.frame.replace(b"\n", b"\r\n")
+        items = []
+        for index in range(0, len(stream), 7):
+            items += parser.feed(stream[index:index + 7])
+
+        self.assertEqual(items[0], b"boot debug output\r\n")
+        self.assertEqual([item.get_body() for item in items[1:]], [self.req.get_body(), self.req.get_body()])
+        self.assertEqual(parser.get_stats(), {"frames": 2, "rejected": 0, "dropped_bytes": 0})
+
+    def test_invalid_frames(self):
+        parser = SerialFrameParser()
+        items = parser.feed(b"!r_p[smarthome/test]_b[{broken]_\n" +
+                            b"!r_p[smarthome/test]_b[{\"sender\": \"chip\"}]_\n" +
+                            b"!r_p[smarthome/test]_b[{}\n")
+
+        # The frame without an end is no frame, but debug output
+        self.assertEqual(items, [b"!r_p[smarthome/test]_b[{}\n"])
+        self.assertEqual(parser.get_stats()["rejected"], 2)
+
+
+class SerialReaderUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        # Everything written to the loopback port is read back by the reader thread
+        self.connector = SerialConnector("tester", "loop://", 115200)
+
+    def tearDown(self):
+        self.connector.close()
+
+    def test_requests_pushed(self):
+        self.assertTrue(self.connector.connected())
+        for session_id in [101, 102]:
+            self.connector.send_request(Request("smarthome/test", session_id, "tester", "echo", {"value": 3}), 0)
+
+        received = [self.connector.get_request(timeout=1) for _ in range(2)]
+        self.assertEqual([req.get_session_id() for req in received], [101, 102])
+        self.assertEqual(received[0].get_payload(), {"value": 3})
+
+    def test_baudrate_fallback(self):
+        # Nothing answers the handshake on a loopback port, which is what old firmware does
+        memory = BaudrateMemory()
+        self.assertEqual(self.connector.negotiate_baudrate("chip", [460800], memory), 115200)
+        self.assertEqual(memory.get("chip"), 115200)
+
+        # The failed rate is not tried again until the failure expires
+        start = time()
+        self.assertEqual(self.connector.negotiate_baudrate("chip", [460800], memory), 115200)
+        self.assertLess(time() - start, 0.1)
+
+    def test_close(self):
+        self.connector.close()
+        self.assertFalse(self.connector.connected())
+        self.assertIsNone(self.connector.get_request(timeout=0.1))
+
+
+class BaudrateMemoryUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".json")
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_persisted(self):
+        BaudrateMemory(self.path).set("chip", 921600)
+        self.assertEqual(BaudrateMemory(self.path).get("chip"), 921600)
+
+    def test_expiring(self):
+        memory = BaudrateMemory(self.path)
+        memory.set("chip", 115200, 0.05)
+        self.assertEqual(memory.get("chip"), 115200)
+        self.assertIsNone(BaudrateMemory(self.path).get("chip"))
+
+        sleep(0.1)
+        self.assertIsNone(memory.get("chip"))
+
+
+class SerialCaptureUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".cap")
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def record(self, count: int):
+        connector = SerialConnector("tester", "loop://", 115200, capture_path=self.path)
+        for session_id in range(1, count + 1):
+            connector.send_request(Request("smarthome/test", session_id, "chip", "tester", {"value": session_id}), 0)
+            connector.get_request(timeout=1)
+            sleep(0.05)
+        connector.close()
+
+    def test_record(self):
+        self.record(2)
+        records = read_capture(self.path)
+
+        self.assertEqual([direction for _, direction, _ in records if direction == DIRECTION_TX], [DIRECTION_TX] * 2)
+        received = b"".join(data for _, direction, data in records if direction == DIRECTION_RX)
+        sent = b"".join(data for _, direction, data in records if direction == DIRECTION_TX)
+        self.assertEqual(received, sent)
+        self.assertEqual([timestamp for timestamp, _, _ in records], sorted(timestamp for timestamp, _, _ in records))
+
+    def test_replay(self):
+        self.record(3)
+
+        # The recorded pauses between the requests are kept at normal speed
+        start = time()
+        replay = SerialConnector("tester", f"replay://{self.path}?speed=1", 115200)
+        received = [replay.get_request(timeout=1) for _ in range(3)]
+        self.assertGreater(time() - start, 0.08)
+        self.assertEqual([req.get_payload() for req in received], [{"value": 1}, {"value": 2}, {"value": 3}])
+
+        # The connection ends with the capture
+        sleep(0.2)
+        self.assertFalse(replay.connected())
+        replay.close()
+
+        fast = SerialConnector("tester", f"replay://{self.path}?speed=0", 115200)
+        self.assertEqual(fast.get_request(timeout=1).get_payload(), {"value": 1})
+        fast.close()
+
+    def test_async_replay(self):
+        self.record(2)
+
+        async def replay_requests():
+            replay = AsyncSerialConnector("tester", f"replay://{self.path}?speed=0", 115200)
+            received = [await replay.get_request(timeout=1) for _ in range(2)]
+            await replay.close()
+            self.assertFalse(replay.connected())
+            return received
+
+        self.assertEqual([req.get_payload() for req in asyncio.run(replay_requests())], [{"value": 1}, {"value": 2}])
+
+
+class SerialPortPoolUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = SerialPortPool("tester", ["loop://", "loop://?logging=info", "/dev/tty_not_existing"],
+                                   baudrate_memory_path=None)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_unavailable_ports_skipped(self):
+        self.assertEqual(self.pool.get_ports(), ["loop://", "loop://?logging=info"])
+
+    def test_run_parallel(self):
+        start = time()
+        results = self.pool.run(lambda port, chip_id, connector: sleep(0.3) or connector.connected())
+
+        self.assertEqual(results, {"loop://": True, "loop://?logging=info": True})
+        self.assertLess(time() - start, 0.55)
+
+    def test_no_chips_found(self):
+        # Nothing answers the broadcast on a loopback port
+        self.assertEqual(self.pool.discover_chip_ids(timeout=1), {"loop://": None, "loop://?logging=info": None})
+        self.assertEqual(self.pool.reboot(), {"loop://": False, "loop://?logging=info": False})
+
+
+class VirtualESP32UnitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.chip = VirtualESP32("virtual_chip", latencies={"smarthome/config/reset": 0.2}, reboot_time=0)
+        self.connector = SerialConnector("tester", self.chip.get_port(), 115200)
+
+    def tearDown(self):
+        self.connector.close()
+        self.chip.close()
+
+    def test_discovery(self):
+        self.assertEqual(client_control_methods.get_connected_chip_id(self.connector, "tester", 2), "virtual_chip")
+
+    def test_split_config_write(self):
+        config = {"name": "test", "description": "Config long enough to be split " * 10,
+                  "data": {"id": "virtual_chip", "network_mode": 2},
+                  "gadgets": [{"type": 1, "name": "lamp_1", "ports": {"port0": 2}}]}
+        self.connector.set_split_settings("virtual_chip", SplitSettings(window_size=4, window_acks=True))
+
+        self.assertTrue(client_control_methods.write_config("virtual_chip", config, "tester", self.connector))
+        self.assertEqual(self.chip.get_config(), config)
+        self.assertTrue(client_control_methods.upload_gadget("virtual_chip", config["gadgets"][0], "tester",
+                                                             self.connector)[0])
+        self.assertEqual(len(self.chip.get_gadgets()), 1)
+
+    def test_latency(self):
+        start = time()
+        self.assertTrue(client_control_methods.reset_config("virtual_chip", "gadgets", "tester", self.connector))
+        self.assertGreaterEqual(time() - start, 0.2)
+
+    def test_baudrate_negotiation(self):
+        memory = BaudrateMemory()
+        self.assertEqual(self.connector.negotiate_baudrate("virtual_chip", memory=memory), 921600)
+        self.assertEqual(memory.get("virtual_chip"), 921600)
+        self.assertTrue(client_control_methods.reboot_client("virtual_chip", "tester", self.connector))
+        self.assertEqual(self.chip.get_handled()["smarthome/sys"], 1)
+
+    def test_baudrate_negotiation_unsupported(self):
+        chip = VirtualESP32("old_chip", baudrates=[], reboot_time=0)
+        connector = SerialConnector("tester", chip.get_port(), 115200)
+        try:
+            self.assertEqual(connector.negotiate_baudrate("old_chip", [460800], BaudrateMemory()), 115200)
+            self.assertEqual(chip.get_handled()[BAUDRATE_PATH], 1)
+        finally:
+            connector.close()
+            chip.close()
+
+    def test_close_after_chip_lost(self):
+        self.assertEqual(self.connector.negotiate_baudrate("virtual_chip", memory=BaudrateMemory()), 921600)
+        self.chip.close()
+
+        # The baudrate can't be switched back anymore, the port is closed nonetheless
+        self.connector.close()
+        self.assertFalse(self.connector.connected())
+
+
+class BroadcastUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.connector = ResponderConnector()
+        self.broadcast_req = Request("smarthome/broadcast/req", 6000, "tester", None, {})
+
+    def test_expected_count(self):
+        start = time()
+        responses = self.connector.send_broadcast(self.broadcast_req, timeout=5, expected_count=1)
+
+        self.assertEqual([res.get_sender() for res in responses], ["chip_a"])
+        self.assertLess(time() - start, 1)
+
+    def test_quiet_period(self):
+        unrelated = Request("smarthome/heartbeat", 6001, "client", "<bridge>", {"runtime_id": 1})
+        self.connector._process_received_request(unrelated)
+        start = time()
+
+        responses = self.connector.send_broadcast(self.broadcast_req, timeout=5, quiet_period=0.2)
+
+        self.assertEqual([res.get_sender() for res in responses], ["chip_a", "chip_b"])
+        self.assertLess(time() - start, 1)
+        self.assertIs(self.connector.get_request(), unrelated)
+
+    def test_streaming(self):
+        senders = []
+        for res in self.connector.iter_broadcast(self.broadcast_req, timeout=0.5):
+            senders.append(res.get_sender())
+        self.assertEqual(senders, ["chip_a", "chip_b"])
+
+
+class AsyncResponderConnector(AsyncNetworkConnector):
+    """Async connector answering every request addressed to 'responder' and every broadcast"""
+
+    async def _send_data(self, req: Request):
+        if req.get_path() == "smarthome/broadcast/req":
+            for name in ["chip_a", "chip_b"]:
+                res = Request("smarthome/broadcast/res", req.get_session_id(), name, req.get_sender(), {})
+                self._loop.call_later(0.05, self._process_received_request, res)
+        elif req.get_receiver() == "responder":
+            res = req.get_response(ack=True, payload={"echo": req.get_payload()})
+            self._loop.call_later(0.05, self._process_received_request, res)
+
+    def connected(self) -> bool:
+        return True
+
+
+class AsyncLinkedConnector(AsyncNetworkConnector):
+    """Async connector delivering every sent request to its peer"""
+
+    peer = None
+
+    async def _send_data(self, req: Request):
+        self._loop.call_soon(self.peer._process_received_request, req)
+
+    def connected(self) -> bool:
+        return True
+
+
+class AsyncNetworkConnectorUnitTest(unittest.TestCase):
+
+    def test_concurrent_send_request(self):
+        async def run_requests():
+            connector = AsyncResponderConnector()
+            requests = [Request("smarthome/test", 2000 + i, "tester", "responder", {"i": i}) for i in range(50)]
+            return await asyncio.gather(*[connector.send_request(req, timeout=2) for req in requests])
+
+        results = asyncio.run(run_requests())
+
+        for i, (res_ack, res) in enumerate(results):
+            self.assertTrue(res_ack)
+            self.assertEqual(res.get_payload()["echo"], {"i": i})
+
+    def test_same_session_id(self):
+        async def run_requests():
+            connector = AsyncResponderConnector()
+            requests = [Request("smarthome/test", 2200, "tester", "responder", {"i": i}) for i in range(2)]
+            return await asyncio.gather(*[connector.send_request(req, timeout=1) for req in requests])
+
+        self.assertEqual([res_ack for res_ack, _ in asyncio.run(run_requests())], [True, True])
+
+    def test_window_acks(self):
+        async def run_split():
+            sender = AsyncLinkedConnector("tester")
+            responder = AsyncLinkedConnector("responder")
+            sender.peer = responder
+            responder.peer = sender
+            sender.set_split_settings("responder", SplitSettings(part_size=20, window_size=4, window_acks=True))
+
+            async def echo():
+                req = await responder.get_request(timeout=2)
+                await responder.send_request(req.get_response(ack=True, payload=dict(req.get_payload())), 0)
+
+            echo_task = asyncio.create_task(echo())
+            result = await sender.send_request_split(Request("smarthome/config/write", 2300, "tester", "responder",
+                                                             {"config": {"data": "z" * 200}}), timeout=1)
+            await echo_task
+            return result
+
+        res_ack, res = asyncio.run(run_split())
+        self.assertTrue(res_ack)
+        self.assertEqual(res.get_payload()["config"], {"data": "z" * 200})
+
+    def test_send_broadcast(self):
+        async def run_broadcast():
+            connector = AsyncResponderConnector()
+            req = Request("smarthome/broadcast/req", 2100, "tester", None, {})
+            return await connector.send_broadcast(req, timeout=0.3)
+
+        responses = asyncio.run(run_broadcast())
+
+        self.assertEqual(sorted(res.get_sender() for res in responses), ["chip_a", "chip_b"])
+
+    def test_send_broadcast_expected_count(self):
+        async def run_broadcast():
+            connector = AsyncResponderConnector()
+            req = Request("smarthome/broadcast/req", 2101, "tester", None, {})
+            return await connector.send_broadcast(req, timeout=5, expected_count=2)
+
+        start = time()
+        responses = asyncio.run(run_broadcast())
+
+        self.assertEqual(len(responses), 2)
+        self.assertLess(time() - start, 1)
+
+
 def mqtt_test() -> bool:
     # Start Responder
     responder = MQTTTestEchoClient(BROKER_IP,
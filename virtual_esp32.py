@@ -0,0 +1,236 @@
+"""Module to simulate a Smarthome_ESP32 chip connected via a serial port, using a pseudo terminal"""
+import argparse
+import os
+import select
+import threading
+import time
+import tty
+from typing import Optional
+
+from fleet_simulator import VirtualClient
+from network_connector import NetworkConnector
+from request import Request
+from serial_connector import encode_serial_request, BAUDRATE_PATH, HIGH_SPEED_BAUDRATES
+from serial_frame_parser import SerialFrameParser
+
+# Output of the ESP32 boot rom and the firmware after a reboot
+BOOT_OUTPUT = [b"ets Jun  8 2016 00:22:57\r\n",
+               b"rst:0xc (SW_CPU_RESET),boot:0x13 (SPI_FAST_FLASH_BOOT)\r\n",
+               b"[I][main.cpp:42] setup(): Smarthome_ESP32 starting\r\n"]
+
+
+class PtyChipConnector(NetworkConnector):
+    """Class to implement the chip end of a pseudo terminal, the other end can be opened as serial port"""
+
+    __master_fd: int
+    __slave_fd: int
+    __port: str
+
+    __parser: SerialFrameParser
+    __running: bool
+    __reader_thread: threading.Thread
+
+    _push_receive = True
+
+    def __init__(self, own_name: str):
+        super().__init__(own_name)
+        self.__master_fd, self.__slave_fd = os.openpty()
+        # No echo and no line ending translation, like a real uart
+        tty.setraw(self.__slave_fd)
+        self.__port = os.ttyname(self.__slave_fd)
+        self.__parser = SerialFrameParser(self._validate_body)
+        self.__running = True
+        self.__reader_thread = threading.Thread(target=self.__read_pty, daemon=True)
+        self.__reader_thread.start()
+
+    def __read_pty(self):
+        while self.__running:
+            readable, _, _ = select.select([self.__master_fd], [], [], 0.1)
+            if not readable:
+                continue
+            try:
+                data = os.read(self.__master_fd, 4096)
+            except OSError:
+                # Nobody has the port open at the moment
+                time.sleep(0.05)
+                continue
+            for item in self.__parser.feed(data):
+                if isinstance(item, Request):
+                    self._process_received_request(item)
+
+    def get_port(self) -> str:
+        """Returns the path of the serial port to connect to the chip with"""
+
+        return self.__port
+
+    def write_raw(self, data: bytes):
+        """Writes bytes that are no request, like debug output"""
+
+        os.write(self.__master_fd, data)
+
+    def _send_data(self, req: Request):
+        self.write_raw(encode_serial_request(req, self._encode_body(req)))
+
+    def connected(self) -> bool:
+        return self.__running
+
+    def close(self):
+        if not self.__running:
+            return
+        self.__running = False
+        self.__reader_thread.join()
+        os.close(self.__master_fd)
+        os.close(self.__slave_fd)
+
+
+class VirtualESP32:
+    """
+    Class to simulate a Smarthome_ESP32 chip answering requests on a serial port.
+
+    Answers broadcasts, config writes, gadget uploads, config resets and baudrate handshakes, syncs and reboots are
+    answered like the clients of the fleet simulator do. Every answer is delayed by the latency configured for its
+    path, or by 'default_latency'.
+    """
+
+    __name: str
+    __connector: PtyChipConnector
+    __client: VirtualClient
+
+    __latencies: dict
+    __default_latency: float
+
+    # Baudrates the simulated firmware accepts in the baudrate handshake, empty for firmware without it
+    __baudrates: list
+
+    # Seconds the chip doesn't react after a reboot
+    __reboot_time: float
+
+    __config: Optional[dict]
+    __gadgets: list
+
+    # Number of requests handled, identified by their path
+    __handled: dict
+
+    __running: bool
+    __lock: threading.Lock
+    __handler_thread: threading.Thread
+
+    def __init__(self, name: str = "virtual_esp32", default_latency: float = 0.0, latencies: Optional[dict] = None,
+                 baudrates: Optional[list] = None, reboot_time: float = 0.5):
+        self.__name = name
+        self.__client = VirtualClient(name, 2, [1, 3])
+        self.__default_latency = default_latency
+        self.__latencies = latencies if latencies is not None else {}
+        self.__baudrates = baudrates if baudrates is not None else list(HIGH_SPEED_BAUDRATES)
+        self.__reboot_time = reboot_time
+        self.__config = None
+        self.__gadgets = []
+        self.__handled = {}
+        self.__running = True
+        self.__lock = threading.Lock()
+        self.__connector = PtyChipConnector(name)
+        self.__handler_thread = threading.Thread(target=self.__handle_requests, daemon=True)
+        self.__handler_thread.start()
+
+    def __handle_requests(self):
+        while self.__running:
+            req = self.__connector.get_request(timeout=0.1)
+            if req is None:
+                continue
+            # Requests to other chips are ignored like the firmware does, broadcasts have no receiver
+            if req.get_receiver() not in [None, self.__name]:
+                continue
+            time.sleep(self.__latencies.get(req.get_path(), self.__default_latency))
+            with self.__lock:
+                self.__handled[req.get_path()] = self.__handled.get(req.get_path(), 0) + 1
+            res = self.__handle_request(req)
+            if res is not None:
+                self.__connector.send_request(res, 0)
+            if req.get_path() == "smarthome/sys" and req.get_payload().get("subject") == "reboot":
+                self.__reboot()
+
+    def __handle_request(self, req: Request) -> Optional[Request]:
+        path = req.get_path()
+        payload = req.get_payload()
+        if path == "smarthome/broadcast/req":
+            return Request("smarthome/broadcast/res", req.get_session_id(), self.__name, req.get_sender(),
+                           {"runtime_id": self.__client.get_runtime_id()})
+        if path == "smarthome/config/write":
+            with self.__lock:
+                self.__config = payload.get("config")
+                if payload.get("reset_gadgets"):
+                    self.__gadgets = []
+            return req.get_response(ack=True)
+        if path == "smarthome/gadget/add":
+            with self.__lock:
+                self.__gadgets.append(payload)
+            return req.get_response(ack=True)
+        if path == "smarthome/config/reset":
+            with self.__lock:
+                if payload.get("reset_option") in ["complete", "erase", "config"]:
+                    self.__config = None
+                if payload.get("reset_option") in ["complete", "erase", "gadgets"]:
+                    self.__gadgets = []
+            return req.get_response(ack=True)
+        if path == BAUDRATE_PATH:
+            # Firmware without the handshake doesn't know the path and never answers
+            if not self.__baudrates:
+                return None
+            # A pseudo terminal has no baudrate, only the handshake itself is simulated
+            return req.get_response(ack=payload.get("baudrate") in self.__baudrates + [115200])
+        return self.__client.handle_request(req)
+
+    def __reboot(self):
+        time.sleep(self.__reboot_time)
+        for line in BOOT_OUTPUT:
+            self.__connector.write_raw(line)
+
+    def get_name(self) -> str:
+        return self.__name
+
+    def get_port(self) -> str:
+        """Returns the path of the serial port to connect to the chip with"""
+
+        return self.__connector.get_port()
+
+    def get_config(self) -> Optional[dict]:
+        with self.__lock:
+            return self.__config
+
+    def get_gadgets(self) -> list:
+        with self.__lock:
+            return list(self.__gadgets)
+
+    def get_handled(self) -> dict:
+        """Returns the number of requests handled, identified by their path"""
+
+        with self.__lock:
+            return dict(self.__handled)
+
+    def write_debug_output(self, line: str):
+        """Writes a line of debug output like the firmware logging does"""
+
+        self.__connector.write_raw(line.encode() + b"\r\n")
+
+    def close(self):
+        self.__running = False
+        self.__handler_thread.join()
+        self.__connector.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulates a Smarthome_ESP32 chip on a pseudo terminal')
+    parser.add_argument('--name', help='Name of the chip', type=str, default="virtual_esp32")
+    parser.add_argument('--latency', help='Seconds every response is delayed by', type=float, default=0.0)
+    parser.add_argument('--no_high_speed', help='Simulates firmware without the baudrate handshake',
+                        action="store_true")
+    ARGS = parser.parse_args()
+
+    chip = VirtualESP32(ARGS.name, ARGS.latency, baudrates=[] if ARGS.no_high_speed else None)
+    print(f"Virtual chip '{chip.get_name()}' is listening on {chip.get_port()}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    chip.close()
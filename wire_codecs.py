@@ -0,0 +1,133 @@
+"""Module to contain the codecs used to encode request bodies on the wire"""
+import json
+from abc import ABC, abstractmethod
+from typing import Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+
+class WireCodec(ABC):
+    """Class to implement a codec prototype for request bodies"""
+
+    # Name of the codec as reported by the clients
+    name: str = ""
+
+    # Whether the encoded data may contain any byte, text based transports cannot carry those
+    binary: bool = False
+
+    @abstractmethod
+    def encode(self, body: dict) -> bytes:
+        """Encodes the body of a request"""
+
+    @abstractmethod
+    def decode(self, data: bytes) -> dict:
+        """Decodes the body of a request"""
+
+    @staticmethod
+    def matches(data: bytes) -> bool:
+        """Checks whether the data looks like it was encoded with this codec"""
+        return False
+
+
+class JsonCodec(WireCodec):
+    """JSON codec, uses orjson if it is installed"""
+
+    name = "json"
+
+    def encode(self, body: dict) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(body, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(body).encode()
+
+    def decode(self, data: bytes) -> dict:
+        if orjson is not None:
+            return orjson.loads(data)
+        return json.loads(data)
+
+    @staticmethod
+    def matches(data: bytes) -> bool:
+        return data.lstrip()[:1] == b"{"
+
+
+class MsgpackCodec(WireCodec):
+    """MessagePack codec, needs the 'msgpack' package"""
+
+    name = "msgpack"
+    binary = True
+
+    def encode(self, body: dict) -> bytes:
+        return msgpack.packb(body)
+
+    def decode(self, data: bytes) -> dict:
+        return msgpack.unpackb(data)
+
+    @staticmethod
+    def matches(data: bytes) -> bool:
+        # fixmap, map 16 or map 32
+        return bool(data) and (0x80 <= data[0] <= 0x8f or data[0] in (0xde, 0xdf))
+
+
+class CborCodec(WireCodec):
+    """CBOR codec, needs the 'cbor2' package"""
+
+    name = "cbor"
+    binary = True
+
+    def encode(self, body: dict) -> bytes:
+        return cbor2.dumps(body)
+
+    def decode(self, data: bytes) -> dict:
+        return cbor2.loads(data)
+
+    @staticmethod
+    def matches(data: bytes) -> bool:
+        # map with inline, 1/2/4/8 byte or indefinite length
+        return bool(data) and (0xa0 <= data[0] <= 0xbb or data[0] == 0xbf)
+
+
+JSON_CODEC = JsonCodec()
+
+# Available codecs, the preferred ones first
+CODECS: [WireCodec] = [codec for codec, module in [(MsgpackCodec(), msgpack),
+                                                   (CborCodec(), cbor2),
+                                                   (JSON_CODEC, json)] if module is not None]
+
+
+def get_codec(name: str) -> Optional[WireCodec]:
+    """Returns the codec with the passed name if it is available"""
+
+    for codec in CODECS:
+        if codec.name == name:
+            return codec
+    return None
+
+
+def select_codec(client_codecs: [str], allow_binary: bool = True) -> WireCodec:
+    """Selects the preferred available codec the client supports, JSON if there is none"""
+
+    for codec in CODECS:
+        if codec.name in client_codecs and (allow_binary or not codec.binary):
+            return codec
+    return JSON_CODEC
+
+
+def detect_codec(data: bytes) -> Optional[WireCodec]:
+    """Returns the available codec the data was most likely encoded with"""
+
+    for codec in CODECS:
+        if codec.matches(data):
+            return codec
+    return None